@@ -1,13 +1,24 @@
 """
 Configuración de la aplicación CardDemo API
 """
-from pydantic_settings import BaseSettings
-from typing import Optional
+import os
+import json
+from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import List, Optional
 
 
 class Settings(BaseSettings):
     """Configuración de la aplicación usando Pydantic Settings"""
     
+    # En AWS Lambda la configuración llega solo por variables de entorno,
+    # así que no se busca ni se parsea ningún archivo .env en el cold start
+    model_config = SettingsConfigDict(
+        env_file=None if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else ".env",
+        case_sensitive=False,
+        frozen=True
+    )
+    
     # Información de la aplicación
     app_name: str = "CardDemo API"
     app_version: str = "1.0.0"
@@ -15,6 +26,12 @@ class Settings(BaseSettings):
     
     # Base de datos
     database_url: str = "sqlite:///./carddemo.db"
+    db_pool_size: int = 20
+    db_max_overflow: int = 30
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 1800
+    db_max_retries: int = 5
+    db_base_delay: float = 0.1
     
     # JWT Configuration
     secret_key: str = "your-secret-key-here-change-in-production"
@@ -23,14 +40,86 @@ class Settings(BaseSettings):
     
     # Configuración de seguridad
     bcrypt_rounds: int = 12
+    # Máximo de operaciones bcrypt simultáneas por proceso (0 = núcleos de CPU)
+    bcrypt_max_concurrency: int = 0
+    # Segundos que se reutiliza el usuario resuelto de un token (0 desactiva)
+    user_cache_ttl_seconds: int = 60
+    user_cache_max_size: int = 10_000
+    # Reutilizar durante unos segundos el payload de un JWT ya verificado
+    jwt_cache_enabled: bool = True
+    jwt_cache_ttl_seconds: int = 5
+    # Segundos que se recuerda una verificación de contraseña correcta, para
+    # no repetir bcrypt en logins seguidos (0 desactiva)
+    password_cache_ttl_seconds: int = 30
     
     # Rate limiting
     rate_limit_per_minute: int = 60
+    # Ventanas deslizantes exactas (un timestamp por request) en lugar de
+    # token bucket y ventanas aproximadas; solo con contadores locales
+    rate_limit_strict: bool = False
+    # Redis para compartir los contadores de rate limit entre workers (opcional)
+    redis_url: Optional[str] = None
+    # TTL de la caché de respuestas de lectura (solo activa con redis_url)
+    response_cache_ttl_seconds: int = 60
+    # Segundos que se reutiliza la comprobación de BD de los health checks
+    health_cache_ttl_seconds: float = 5.0
+    
+    # CORS: orígenes, métodos y cabeceras explícitos (sin comodines)
+    cors_origins: List[str] = ["http://localhost:3000", "http://localhost:5173"]
+    cors_allow_methods: List[str] = ["GET", "POST", "PUT", "DELETE", "PATCH"]
+    cors_allow_headers: List[str] = ["Authorization", "Content-Type", "X-Correlation-ID"]
+    
+    # ID de un secreto JSON de AWS Secrets Manager con valores sensibles
+    # (secret_key, encryption_key). Se consulta solo cuando se necesita un valor.
+    aws_secret_id: Optional[str] = None
+    
+    def get_secret(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """
+        Obtener un valor sensible, resolviéndolo en Secrets Manager bajo demanda
+        
+        La primera consulta descarga el secreto y queda cacheada para el resto
+        del proceso, así que la llamada de red no ocurre en el cold start.
+        
+        Args:
+            name: Clave dentro del secreto JSON
+            default: Valor a usar si no hay secreto configurado o no contiene la clave
+            
+        Returns:
+            Valor del secreto o el valor por defecto
+        """
+        if not self.aws_secret_id:
+            return default
+        return _load_secret_values(self.aws_secret_id).get(name, default)
+
+
+@lru_cache(maxsize=None)
+def _load_secret_values(secret_id: str) -> dict:
+    """
+    Descargar y parsear un secreto JSON de AWS Secrets Manager (una vez por proceso)
+    
+    Args:
+        secret_id: ID o ARN del secreto
+        
+    Returns:
+        Diccionario con los valores del secreto
+    """
+    # boto3 viene incluido en el runtime de Lambda; se importa solo si se usa
+    import boto3
+    
+    response = boto3.client("secretsmanager").get_secret_value(SecretId=secret_id)
+    return json.loads(response["SecretString"])
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Obtener configuración de la aplicación (se construye y valida una sola vez)
     
-    class Config:
-        env_file = ".env"
-        case_sensitive = False
+    Returns:
+        Instancia inmutable de Settings
+    """
+    return Settings()
 
 
 # Instancia global de configuración
-settings = Settings()
\ No newline at end of file
+settings = get_settings()
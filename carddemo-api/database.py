@@ -2,9 +2,14 @@
 Configuración de base de datos para CardDemo API
 """
 from sqlmodel import SQLModel, create_engine, Session
+from sqlalchemy import event, exists, func, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from config import settings
 from services.logging_service import get_secure_logger, get_db_error_handler
 import time
+import random
 from typing import Generator, Optional, Any, Callable
 from contextlib import contextmanager
 from functools import wraps
@@ -12,113 +17,164 @@ from functools import wraps
 # Configurar logging seguro
 logger = get_secure_logger("database")
 
+_is_sqlite = settings.database_url.startswith("sqlite")
+
+# Argumentos de conexión específicos del driver
+connect_args = {"check_same_thread": False, "timeout": 30} if _is_sqlite else {}  # Necesario para SQLite
+
+# Pool de conexiones explícito dimensionado para la concurrencia de los workers
+# (SQLite en memoria no admite QueuePool: cada conexión sería una BD distinta)
+pool_args = {} if ":memory:" in settings.database_url else {
+    "poolclass": QueuePool,
+    "pool_size": settings.db_pool_size,
+    "max_overflow": settings.db_max_overflow,
+    "pool_timeout": settings.db_pool_timeout,
+    "pool_recycle": settings.db_pool_recycle,
+}
+
 # Crear engine de base de datos
 engine = create_engine(
     settings.database_url,
     echo=settings.debug,  # Log SQL queries en modo debug
-    connect_args={"check_same_thread": False}  # Necesario para SQLite
+    connect_args=connect_args,
+    pool_pre_ping=True,  # Verificar la conexión al sacarla del pool
+    **pool_args
+)
+
+
+# PRAGMAs de SQLite aplicados una vez por conexión física:
+# WAL permite lectores concurrentes durante escrituras, synchronous=NORMAL
+# reduce los fsync (seguro con WAL), y caché/mmap/temp_store en memoria
+# evitan lecturas de disco; foreign_keys activa la integridad referencial
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
 )
 
 
+if _is_sqlite:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Aplicar SQLITE_PRAGMAS a cada nueva conexión física del pool"""
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+# Fábrica de sesiones: una sesión nueva por petición o unidad de trabajo. No
+# se usa un registro por hilo (scoped_session): FastAPI ejecuta la entrada y
+# el cierre de las dependencias síncronas en hilos cualesquiera del
+# threadpool, así que dos peticiones podrían compartir la misma sesión.
+# expire_on_commit=False evita que los objetos se recarguen con un SELECT
+# tras cada commit
+SessionLocal = sessionmaker(bind=engine, class_=Session, expire_on_commit=False)
+
+
+def _backoff_delay(attempt: int) -> float:
+    """
+    Calcular espera antes del siguiente reintento (backoff exponencial con jitter)
+    
+    Args:
+        attempt: Número de intento fallido (empezando en 0)
+        
+    Returns:
+        Segundos a esperar
+    """
+    return settings.db_base_delay * (2 ** attempt) + random.uniform(0, 0.05)
+
+
+def _retry_or_raise(error: Exception, operation_name: str, attempt: int, **context) -> None:
+    """
+    Registrar un fallo y esperar antes de reintentar, o re-lanzar si no procede
+    
+    Debe llamarse desde un bloque except para que el re-lanzamiento conserve
+    la excepción original.
+    
+    Args:
+        error: Excepción capturada
+        operation_name: Nombre descriptivo de la operación
+        attempt: Número de intento fallido (empezando en 0)
+        **context: Contexto adicional para el log (sin datos sensibles)
+    """
+    error_info = get_db_error_handler().handle_database_error(
+        error,
+        operation_name,
+        retry_count=attempt,
+        **context
+    )
+    
+    if not error_info['recoverable'] or attempt + 1 >= settings.db_max_retries:
+        logger.error(f"Operación {operation_name} falló después de {attempt + 1} intentos")
+        raise error
+    
+    retry_delay = _backoff_delay(attempt)
+    logger.warning(f"Reintentando {operation_name} en {retry_delay:.2f} segundos...")
+    time.sleep(retry_delay)
+
+
 def create_db_and_tables():
     """Crear base de datos y todas las tablas con manejo de errores"""
-    error_handler = get_db_error_handler()
-    
-    while True:
+    for attempt in range(settings.db_max_retries):
         try:
             SQLModel.metadata.create_all(engine)
             logger.info("✅ Base de datos y tablas creadas exitosamente")
-            error_handler.reset_retry_count()
-            break
+            return
             
         except Exception as e:
-            error_info = error_handler.handle_database_error(
-                e, 
-                "create_db_and_tables",
-                operation_type="DDL"
-            )
-            
-            if error_handler.should_retry(e):
-                error_handler.increment_retry()
-                retry_delay = error_handler.retry_delay * error_handler.retry_count
-                logger.warning(f"Reintentando creación de BD en {retry_delay} segundos...")
-                time.sleep(retry_delay)
-                continue
-            else:
-                logger.critical("No se pudo crear la base de datos después de múltiples intentos")
-                raise
+            _retry_or_raise(e, "create_db_and_tables", attempt, operation_type="DDL")
+
+
+def get_session():
+    """
+    Obtener sesión de base de datos para dependency injection (FastAPI)
+    
+    La sesión no toma una conexión del pool hasta su primera consulta y la
+    devuelve en cada commit y al cerrarse. FastAPI ejecuta este cierre al
+    terminar el endpoint (síncrono, en el threadpool), antes de que los
+    middlewares procesen y envíen la respuesta, así que la conexión solo se
+    retiene mientras el endpoint trabaja con la base de datos.
+    """
+    with SessionLocal() as session:
+        yield session
 
 
 @contextmanager
 def get_db_session() -> Generator[Session, None, None]:
     """
-    Obtener sesión de base de datos con manejo robusto de errores
+    Obtener sesión de base de datos como context manager (uso fuera de FastAPI)
+    
+    Delimita una unidad de trabajo: hace commit al salir sin errores y
+    rollback si se produce una excepción, y libera la conexión en ambos
+    casos. Conviene abrirla solo alrededor del código que consulta la base de
+    datos.
+    
+    La conectividad la verifica el pool (``pool_pre_ping``) al entregar cada
+    conexión, por lo que no se ejecuta ninguna query de prueba adicional.
     
     Yields:
         Session: Sesión de base de datos
-        
-    Raises:
-        Exception: Si no se puede establecer conexión después de reintentos
     """
-    error_handler = get_db_error_handler()
-    session = None
-    
-    while True:
+    with SessionLocal() as session:
         try:
-            session = Session(engine)
-            
-            # Verificar conectividad con una query simple
-            from sqlmodel import text
-            session.execute(text("SELECT 1"))
-            
-            logger.debug("Sesión de base de datos establecida exitosamente")
-            error_handler.reset_retry_count()
-            
             yield session
-            break
-            
-        except Exception as e:
-            if session:
-                session.close()
-            
-            error_info = error_handler.handle_database_error(
-                e,
-                "get_db_session",
-                operation_type="connection"
-            )
-            
-            if error_handler.should_retry(e):
-                error_handler.increment_retry()
-                retry_delay = error_handler.retry_delay * error_handler.retry_count
-                logger.warning(f"Reintentando conexión a BD en {retry_delay} segundos...")
-                time.sleep(retry_delay)
-                continue
-            else:
-                logger.critical("No se pudo establecer conexión a BD después de múltiples intentos")
-                raise
-        
-        finally:
-            if session:
-                try:
-                    session.close()
-                    logger.debug("Sesión de base de datos cerrada")
-                except Exception as e:
-                    logger.error(f"Error cerrando sesión de BD: {e}")
-
-
-def get_session():
-    """Obtener sesión de base de datos para dependency injection (FastAPI)"""
-    session = Session(engine)
-    try:
-        yield session
-    finally:
-        session.close()
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
 
 
 def execute_with_retry(operation: Callable, operation_name: str, **kwargs) -> Any:
     """
     Ejecutar operación de base de datos con reintentos automáticos
     
+    El número de intentos está acotado por ``settings.db_max_retries`` y la
+    espera entre intentos crece exponencialmente.
+    
     Args:
         operation: Función a ejecutar
         operation_name: Nombre descriptivo de la operación
@@ -130,31 +186,14 @@ def execute_with_retry(operation: Callable, operation_name: str, **kwargs) -> An
     Raises:
         Exception: Si la operación falla después de todos los reintentos
     """
-    error_handler = get_db_error_handler()
-    
-    while True:
+    for attempt in range(settings.db_max_retries):
         try:
             result = operation(**kwargs)
-            error_handler.reset_retry_count()
             logger.debug(f"Operación {operation_name} ejecutada exitosamente")
             return result
             
         except Exception as e:
-            error_info = error_handler.handle_database_error(
-                e,
-                operation_name,
-                **kwargs
-            )
-            
-            if error_handler.should_retry(e):
-                error_handler.increment_retry()
-                retry_delay = error_handler.retry_delay * error_handler.retry_count
-                logger.warning(f"Reintentando {operation_name} en {retry_delay} segundos...")
-                time.sleep(retry_delay)
-                continue
-            else:
-                logger.error(f"Operación {operation_name} falló después de múltiples intentos")
-                raise
+            _retry_or_raise(e, operation_name, attempt, **kwargs)
 
 
 def database_operation(operation_name: str):
@@ -175,10 +214,14 @@ def database_operation(operation_name: str):
     return decorator
 
 
-def check_database_health() -> dict:
+def check_database_health(detailed: bool = False) -> dict:
     """
     Verificar salud de la base de datos
     
+    Args:
+        detailed: Si es True incluye el número de usuarios (requiere un COUNT
+            que recorre la tabla completa)
+    
     Returns:
         Dict con información de salud de la BD
     """
@@ -191,17 +234,25 @@ def check_database_health() -> dict:
     }
     
     try:
-        with get_db_session() as session:
-            # Verificar conexión
-            from sqlmodel import text
-            session.execute(text("SELECT 1"))
+        with engine.connect() as connection:
+            # Una sola ida y vuelta: leer como mucho una fila de users prueba
+            # a la vez la conexión y que las tablas principales existen
+            try:
+                connection.execute(text("SELECT 1 FROM users LIMIT 1")).first()
+            except DBAPIError:
+                # Solo al fallar se distingue BD caída de tablas ausentes
+                connection.rollback()
+                connection.execute(text("SELECT 1"))
+                health_info['connection'] = True
+                raise
             health_info['connection'] = True
-            
-            # Verificar que las tablas principales existen
-            from models.database_models import User
-            user_count = session.query(User).count()
             health_info['tables_exist'] = True
-            health_info['user_count'] = user_count
+            
+            if detailed:
+                from models.database_models import User
+                health_info['user_count'] = connection.execute(
+                    select(func.count()).select_from(User)
+                ).scalar_one()
             
             health_info['status'] = 'healthy'
             logger.debug("Verificación de salud de BD exitosa")
@@ -219,6 +270,7 @@ def init_database():
     """Inicializar base de datos con datos de prueba"""
     from models.database_models import User, Account, CreditCard, Transaction
     from services.auth_service import AuthService
+    from concurrent.futures import ThreadPoolExecutor
     from datetime import datetime, date
     from decimal import Decimal
     
@@ -226,37 +278,39 @@ def init_database():
     
     with get_db_session() as session:
         # Verificar si ya hay datos
-        existing_user = session.query(User).first()
-        if existing_user:
+        if session.execute(select(exists().select_from(User))).scalar():
             logger.info("ℹ️  Base de datos ya tiene datos, saltando inicialización")
             return
         
         logger.info("📝 Inicializando base de datos con datos de prueba...")
         
+        # Todos los datos se insertan en una única transacción; flush() asigna
+        # los IDs necesarios para las claves foráneas sin hacer commit intermedio
+        
         # Crear usuarios de prueba
         auth_service = AuthService()
         
+        # bcrypt libera el GIL: ambos hashes se calculan en paralelo
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            admin_hash, regular_hash = executor.map(auth_service.hash_password, ["PASSWORD", "PASSWORD"])
+        
         # Usuario administrador
         admin_user = User(
             username="ADMIN001",
             email="admin@carddemo.com",
-            hashed_password=auth_service.hash_password("PASSWORD"),
+            hashed_password=admin_hash,
             is_active=True
         )
-        session.add(admin_user)
-        session.commit()
-        session.refresh(admin_user)
         
         # Usuario regular
         regular_user = User(
             username="USER0001",
             email="user@carddemo.com",
-            hashed_password=auth_service.hash_password("PASSWORD"),
+            hashed_password=regular_hash,
             is_active=True
         )
-        session.add(regular_user)
-        session.commit()
-        session.refresh(regular_user)
+        session.add_all([admin_user, regular_user])
+        session.flush()
         
         # Crear cuentas
         admin_account = Account(
@@ -270,7 +324,6 @@ def init_database():
             state="AC",
             zip_code="12345"
         )
-        session.add(admin_account)
         
         user_account = Account(
             user_id=regular_user.id,
@@ -283,10 +336,8 @@ def init_database():
             state="UC",
             zip_code="67890"
         )
-        session.add(user_account)
-        session.commit()
-        session.refresh(admin_account)
-        session.refresh(user_account)
+        session.add_all([admin_account, user_account])
+        session.flush()
         
         # Crear tarjetas de crédito
         admin_card = CreditCard(
@@ -299,7 +350,6 @@ def init_database():
             credit_limit=Decimal("10000.00"),
             available_credit=Decimal("8500.00")
         )
-        session.add(admin_card)
         
         user_card1 = CreditCard(
             account_id=user_account.id,
@@ -311,7 +361,6 @@ def init_database():
             credit_limit=Decimal("5000.00"),
             available_credit=Decimal("4200.00")
         )
-        session.add(user_card1)
         
         user_card2 = CreditCard(
             account_id=user_account.id,
@@ -323,11 +372,8 @@ def init_database():
             credit_limit=Decimal("7500.00"),
             available_credit=Decimal("7500.00")
         )
-        session.add(user_card2)
-        session.commit()
-        session.refresh(admin_card)
-        session.refresh(user_card1)
-        session.refresh(user_card2)
+        session.add_all([admin_card, user_card1, user_card2])
+        session.flush()
         
         # Crear transacciones de ejemplo
         transactions = [
@@ -378,9 +424,7 @@ def init_database():
             )
         ]
         
-        for transaction in transactions:
-            session.add(transaction)
-        
+        session.add_all(transactions)
         session.commit()
         logger.info("✅ Datos de prueba inicializados exitosamente")
         logger.info("👤 Usuarios creados: ADMIN001/PASSWORD, USER0001/PASSWORD")
\ No newline at end of file
@@ -5,6 +5,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlmodel import Session
 from typing import Optional
+from functools import lru_cache
 
 from database import get_session
 from services.auth_service import AuthService
@@ -15,8 +16,9 @@ from models.database_models import User
 security = HTTPBearer()
 
 
+@lru_cache(maxsize=1)
 def get_auth_service() -> AuthService:
-    """Dependency para obtener servicio de autenticación"""
+    """Dependency para obtener servicio de autenticación (instancia única por proceso)"""
     return AuthService()
 
 
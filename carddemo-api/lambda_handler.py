@@ -6,5 +6,6 @@ from mangum import Mangum
 from main import app
 
 # Mangum convierte las peticiones de API Gateway a formato ASGI
-# y las respuestas ASGI a formato API Gateway
-handler = Mangum(app, lifespan="off")
+# y las respuestas ASGI a formato API Gateway. Con lifespan="auto" el
+# evento de arranque se ejecuta una sola vez por contenedor (cold start)
+handler = Mangum(app, lifespan="auto")
@@ -2,38 +2,60 @@
 CardDemo API - Aplicación principal FastAPI
 Migración de la aplicación mainframe CardDemo COBOL a API REST moderna
 """
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from config import settings
-from routers import auth
+from routers import auth, accounts, cards, transactions, health
 from middleware import ErrorHandlerMiddleware, RateLimitMiddleware, InputSanitizerMiddleware, setup_logging, setup_exception_handlers
 from database import init_database
 
 # Configurar logging
 setup_logging()
 
-# Inicializar base de datos
-init_database()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Ciclo de vida de la aplicación: inicializa la base de datos una vez por proceso
+    
+    En AWS Lambda (AWS_LAMBDA_FUNCTION_NAME definido) la base de datos ya está
+    provisionada, así que se omite la inicialización para no penalizar el cold start.
+    """
+    if not os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+        init_database()
+    yield
+
 
 # Crear instancia de FastAPI
 app = FastAPI(
     title=settings.app_name,
     version=settings.app_version,
     description="API REST para gestión de tarjetas de crédito - Migración de CardDemo COBOL",
-    debug=settings.debug
+    debug=settings.debug,
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Agregar middleware de sanitización de entrada (debe ser el primero)
 app.add_middleware(InputSanitizerMiddleware)
 
 # Agregar middleware de rate limiting con configuración más permisiva para tests
-import os
 if os.getenv("TESTING"):
     # Configuración muy permisiva para tests
     app.add_middleware(RateLimitMiddleware, calls_per_minute=10000, calls_per_hour=100000, burst_limit=1000)
 else:
     # Configuración normal para producción
-    app.add_middleware(RateLimitMiddleware, calls_per_minute=60, calls_per_hour=1000, burst_limit=10)
+    app.add_middleware(
+        RateLimitMiddleware,
+        calls_per_minute=60,
+        calls_per_hour=1000,
+        burst_limit=10,
+        strict=settings.rate_limit_strict,
+        redis_url=settings.redis_url
+    )
 
 # Agregar middleware de manejo de errores
 app.add_middleware(ErrorHandlerMiddleware)
@@ -44,29 +66,18 @@ setup_exception_handlers(app)
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # En producción, especificar dominios específicos
+    allow_origins=settings.cors_origins,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=settings.cors_allow_methods,
+    allow_headers=settings.cors_allow_headers,
+    expose_headers=["X-Correlation-ID"],
 )
 
 # Incluir routers
 app.include_router(auth.router)
-
-# Importar y incluir router de cuentas
-from routers import accounts
 app.include_router(accounts.router)
-
-# Importar y incluir router de tarjetas
-from routers import cards
 app.include_router(cards.router)
-
-# Importar y incluir router de transacciones
-from routers import transactions
 app.include_router(transactions.router)
-
-# Importar y incluir router de salud
-from routers import health
 app.include_router(health.router)
 
 
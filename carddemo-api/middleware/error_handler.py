@@ -1,12 +1,12 @@
 """
 Middleware de manejo de errores global para CardDemo API
 """
-import uuid
+import os
+import time
 import logging
 from typing import Dict, Any, Optional
-from datetime import datetime, timezone
 from fastapi import Request, Response, HTTPException, FastAPI
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.middleware.base import BaseHTTPMiddleware
 from pydantic import ValidationError
@@ -16,6 +16,127 @@ from sqlalchemy.exc import SQLAlchemyError
 # Configurar logger
 logger = logging.getLogger("carddemo.errors")
 
+# Endpoints triviales de alto volumen (health checks del ALB) que no pasan
+# por la generación de correlation ID
+_FAST_PATHS = frozenset({"/", "/health"})
+
+# Nombre del método de logging para cada nivel, en minúscula y mayúscula,
+# para no normalizar el nivel con str.lower() en cada llamada
+_LOG_METHOD_NAMES = {}
+for _name in ("debug", "info", "warning", "error", "critical"):
+    _LOG_METHOD_NAMES[_name] = _LOG_METHOD_NAMES[_name.upper()] = _name
+del _name
+
+
+def _new_correlation_id() -> str:
+    """
+    Generar correlation ID aleatorio con el formato textual de un UUID
+    
+    Usa os.urandom directamente para evitar construir un objeto uuid.UUID
+    en cada request.
+    
+    Returns:
+        ID de 36 caracteres (8-4-4-4-12 dígitos hexadecimales)
+    """
+    h = os.urandom(16).hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _iso_now() -> str:
+    """
+    Obtener timestamp UTC actual en formato ISO 8601 sin crear objetos datetime
+    
+    Returns:
+        Timestamp con microsegundos, p. ej. "2024-01-15T10:30:00.123456Z"
+    """
+    now = time.time()
+    seconds = int(now)
+    return f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds))}.{int((now - seconds) * 1e6):06d}Z"
+
+
+def _log_context(request: Request, correlation_id: str, **fields) -> Dict[str, Any]:
+    """
+    Construir el contexto de log de una request (correlation ID, ruta y método)
+    
+    Args:
+        request: Request HTTP
+        correlation_id: ID de correlación
+        **fields: Campos adicionales específicos del evento
+        
+    Returns:
+        Diccionario para pasar como ``extra`` al logger
+    """
+    return {
+        "correlation_id": correlation_id,
+        "path": request.url.path,
+        "method": request.method,
+        **fields
+    }
+
+
+def _format_validation_errors(errors: list) -> list:
+    """
+    Formatear errores de validación de Pydantic
+    
+    Args:
+        errors: Lista de errores de Pydantic
+        
+    Returns:
+        Lista de errores formateados
+    """
+    return [
+        {
+            "field": " -> ".join(map(str, error["loc"])),
+            "message": error["msg"],
+            "type": error["type"]
+        }
+        for error in errors
+    ]
+
+
+def _error_response(
+    status_code: int,
+    error_code: str,
+    message: Any,
+    correlation_id: str,
+    request: Request,
+    details: Optional[list] = None
+) -> ORJSONResponse:
+    """
+    Crear respuesta de error estandarizada serializada con orjson
+    
+    Compartida por el middleware y los exception handlers para que todas las
+    respuestas de error tengan exactamente la misma forma.
+    
+    Args:
+        status_code: Código de estado HTTP
+        error_code: Código de error interno
+        message: Mensaje de error
+        correlation_id: ID de correlación
+        request: Request HTTP
+        details: Detalles adicionales del error
+        
+    Returns:
+        ORJSONResponse con formato de error estandarizado
+    """
+    error = {
+        "code": error_code,
+        "message": message,
+        "correlation_id": correlation_id,
+        "timestamp": _iso_now(),
+        "path": request.url.path,
+        "method": request.method
+    }
+    
+    if details:
+        error["details"] = details
+    
+    return ORJSONResponse(
+        status_code=status_code,
+        content={"error": error},
+        headers={"X-Correlation-ID": correlation_id}
+    )
+
 
 class ErrorHandlerMiddleware(BaseHTTPMiddleware):
     """Middleware para manejo global de errores"""
@@ -31,8 +152,12 @@ class ErrorHandlerMiddleware(BaseHTTPMiddleware):
         Returns:
             Response HTTP con manejo de errores estandarizado
         """
+        # Health checks del balanceador y raíz: sin correlation ID ni headers extra
+        if request.url.path in _FAST_PATHS:
+            return await call_next(request)
+        
         # Generar correlation ID único para esta request
-        correlation_id = str(uuid.uuid4())
+        correlation_id = _new_correlation_id()
         request.state.correlation_id = correlation_id
         
         try:
@@ -44,49 +169,32 @@ class ErrorHandlerMiddleware(BaseHTTPMiddleware):
             
             return response
             
-        except SQLAlchemyError as e:
-            # Error de base de datos
-            logger.error(
-                f"Database error - Correlation ID: {correlation_id}",
-                extra={
-                    "correlation_id": correlation_id,
-                    "path": request.url.path,
-                    "method": request.method,
-                    "error": str(e)
-                },
-                exc_info=True
-            )
-            
-            return self._create_error_response(
-                status_code=500,
-                error_code="DATABASE_ERROR",
-                message="Error interno del servidor - problema de base de datos",
-                correlation_id=correlation_id,
-                request=request
-            )
-            
         except Exception as e:
-            # Error genérico no manejado (excluyendo HTTPException que maneja FastAPI)
+            # HTTPException la maneja FastAPI con su exception handler
             if isinstance(e, HTTPException):
-                # Re-raise HTTPException para que FastAPI la maneje
-                raise e
-                
+                raise
+            
+            if isinstance(e, SQLAlchemyError):
+                # Error de base de datos
+                event = "Database error"
+                error_code = "DATABASE_ERROR"
+                message = "Error interno del servidor - problema de base de datos"
+            else:
+                # Error genérico no manejado
+                event = "Unhandled error"
+                error_code = "INTERNAL_SERVER_ERROR"
+                message = "Error interno del servidor"
+            
             logger.error(
-                f"Unhandled error - Correlation ID: {correlation_id}",
-                extra={
-                    "correlation_id": correlation_id,
-                    "path": request.url.path,
-                    "method": request.method,
-                    "error": str(e),
-                    "error_type": type(e).__name__
-                },
+                f"{event} - Correlation ID: {correlation_id}",
+                extra=_log_context(request, correlation_id, error=str(e), error_type=type(e).__name__),
                 exc_info=True
             )
             
             return self._create_error_response(
                 status_code=500,
-                error_code="INTERNAL_SERVER_ERROR",
-                message="Error interno del servidor",
+                error_code=error_code,
+                message=message,
                 correlation_id=correlation_id,
                 request=request
             )
@@ -99,7 +207,7 @@ class ErrorHandlerMiddleware(BaseHTTPMiddleware):
         correlation_id: str,
         request: Request,
         details: Optional[list] = None
-    ) -> JSONResponse:
+    ) -> ORJSONResponse:
         """
         Crear respuesta de error estandarizada
         
@@ -112,62 +220,55 @@ class ErrorHandlerMiddleware(BaseHTTPMiddleware):
             details: Detalles adicionales del error
             
         Returns:
-            JSONResponse con formato de error estandarizado
+            ORJSONResponse con formato de error estandarizado
         """
-        error_response = {
-            "error": {
-                "code": error_code,
-                "message": message,
-                "correlation_id": correlation_id,
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                "path": request.url.path,
-                "method": request.method
-            }
-        }
-        
-        if details:
-            error_response["error"]["details"] = details
-        
-        return JSONResponse(
-            status_code=status_code,
-            content=error_response,
-            headers={"X-Correlation-ID": correlation_id}
-        )
+        return _error_response(status_code, error_code, message, correlation_id, request, details)
+
+
+class CachedTimeFormatter(logging.Formatter):
+    """Formatter con hora UTC que calcula la parte de fecha/hora una sola vez por segundo"""
+    
+    converter = time.gmtime
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (segundo, texto formateado) se reemplaza de forma atómica
+        self._time_cache = (None, "")
     
-    def _format_validation_errors(self, errors: list) -> list:
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
         """
-        Formatear errores de validación de Pydantic
+        Formatear timestamp del record reutilizando el texto del segundo actual
         
         Args:
-            errors: Lista de errores de Pydantic
+            record: Record de logging
+            datefmt: Formato de fecha (si no se indica, el del formatter)
             
         Returns:
-            Lista de errores formateados
+            Timestamp formateado con milisegundos
         """
-        formatted_errors = []
-        
-        for error in errors:
-            field_path = " -> ".join(str(loc) for loc in error["loc"])
-            formatted_errors.append({
-                "field": field_path,
-                "message": error["msg"],
-                "type": error["type"]
-            })
-        
-        return formatted_errors
+        second = int(record.created)
+        cached_second, prefix = self._time_cache
+        if second != cached_second:
+            prefix = time.strftime(datefmt or self.datefmt or self.default_time_format, self.converter(second))
+            self._time_cache = (second, prefix)
+        return f"{prefix},{int(record.msecs):03d}"
 
 
 def setup_logging():
-    """Configurar logging para la aplicación"""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    
+    """Configurar logging para la aplicación (idempotente, p. ej. en warm starts de Lambda)"""
     # Configurar logger específico para errores
     error_logger = logging.getLogger("carddemo.errors")
     error_logger.setLevel(logging.INFO)
     
+    root_logger = logging.getLogger()
+    if root_logger.handlers:
+        return error_logger
+    
+    handler = logging.StreamHandler()
+    handler.setFormatter(CachedTimeFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root_logger.addHandler(handler)
+    root_logger.setLevel(logging.INFO)
+    
     # En producción, aquí se configurarían handlers específicos
     # como archivos de log, servicios de logging, etc.
     
@@ -185,77 +286,46 @@ def setup_exception_handlers(app: FastAPI):
     @app.exception_handler(HTTPException)
     async def http_exception_handler(request: Request, exc: HTTPException):
         """Handler para HTTPException"""
-        correlation_id = getattr(request.state, 'correlation_id', str(uuid.uuid4()))
-        
-        logger.warning(
-            f"HTTP Exception - Correlation ID: {correlation_id}",
-            extra={
-                "correlation_id": correlation_id,
-                "path": request.url.path,
-                "method": request.method,
-                "status_code": exc.status_code,
-                "detail": exc.detail
-            }
-        )
+        correlation_id = getattr(request.state, 'correlation_id', None) or _new_correlation_id()
         
-        error_response = {
-            "error": {
-                "code": "HTTP_EXCEPTION",
-                "message": exc.detail,
-                "correlation_id": correlation_id,
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                "path": request.url.path,
-                "method": request.method
-            }
-        }
+        # Los 4xx son frecuentes: no construir el contexto si el nivel está desactivado
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning(
+                f"HTTP Exception - Correlation ID: {correlation_id}",
+                extra=_log_context(request, correlation_id, status_code=exc.status_code, detail=exc.detail)
+            )
         
-        return JSONResponse(
+        return _error_response(
             status_code=exc.status_code,
-            content=error_response,
-            headers={"X-Correlation-ID": correlation_id}
+            error_code="HTTP_EXCEPTION",
+            message=exc.detail,
+            correlation_id=correlation_id,
+            request=request
         )
     
     @app.exception_handler(RequestValidationError)
     async def validation_exception_handler(request: Request, exc: RequestValidationError):
         """Handler para errores de validación de FastAPI"""
-        correlation_id = getattr(request.state, 'correlation_id', str(uuid.uuid4()))
+        correlation_id = getattr(request.state, 'correlation_id', None) or _new_correlation_id()
         
-        logger.warning(
-            f"Validation error - Correlation ID: {correlation_id}",
-            extra={
-                "correlation_id": correlation_id,
-                "path": request.url.path,
-                "method": request.method,
-                "validation_errors": exc.errors()
-            }
-        )
+        errors = exc.errors()
         
-        # Formatear errores de validación
-        formatted_errors = []
-        for error in exc.errors():
-            field_path = " -> ".join(str(loc) for loc in error["loc"])
-            formatted_errors.append({
-                "field": field_path,
-                "message": error["msg"],
-                "type": error["type"]
-            })
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning(
+                f"Validation error - Correlation ID: {correlation_id}",
+                extra=_log_context(request, correlation_id, validation_errors=errors)
+            )
         
-        error_response = {
-            "error": {
-                "code": "VALIDATION_ERROR",
-                "message": "Los datos proporcionados no son válidos",
-                "details": formatted_errors,
-                "correlation_id": correlation_id,
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                "path": request.url.path,
-                "method": request.method
-            }
-        }
+        # Formatear errores de validación
+        formatted_errors = _format_validation_errors(errors)
         
-        return JSONResponse(
+        return _error_response(
             status_code=422,
-            content=error_response,
-            headers={"X-Correlation-ID": correlation_id}
+            error_code="VALIDATION_ERROR",
+            message="Los datos proporcionados no son válidos",
+            correlation_id=correlation_id,
+            request=request,
+            details=formatted_errors
         )
 
 
@@ -295,5 +365,5 @@ def log_with_correlation(
     extra['correlation_id'] = correlation_id
     kwargs['extra'] = extra
     
-    log_method = getattr(logger, level.lower())
+    log_method = getattr(logger, _LOG_METHOD_NAMES.get(level) or level.lower())
     log_method(f"{message} - Correlation ID: {correlation_id}", **kwargs)
\ No newline at end of file
@@ -1,8 +1,8 @@
 """
 Middleware de sanitización de entrada para CardDemo API
 """
-import json
-from typing import Any, Dict
+import orjson
+from typing import Any, Dict, Iterator, List, Tuple, Union
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
 from services.encryption_service import get_encryption_service
@@ -10,6 +10,102 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# A partir de este tamaño el body se lee por chunks directamente a un único
+# buffer en lugar de acumular la lista de chunks y unirlos con join
+_STREAM_THRESHOLD = 64 * 1024
+
+
+# Recorrido de los datos JSON: iterativo con una pila explícita, sin un frame
+# de Python por nodo ni riesgo de RecursionError con anidamientos profundos.
+# Los datos parseados son siempre dict/list/str/int/float/bool/None exactos,
+# así que se comparan tipos exactos; el resto de valores se devuelve tal cual
+
+def _collect_strings(data: Any, strings: List[str]) -> None:
+    """
+    Recoger los strings de la estructura en orden de recorrido
+    
+    El orden es el de un recorrido en profundidad en preorden (en los dict,
+    la clave antes que su valor), el mismo en que ``_rebuild`` los consume.
+    
+    Args:
+        data: Datos a recorrer
+        strings: Lista donde se acumulan claves y valores string
+    """
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        node_type = type(node)
+        if node_type is str:
+            strings.append(node)
+        elif node_type is dict:
+            # Se apilan en orden inverso para desapilarlos en el original
+            for key, value in reversed(node.items()):
+                stack.append(value)
+                if type(key) is str:
+                    stack.append(key)
+        elif node_type is list:
+            stack.extend(reversed(node))
+
+
+def _rebuild(data: Any, sanitized: Iterator[str]) -> Any:
+    """
+    Reconstruir la estructura sustituyendo los strings por los sanitizados
+    
+    Args:
+        data: Datos originales
+        sanitized: Strings sanitizados en el mismo orden que ``_collect_strings``
+        
+    Returns:
+        Datos sanitizados
+    """
+    data_type = type(data)
+    if data_type is str:
+        return next(sanitized)
+    if data_type is not dict and data_type is not list:
+        return data
+    
+    root = _new_container(data_type)
+    # Cada entrada: (iterador de la estructura original, copia en construcción)
+    stack = [(_iter_entries(data), root)]
+    while stack:
+        entries, target = stack[-1]
+        for key, value in entries:
+            # La clave se sustituye antes de recorrer el valor, igual que al recoger
+            if type(key) is str:
+                key = next(sanitized)
+            
+            value_type = type(value)
+            if value_type is str:
+                value = next(sanitized)
+            elif value_type is dict or value_type is list:
+                child = _new_container(value_type)
+                _store(target, key, child)
+                stack.append((_iter_entries(value), child))
+                break
+            _store(target, key, value)
+        else:
+            stack.pop()
+    
+    return root
+
+
+def _new_container(container_type: type) -> Any:
+    return {} if container_type is dict else []
+
+
+def _iter_entries(container: Any) -> Iterator[Tuple[Any, Any]]:
+    # En las listas la "clave" es None para no confundirla con un string
+    if type(container) is dict:
+        return iter(container.items())
+    return ((None, item) for item in container)
+
+
+def _store(target: Any, key: Any, value: Any) -> None:
+    if type(target) is dict:
+        target[key] = value
+    else:
+        target.append(value)
+
 
 class InputSanitizerMiddleware(BaseHTTPMiddleware):
     """Middleware para sanitizar entrada de datos"""
@@ -29,30 +125,34 @@ class InputSanitizerMiddleware(BaseHTTPMiddleware):
         Returns:
             Response HTTP con datos sanitizados
         """
-        # Solo sanitizar requests con body (POST, PUT, PATCH)
-        if request.method in ["POST", "PUT", "PATCH"]:
+        # Solo sanitizar requests con body JSON (POST, PUT, PATCH); otros
+        # content types (p. ej. multipart) nunca parsearían como JSON
+        if request.method in ["POST", "PUT", "PATCH"] and self._has_json_body(request):
             # Leer body original
-            body = await request.body()
+            body = await self._read_body(request)
             
             if body:
                 try:
-                    # Intentar parsear como JSON
-                    data = json.loads(body.decode())
+                    # Intentar parsear como JSON (orjson acepta bytes directamente)
+                    data = orjson.loads(body)
                     
                     # Sanitizar datos recursivamente
-                    sanitized_data = self._sanitize_data(data)
-                    
-                    # Reemplazar body con datos sanitizados
-                    sanitized_body = json.dumps(sanitized_data).encode()
+                    sanitized_data, changed = self._sanitize_with_changes(data)
                     
-                    # Crear nuevo request con body sanitizado
-                    request._body = sanitized_body
+                    # Reemplazar body solo si la sanitización modificó algo;
+                    # si no, se conservan los bytes originales sin re-serializar
+                    if changed:
+                        request._body = orjson.dumps(sanitized_data)
                     
-                except (json.JSONDecodeError, UnicodeDecodeError) as e:
-                    # Si no es JSON válido, continuar sin sanitizar
+                except orjson.JSONDecodeError as e:
+                    # Si el JSON declarado no es válido, continuar sin sanitizar
                     logger.warning(f"Could not parse request body as JSON: {e}")
                 except Exception as e:
                     logger.error(f"Error sanitizing request data: {e}")
+            
+            # Body leído por stream y no reemplazado: entregarlo intacto
+            if not hasattr(request, "_body"):
+                request._body = bytes(body)
         
         # Sanitizar query parameters
         if request.query_params:
@@ -71,6 +171,47 @@ class InputSanitizerMiddleware(BaseHTTPMiddleware):
         response = await call_next(request)
         return response
     
+    @staticmethod
+    def _has_json_body(request: Request) -> bool:
+        """
+        Indicar si el request declara un body JSON no vacío
+        
+        Args:
+            request: Request HTTP
+            
+        Returns:
+            True si el Content-Type es JSON y el Content-Length no es 0
+        """
+        headers = request.headers
+        if not headers.get("content-type", "").startswith("application/json"):
+            return False
+        return headers.get("content-length") != "0"
+    
+    async def _read_body(self, request: Request) -> Union[bytes, bytearray]:
+        """
+        Leer el body del request
+        
+        Los bodies pequeños usan ``request.body()``. Los que superan
+        ``_STREAM_THRESHOLD`` se consumen con ``request.stream()`` sobre un
+        único ``bytearray`` (orjson parsea bytearray sin copiarlo), evitando
+        mantener a la vez la lista de chunks y el resultado del join. En ese
+        caso es ``dispatch`` quien deja el body en ``request._body``.
+        
+        Args:
+            request: Request HTTP
+            
+        Returns:
+            Body completo como bytes o bytearray
+        """
+        content_length = request.headers.get("content-length", "")
+        if not content_length.isdigit() or int(content_length) <= _STREAM_THRESHOLD:
+            return await request.body()
+        
+        buffer = bytearray()
+        async for chunk in request.stream():
+            buffer += chunk
+        return buffer
+    
     def _sanitize_data(self, data: Any) -> Any:
         """
         Sanitizar datos recursivamente
@@ -81,25 +222,29 @@ class InputSanitizerMiddleware(BaseHTTPMiddleware):
         Returns:
             Datos sanitizados
         """
-        if isinstance(data, dict):
-            # Sanitizar diccionario recursivamente
-            sanitized = {}
-            for key, value in data.items():
-                # Sanitizar clave
-                sanitized_key = self.encryption_service.sanitize_input(str(key)) if isinstance(key, str) else key
-                # Sanitizar valor recursivamente
-                sanitized_value = self._sanitize_data(value)
-                sanitized[sanitized_key] = sanitized_value
-            return sanitized
-            
-        elif isinstance(data, list):
-            # Sanitizar lista recursivamente
-            return [self._sanitize_data(item) for item in data]
-            
-        elif isinstance(data, str):
-            # Sanitizar string
-            return self.encryption_service.sanitize_input(data)
+        return self._sanitize_with_changes(data)[0]
+    
+    def _sanitize_with_changes(self, data: Any) -> Tuple[Any, bool]:
+        """
+        Sanitizar datos recursivamente indicando si se modificó algún string
+        
+        Todos los strings (claves y valores) se recogen en una lista y se
+        sanitizan en una sola llamada a ``sanitize_batch``; después se
+        reconstruye la estructura solo si algún string cambió.
+        
+        Args:
+            data: Datos a sanitizar
             
-        else:
-            # Otros tipos (int, float, bool, None) no necesitan sanitización
-            return data
\ No newline at end of file
+        Returns:
+            Tupla (datos sanitizados, True si algún valor o clave cambió)
+        """
+        strings: List[str] = []
+        _collect_strings(data, strings)
+        if not strings:
+            return data, False
+        
+        sanitized = self.encryption_service.sanitize_batch(strings)
+        if sanitized == strings:
+            return data, False
+        
+        return _rebuild(data, iter(sanitized)), True
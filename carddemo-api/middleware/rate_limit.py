@@ -1,154 +1,488 @@
 """
 Middleware de rate limiting para CardDemo API
 """
+import heapq
+import sys
 import time
-from typing import Dict, Optional
-from collections import defaultdict, deque
-from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import JSONResponse
+from array import array
+from typing import Dict, List, Optional, Tuple
+from fastapi import Request
+from fastapi.responses import ORJSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Prefijos de endpoints sensibles con límite más estricto; str.startswith
+# con una tupla los compara todos en C sin regex ni caché
+_SENSITIVE_PREFIXES = ('/auth/login', '/auth/logout', '/auth/me')
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """Middleware para implementar rate limiting por IP y endpoint"""
+# Los timestamps locales son enteros de time.monotonic_ns(): aritmética
+# entera y un reloj que no retrocede con los ajustes de NTP. Duración de
+# las ventanas de ráfaga, minuto y hora en nanosegundos
+_NS = 1_000_000_000
+_BURST_NS = 10 * _NS
+_MINUTE_NS = 60 * _NS
+_HOUR_NS = 3600 * _NS
+
+# Tiempo máximo de espera de Redis: cada request espera sus contadores, así
+# que un Redis lento o inalcanzable no debe frenar la API
+_REDIS_TIMEOUT_SECONDS = 0.05
+# Tras un fallo de Redis se usan los contadores locales durante este tiempo
+# antes de volver a intentarlo
+_REDIS_RETRY_BACKOFF_SECONDS = 5.0
+
+
+# Ventanas fijas compartidas en Redis: incrementa los contadores de ráfaga,
+# minuto y hora de forma atómica y fija su expiración al crearlos, de modo
+# que no hace falta ninguna limpieza (las claves caducan solas)
+_REDIS_WINDOW_SCRIPT = """
+local counts = {}
+for i, key in ipairs(KEYS) do
+    local n = redis.call('INCR', key)
+    if n == 1 then
+        redis.call('PEXPIRE', key, ARGV[i])
+    end
+    counts[i] = n
+end
+return counts
+"""
+
+
+# Último segundo para el que se calculó el header X-RateLimit-Reset y su
+# valor; es igual para todas las instancias y cambia como mucho una vez
+# por segundo, así que no se formatea en cada respuesta
+_CACHED_RESET: List = [-1, ""]
+
+
+class _TimestampRing:
+    """
+    Buffer circular de timestamps (int64) con capacidad igual al límite
+    
+    Para decidir si una ventana deslizante está llena basta con conservar
+    los últimos ``capacity`` timestamps, así que la memoria por IP queda
+    acotada por el límite y cada entrada ocupa 8 bytes en un ``array('q')``
+    en lugar de un objeto int dentro de un deque. El buffer crece bajo
+    demanda hasta la capacidad, de modo que una IP con pocos requests no
+    reserva el máximo.
+    """
+    
+    __slots__ = ('_buf', '_capacity', '_head', '_size')
+    
+    def __init__(self, capacity: int):
+        self._buf = array('q')
+        self._capacity = capacity
+        self._head = 0
+        self._size = 0
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def append(self, timestamp: int):
+        """Registrar un timestamp (descarta el más antiguo si está lleno)"""
+        buf = self._buf
+        if self._size < len(buf):
+            buf[(self._head + self._size) % len(buf)] = timestamp
+            self._size += 1
+        elif len(buf) < self._capacity:
+            # Crecer: se rota para que el más antiguo quede al principio
+            if self._head:
+                self._buf = buf = buf[self._head:] + buf[:self._head]
+                self._head = 0
+            buf.append(timestamp)
+            self._size += 1
+        elif buf:
+            buf[self._head] = timestamp
+            self._head = (self._head + 1) % len(buf)
+    
+    def expire(self, threshold: int):
+        """Descartar los timestamps anteriores a ``threshold``"""
+        buf = self._buf
+        while self._size and buf[self._head] < threshold:
+            self._head = (self._head + 1) % len(buf)
+            self._size -= 1
+    
+    def last(self) -> Optional[int]:
+        """Timestamp más reciente, o None si está vacío"""
+        if not self._size:
+            return None
+        return self._buf[(self._head + self._size - 1) % len(self._buf)]
+
+
+class RateLimitMiddleware:
+    """
+    Middleware para implementar rate limiting por IP y endpoint
+    
+    Es un middleware ASGI puro: la decisión solo necesita el scope (ruta y
+    headers), así que no pasa por BaseHTTPMiddleware, que añade una tarea y
+    un stream intermedio por request. Los headers informativos se inyectan
+    en el mensaje ``http.response.start`` sin tocar el body.
+    """
     
     def __init__(
         self,
-        app,
+        app: ASGIApp,
         calls_per_minute: int = 60,
         calls_per_hour: int = 1000,
         burst_limit: int = 10,
-        cleanup_interval: int = 300  # 5 minutos
+        strict: bool = False,
+        redis_url: Optional[str] = None
     ):
         """
         Inicializar middleware de rate limiting
         
         Args:
-            app: Aplicación FastAPI
+            app: Aplicación ASGI siguiente
             calls_per_minute: Límite de llamadas por minuto por IP
             calls_per_hour: Límite de llamadas por hora por IP
             burst_limit: Límite de ráfaga (llamadas consecutivas rápidas)
-            cleanup_interval: Intervalo de limpieza de datos antiguos en segundos
+            strict: Usar ventanas deslizantes exactas (un timestamp por request)
+                en lugar de token bucket y ventanas aproximadas
+            redis_url: URL de Redis para compartir los contadores entre workers;
+                si no está disponible se usan los contadores locales
         """
-        super().__init__(app)
+        self.app = app
         self.calls_per_minute = calls_per_minute
         self.calls_per_hour = calls_per_hour
         self.burst_limit = burst_limit
-        self.cleanup_interval = cleanup_interval
+        self.strict = strict
+        
+        # Valores fijos de los headers informativos
+        self._limit_minute_str = str(calls_per_minute)
+        self._limit_hour_str = str(calls_per_hour)
+        
+        # Capacidad y duración (segundos) de cada ventana: ráfaga, minuto, hora
+        # (las claves de Redis se indexan con la hora de reloj, común a todos
+        # los workers)
+        self._windows: Tuple[Tuple[int, float], ...] = (
+            (burst_limit, 10.0),
+            (calls_per_minute, 60.0),
+            (calls_per_hour, 3600.0),
+        )
         
-        # Almacenamiento en memoria para tracking de requests
+        # Estado por IP con memoria constante:
+        # [burst_tokens, burst_ts,
+        #  minute_prev, minute_curr, minute_window,
+        #  hour_prev, hour_curr, hour_window]
+        # La ráfaga es un token bucket que se recarga con el tiempo; minuto y
+        # hora usan la ventana deslizante aproximada de dos contadores (el de la
+        # ventana fija anterior ponderado por la parte que aún se solapa)
         # En producción, esto debería usar Redis o similar
-        self.minute_requests: Dict[str, deque] = defaultdict(deque)
-        self.hour_requests: Dict[str, deque] = defaultdict(deque)
-        self.burst_requests: Dict[str, deque] = defaultdict(deque)
-        
-        # Timestamp de última limpieza
-        self.last_cleanup = time.time()
+        self.buckets: Dict[str, List[float]] = {}
+        
+        # Modo estricto: ventanas deslizantes exactas con un timestamp por request
+        # (un diccionario por ventana, indexado directamente por IP, con un
+        # buffer circular acotado por el límite de la ventana)
+        self.minute_requests: Dict[str, _TimestampRing] = {}
+        self.hour_requests: Dict[str, _TimestampRing] = {}
+        self.burst_requests: Dict[str, _TimestampRing] = {}
+        
+        # Min-heap de (expiración, IP): la limpieza solo toca las IPs cuyo
+        # estado puede haber caducado, sin recorrer las IPs activas
+        self._expirations: List[Tuple[int, str]] = []
+        # Tras este tiempo de inactividad el estado de una IP equivale a uno
+        # nuevo y se puede eliminar sin perder información
+        self._retention = (3600 if strict else 7200) * _NS
+        
+        # Contadores compartidos en Redis (opcional)
+        self._redis_script = None
+        # Instante (time.monotonic) hasta el que no se vuelve a probar Redis
+        self._redis_retry_at = 0.0
+        if redis_url:
+            try:
+                import redis.asyncio as aioredis
+            except ImportError:
+                logger.warning("Paquete redis no instalado; se usan contadores de rate limit locales")
+            else:
+                self._redis_script = aioredis.from_url(
+                    redis_url,
+                    socket_timeout=_REDIS_TIMEOUT_SECONDS,
+                    socket_connect_timeout=_REDIS_TIMEOUT_SECONDS
+                ).register_script(_REDIS_WINDOW_SCRIPT)
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
         """
         Procesar request y aplicar rate limiting
         
         Args:
-            request: Request HTTP
-            call_next: Siguiente middleware/handler
-            
-        Returns:
-            Response HTTP o error de rate limit
+            scope: Scope ASGI
+            receive: Canal de recepción ASGI
+            send: Canal de envío ASGI
         """
-        # Obtener IP del cliente
-        client_ip = self._get_client_ip(request)
-        
-        # Limpiar datos antiguos periódicamente
-        current_time = time.time()
-        if current_time - self.last_cleanup > self.cleanup_interval:
-            self._cleanup_old_requests(current_time)
-            self.last_cleanup = current_time
-        
-        # Verificar límites
-        if self._is_rate_limited(client_ip, request.url.path, current_time):
-            return self._create_rate_limit_response(client_ip, request)
-        
-        # Registrar request
-        self._record_request(client_ip, current_time)
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        # Obtener IP del cliente (internada: las búsquedas en los diccionarios
+        # de estado comparan por identidad) y dejarla disponible en request.state
+        state = scope.setdefault("state", {})
+        client_ip = state.get("client_ip")
+        if client_ip is None:
+            client_ip = sys.intern(self._get_client_ip(scope))
+            state["client_ip"] = client_ip
+        path = scope["path"]
+        current_time = time.monotonic_ns()
+        
+        # Con Redis los límites se comparten entre todos los workers
+        counts = None
+        if self._redis_script is not None:
+            counts = await self._get_redis_counts(client_ip, time.time())
+        
+        if counts is not None:
+            limited = self._exceeds_limits(counts, client_ip, path)
+        else:
+            # Limpiar estado de IPs inactivas cuando vence la primera expiración
+            if self._expirations and self._expirations[0][0] <= current_time:
+                self._cleanup_old_requests(current_time)
+            
+            # Verificar límites
+            limited = self._is_rate_limited(client_ip, path, current_time)
+        
+        if limited:
+            response = self._create_rate_limit_response(client_ip, Request(scope))
+            await response(scope, receive, send)
+            return
+        
+        # Registrar request (con Redis ya quedó registrado al contar)
+        if counts is None:
+            self._record_request(client_ip, current_time)
+        
+        async def send_with_headers(message: Message):
+            # Agregar headers de rate limit info a la respuesta
+            if message["type"] == "http.response.start":
+                self._add_rate_limit_headers(
+                    MutableHeaders(scope=message), client_ip, current_time, counts
+                )
+            await send(message)
         
         # Procesar request normalmente
-        response = await call_next(request)
-        
-        # Agregar headers de rate limit info
-        self._add_rate_limit_headers(response, client_ip, current_time)
-        
-        return response
+        await self.app(scope, receive, send_with_headers)
     
-    def _get_client_ip(self, request: Request) -> str:
+    def _get_client_ip(self, scope: Scope) -> str:
         """
         Obtener IP del cliente considerando proxies
         
         Args:
-            request: Request HTTP
+            scope: Scope ASGI del request
             
         Returns:
             IP del cliente
         """
+        headers = Headers(scope=scope)
+        
         # Verificar headers de proxy
-        forwarded_for = request.headers.get("X-Forwarded-For")
+        forwarded_for = headers.get("X-Forwarded-For")
         if forwarded_for:
             # Tomar la primera IP (cliente original)
             return forwarded_for.split(",")[0].strip()
         
-        real_ip = request.headers.get("X-Real-IP")
+        real_ip = headers.get("X-Real-IP")
         if real_ip:
             return real_ip
         
         # Fallback a IP directa
-        return request.client.host if request.client else "unknown"
+        client = scope.get("client")
+        return client[0] if client else "unknown"
     
-    def _is_rate_limited(self, client_ip: str, path: str, current_time: float) -> bool:
+    async def _get_redis_counts(self, client_ip: str, current_time: float) -> Optional[Tuple[int, int, int]]:
+        """
+        Registrar el request en Redis y obtener los contadores de cada ventana
+        
+        Args:
+            client_ip: IP del cliente
+            current_time: Hora actual de reloj (``time.time()``)
+            
+        Returns:
+            Contadores (ráfaga, minuto, hora) incluyendo este request,
+            o None si Redis no está disponible
+        """
+        # Tras un fallo reciente no se espera a Redis en cada request
+        if self._redis_retry_at and time.monotonic() < self._redis_retry_at:
+            return None
+        
+        keys = [
+            f"rl:{client_ip}:{name}:{int(current_time // window)}"
+            for name, (_, window) in zip(("burst", "minute", "hour"), self._windows)
+        ]
+        
+        try:
+            counts = await self._redis_script(keys=keys, args=[10000, 60000, 3600000])
+        except Exception as e:
+            self._redis_retry_at = time.monotonic() + _REDIS_RETRY_BACKOFF_SECONDS
+            logger.warning(
+                f"Redis no disponible para rate limiting, usando contadores locales "
+                f"durante {_REDIS_RETRY_BACKOFF_SECONDS:.0f}s: {e}"
+            )
+            return None
+        
+        self._redis_retry_at = 0.0
+        return tuple(counts)
+    
+    def _exceeds_limits(self, counts: Tuple[int, int, int], client_ip: str, path: str) -> bool:
+        """
+        Verificar límites a partir de los contadores de Redis
+        
+        Args:
+            counts: Contadores (ráfaga, minuto, hora) incluyendo este request
+            client_ip: IP del cliente
+            path: Ruta del endpoint
+            
+        Returns:
+            True si está limitado, False en caso contrario
+        """
+        burst_count, minute_count, hour_count = counts
+        
+        if burst_count > self.burst_limit:
+            logger.warning(f"Burst limit exceeded for IP {client_ip}")
+            return True
+        
+        if minute_count > self.calls_per_minute:
+            logger.warning(f"Per-minute limit exceeded for IP {client_ip}")
+            return True
+        
+        if hour_count > self.calls_per_hour:
+            logger.warning(f"Per-hour limit exceeded for IP {client_ip}")
+            return True
+        
+        if self._is_sensitive_endpoint(path):
+            auth_limit = min(10, self.calls_per_minute // 6)  # Máximo 10 por minuto
+            if minute_count > auth_limit:
+                logger.warning(f"Auth endpoint limit exceeded for IP {client_ip} on {path}")
+                return True
+        
+        return False
+    
+    def _is_rate_limited(self, client_ip: str, path: str, current_time: int) -> bool:
         """
         Verificar si el cliente ha excedido los límites
         
         Args:
             client_ip: IP del cliente
             path: Ruta del endpoint
-            current_time: Timestamp actual
+            current_time: Timestamp actual (``time.monotonic_ns()``)
             
         Returns:
             True si está limitado, False en caso contrario
         """
-        # Verificar límite de ráfaga (últimos 10 segundos)
-        burst_key = f"{client_ip}:burst"
-        burst_requests = self.burst_requests[burst_key]
+        if self.strict:
+            return self._is_rate_limited_strict(client_ip, path, current_time)
         
-        # Limpiar requests antiguos de ráfaga
-        while burst_requests and current_time - burst_requests[0] > 10:
-            burst_requests.popleft()
+        state = self._update_state(client_ip, current_time)
         
-        if len(burst_requests) >= self.burst_limit:
+        # Verificar límite de ráfaga (10 segundos)
+        if state[0] < 1:
             logger.warning(f"Burst limit exceeded for IP {client_ip}")
             return True
         
         # Verificar límite por minuto
-        minute_key = f"{client_ip}:minute"
-        minute_requests = self.minute_requests[minute_key]
+        minute_count = self._window_count(state, 2, _MINUTE_NS, current_time)
+        if minute_count >= self.calls_per_minute:
+            logger.warning(f"Per-minute limit exceeded for IP {client_ip}")
+            return True
+        
+        # Verificar límite por hora
+        if self._window_count(state, 5, _HOUR_NS, current_time) >= self.calls_per_hour:
+            logger.warning(f"Per-hour limit exceeded for IP {client_ip}")
+            return True
+        
+        # Límites especiales para endpoints sensibles
+        if self._is_sensitive_endpoint(path):
+            # Límite más estricto para endpoints de autenticación
+            auth_limit = min(10, self.calls_per_minute // 6)  # Máximo 10 por minuto
+            if minute_count >= auth_limit:
+                logger.warning(f"Auth endpoint limit exceeded for IP {client_ip} on {path}")
+                return True
         
-        # Limpiar requests antiguos del minuto
-        while minute_requests and current_time - minute_requests[0] > 60:
-            minute_requests.popleft()
+        return False
+    
+    def _update_state(self, client_ip: str, current_time: int) -> List[float]:
+        """
+        Recargar el token bucket de ráfaga y rotar las ventanas de una IP
+        
+        Args:
+            client_ip: IP del cliente
+            current_time: Timestamp actual (``time.monotonic_ns()``)
+            
+        Returns:
+            Estado de la IP (ver ``self.buckets``)
+        """
+        state = self.buckets.get(client_ip)
+        if state is None:
+            state = [
+                float(self.burst_limit), current_time,
+                0.0, 0.0, current_time // _MINUTE_NS,
+                0.0, 0.0, current_time // _HOUR_NS,
+            ]
+            self.buckets[client_ip] = state
+            heapq.heappush(self._expirations, (current_time + self._retention, client_ip))
+            return state
+        
+        # Recargar tokens de ráfaga en proporción al tiempo transcurrido
+        elapsed = current_time - state[1]
+        if elapsed > 0:
+            state[0] = min(self.burst_limit, state[0] + elapsed * self.burst_limit / _BURST_NS)
+            state[1] = current_time
+        
+        # Al entrar en una nueva ventana fija, la actual pasa a ser la anterior
+        # (o se descarta si ya no es contigua)
+        for idx, window in ((2, _MINUTE_NS), (5, _HOUR_NS)):
+            window_index = current_time // window
+            if window_index != state[idx + 2]:
+                state[idx] = state[idx + 1] if window_index == state[idx + 2] + 1 else 0.0
+                state[idx + 1] = 0.0
+                state[idx + 2] = window_index
+        
+        return state
+    
+    @staticmethod
+    def _window_count(state: List[float], idx: int, window: int, current_time: int) -> float:
+        """
+        Estimar los requests de la ventana deslizante a partir de dos contadores
+        
+        Args:
+            state: Estado de la IP
+            idx: Posición del contador de la ventana anterior en el estado
+            window: Duración de la ventana en nanosegundos
+            current_time: Timestamp actual (``time.monotonic_ns()``)
+            
+        Returns:
+            Número estimado de requests en la última ``window``
+        """
+        overlap = 1.0 - (current_time % window) / window
+        return state[idx] * overlap + state[idx + 1]
+    
+    def _is_rate_limited_strict(self, client_ip: str, path: str, current_time: int) -> bool:
+        """
+        Verificar límites con ventanas deslizantes exactas (modo estricto)
+        
+        Args:
+            client_ip: IP del cliente
+            path: Ruta del endpoint
+            current_time: Timestamp actual (``time.monotonic_ns()``)
+            
+        Returns:
+            True si está limitado, False en caso contrario
+        """
+        # Verificar límite de ráfaga (últimos 10 segundos)
+        burst_requests = self._get_ring(self.burst_requests, client_ip, self.burst_limit)
+        burst_requests.expire(current_time - _BURST_NS)
+        
+        if len(burst_requests) >= self.burst_limit:
+            logger.warning(f"Burst limit exceeded for IP {client_ip}")
+            return True
+        
+        # Verificar límite por minuto
+        minute_requests = self._get_ring(self.minute_requests, client_ip, self.calls_per_minute)
+        minute_requests.expire(current_time - _MINUTE_NS)
         
         if len(minute_requests) >= self.calls_per_minute:
             logger.warning(f"Per-minute limit exceeded for IP {client_ip}")
             return True
         
         # Verificar límite por hora
-        hour_key = f"{client_ip}:hour"
-        hour_requests = self.hour_requests[hour_key]
-        
-        # Limpiar requests antiguos de la hora
-        while hour_requests and current_time - hour_requests[0] > 3600:
-            hour_requests.popleft()
+        hour_requests = self._get_ring(self.hour_requests, client_ip, self.calls_per_hour)
+        hour_requests.expire(current_time - _HOUR_NS)
         
         if len(hour_requests) >= self.calls_per_hour:
             logger.warning(f"Per-hour limit exceeded for IP {client_ip}")
@@ -164,6 +498,24 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         
         return False
     
+    @staticmethod
+    def _get_ring(requests: Dict[str, _TimestampRing], client_ip: str, capacity: int) -> _TimestampRing:
+        """
+        Obtener (o crear) el buffer de timestamps de una IP para una ventana
+        
+        Args:
+            requests: Buffers de la ventana indexados por IP
+            client_ip: IP del cliente
+            capacity: Límite de la ventana
+            
+        Returns:
+            Buffer de timestamps de la IP
+        """
+        ring = requests.get(client_ip)
+        if ring is None:
+            ring = requests[client_ip] = _TimestampRing(capacity)
+        return ring
+    
     def _is_sensitive_endpoint(self, path: str) -> bool:
         """
         Verificar si el endpoint es sensible y requiere límites más estrictos
@@ -174,59 +526,77 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         Returns:
             True si es endpoint sensible
         """
-        sensitive_patterns = [
-            '/auth/login',
-            '/auth/logout',
-            '/auth/me',
-        ]
-        
-        return any(pattern in path for pattern in sensitive_patterns)
+        return path.startswith(_SENSITIVE_PREFIXES)
     
-    def _record_request(self, client_ip: str, current_time: float):
+    def _record_request(self, client_ip: str, current_time: int):
         """
         Registrar request para tracking
         
         Args:
             client_ip: IP del cliente
-            current_time: Timestamp actual
+            current_time: Timestamp actual (``time.monotonic_ns()``)
         """
+        if not self.strict:
+            # Consumir un token de ráfaga y contar en las ventanas actuales
+            # (el estado ya se actualizó al verificar)
+            state = self.buckets[client_ip]
+            state[0] -= 1
+            state[3] += 1
+            state[6] += 1
+            return
+        
+        # Programar la limpieza si la IP no tenía requests registrados
+        # (los buffers ya se crearon al verificar)
+        hour_requests = self.hour_requests[client_ip]
+        if not hour_requests:
+            heapq.heappush(self._expirations, (current_time + self._retention, client_ip))
+        
         # Registrar en todas las ventanas de tiempo
-        self.burst_requests[f"{client_ip}:burst"].append(current_time)
-        self.minute_requests[f"{client_ip}:minute"].append(current_time)
-        self.hour_requests[f"{client_ip}:hour"].append(current_time)
+        self.burst_requests[client_ip].append(current_time)
+        self.minute_requests[client_ip].append(current_time)
+        hour_requests.append(current_time)
     
-    def _cleanup_old_requests(self, current_time: float):
+    def _cleanup_old_requests(self, current_time: int):
         """
-        Limpiar requests antiguos para liberar memoria
+        Limpiar el estado de IPs inactivas para liberar memoria
+        
+        Solo se procesan las entradas vencidas del heap; si la IP tuvo
+        actividad posterior se reprograma según su última actividad.
         
         Args:
-            current_time: Timestamp actual
-        """
-        # Limpiar requests de ráfaga (> 10 segundos)
-        for key in list(self.burst_requests.keys()):
-            requests = self.burst_requests[key]
-            while requests and current_time - requests[0] > 10:
-                requests.popleft()
-            if not requests:
-                del self.burst_requests[key]
-        
-        # Limpiar requests por minuto (> 60 segundos)
-        for key in list(self.minute_requests.keys()):
-            requests = self.minute_requests[key]
-            while requests and current_time - requests[0] > 60:
-                requests.popleft()
-            if not requests:
-                del self.minute_requests[key]
-        
-        # Limpiar requests por hora (> 3600 segundos)
-        for key in list(self.hour_requests.keys()):
-            requests = self.hour_requests[key]
-            while requests and current_time - requests[0] > 3600:
-                requests.popleft()
-            if not requests:
-                del self.hour_requests[key]
+            current_time: Timestamp actual (``time.monotonic_ns()``)
+        """
+        while self._expirations and self._expirations[0][0] <= current_time:
+            _, client_ip = heapq.heappop(self._expirations)
+            
+            last_activity = self._last_activity(client_ip)
+            if last_activity is not None and last_activity + self._retention > current_time:
+                heapq.heappush(self._expirations, (last_activity + self._retention, client_ip))
+                continue
+            
+            self.buckets.pop(client_ip, None)
+            self.burst_requests.pop(client_ip, None)
+            self.minute_requests.pop(client_ip, None)
+            self.hour_requests.pop(client_ip, None)
+    
+    def _last_activity(self, client_ip: str) -> Optional[int]:
+        """
+        Obtener el timestamp de la última actividad registrada de una IP
+        
+        Args:
+            client_ip: IP del cliente
+            
+        Returns:
+            Timestamp o None si no hay estado para la IP
+        """
+        if self.strict:
+            hour_requests = self.hour_requests.get(client_ip)
+            return hour_requests.last() if hour_requests is not None else None
+        
+        state = self.buckets.get(client_ip)
+        return state[1] if state is not None else None
     
-    def _create_rate_limit_response(self, client_ip: str, request: Request) -> JSONResponse:
+    def _create_rate_limit_response(self, client_ip: str, request: Request) -> ORJSONResponse:
         """
         Crear respuesta de rate limit excedido
         
@@ -235,7 +605,7 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
             request: Request HTTP
             
         Returns:
-            JSONResponse con error 429
+            ORJSONResponse con error 429
         """
         correlation_id = getattr(request.state, 'correlation_id', 'unknown')
         
@@ -255,34 +625,55 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
             "Retry-After": "60"  # Sugerir reintentar en 60 segundos
         }
         
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=429,
             content=error_response,
             headers=headers
         )
     
-    def _add_rate_limit_headers(self, response, client_ip: str, current_time: float):
+    def _add_rate_limit_headers(
+        self,
+        headers: MutableHeaders,
+        client_ip: str,
+        current_time: int,
+        counts: Optional[Tuple[int, int, int]] = None
+    ):
         """
         Agregar headers informativos sobre rate limiting
         
         Args:
-            response: Response HTTP
+            headers: Headers de la respuesta
             client_ip: IP del cliente
-            current_time: Timestamp actual
+            current_time: Timestamp actual (``time.monotonic_ns()``)
+            counts: Contadores de Redis (ráfaga, minuto, hora), si se usan
         """
         # Calcular requests restantes
-        minute_requests = len(self.minute_requests.get(f"{client_ip}:minute", []))
-        hour_requests = len(self.hour_requests.get(f"{client_ip}:hour", []))
-        
-        remaining_minute = max(0, self.calls_per_minute - minute_requests)
-        remaining_hour = max(0, self.calls_per_hour - hour_requests)
+        if counts is not None:
+            remaining_minute = max(0, self.calls_per_minute - counts[1])
+            remaining_hour = max(0, self.calls_per_hour - counts[2])
+        elif self.strict:
+            minute_requests = len(self.minute_requests.get(client_ip, ()))
+            hour_requests = len(self.hour_requests.get(client_ip, ()))
+            
+            remaining_minute = max(0, self.calls_per_minute - minute_requests)
+            remaining_hour = max(0, self.calls_per_hour - hour_requests)
+        else:
+            state = self.buckets[client_ip]
+            minute_count = self._window_count(state, 2, _MINUTE_NS, current_time)
+            hour_count = self._window_count(state, 5, _HOUR_NS, current_time)
+            
+            remaining_minute = max(0, int(self.calls_per_minute - minute_count))
+            remaining_hour = max(0, int(self.calls_per_hour - hour_count))
         
         # Agregar headers informativos
-        response.headers["X-RateLimit-Limit-Minute"] = str(self.calls_per_minute)
-        response.headers["X-RateLimit-Remaining-Minute"] = str(remaining_minute)
-        response.headers["X-RateLimit-Limit-Hour"] = str(self.calls_per_hour)
-        response.headers["X-RateLimit-Remaining-Hour"] = str(remaining_hour)
-        
-        # Tiempo hasta reset (próximo minuto)
-        reset_time = int(current_time) + (60 - int(current_time) % 60)
-        response.headers["X-RateLimit-Reset"] = str(reset_time)
\ No newline at end of file
+        headers["X-RateLimit-Limit-Minute"] = self._limit_minute_str
+        headers["X-RateLimit-Remaining-Minute"] = str(remaining_minute)
+        headers["X-RateLimit-Limit-Hour"] = self._limit_hour_str
+        headers["X-RateLimit-Remaining-Hour"] = str(remaining_hour)
+        
+        # Tiempo hasta reset (próximo minuto de reloj), recalculado una vez
+        # por segundo
+        second = int(time.time())
+        if _CACHED_RESET[0] != second:
+            _CACHED_RESET[:] = [second, str(second + 60 - second % 60)]
+        headers["X-RateLimit-Reset"] = _CACHED_RESET[1]
\ No newline at end of file
@@ -1,13 +1,18 @@
 """
 Modelos Pydantic para requests y responses de la API CardDemo
 """
-from pydantic import BaseModel, EmailStr, Field, validator
+import re
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator, model_validator
 from typing import Optional, List
 from datetime import datetime, date
 from decimal import Decimal
 from enum import Enum
 
 
+# Caracteres no numéricos (para contar los dígitos del teléfono)
+_NON_DIGIT_RE = re.compile(r'\D')
+
+
 # Enums para valores constantes
 class CardType(str, Enum):
     VISA = "VISA"
@@ -40,13 +45,14 @@ class UserLogin(BaseModel):
     username: str = Field(..., min_length=3, max_length=50, description="Nombre de usuario")
     password: str = Field(..., min_length=8, max_length=128, description="Contraseña del usuario")
     
-    class Config:
-        schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "username": "USER0001",
                 "password": "PASSWORD"
             }
         }
+    )
 
 
 class AccountUpdate(BaseModel):
@@ -59,23 +65,25 @@ class AccountUpdate(BaseModel):
     state: Optional[str] = Field(None, min_length=2, max_length=2, description="Estado (código de 2 letras)")
     zip_code: Optional[str] = Field(None, min_length=5, max_length=10, description="Código postal")
     
-    @validator('state')
+    @field_validator('state')
+    @classmethod
     def validate_state(cls, v):
-        if v is not None:
+        if v is not None and not v.isupper():
             return v.upper()
         return v
     
-    @validator('phone')
+    @field_validator('phone')
+    @classmethod
     def validate_phone(cls, v):
         if v is not None:
             # Remover caracteres no numéricos para validación básica
-            digits_only = ''.join(filter(str.isdigit, v))
+            digits_only = _NON_DIGIT_RE.sub('', v)
             if len(digits_only) < 10:
                 raise ValueError('El teléfono debe tener al menos 10 dígitos')
         return v
     
-    class Config:
-        schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "first_name": "John",
                 "last_name": "Doe",
@@ -86,6 +94,7 @@ class AccountUpdate(BaseModel):
                 "zip_code": "12345"
             }
         }
+    )
 
 
 class TransactionFilters(BaseModel):
@@ -94,27 +103,35 @@ class TransactionFilters(BaseModel):
     end_date: Optional[date] = Field(None, description="Fecha de fin (YYYY-MM-DD)")
     card_id: Optional[int] = Field(None, ge=1, description="ID de la tarjeta")
     transaction_type: Optional[TransactionType] = Field(None, description="Tipo de transacción")
-    min_amount: Optional[Decimal] = Field(None, ge=0, description="Monto mínimo")
-    max_amount: Optional[Decimal] = Field(None, ge=0, description="Monto máximo")
+    # Los filtros de monto no se almacenan: float basta y evita construir
+    # Decimal en cada validación (se convierten en la consulta con to_decimal)
+    min_amount: Optional[float] = Field(None, ge=0, description="Monto mínimo")
+    max_amount: Optional[float] = Field(None, ge=0, description="Monto máximo")
     limit: int = Field(50, ge=1, le=100, description="Número máximo de resultados")
     offset: int = Field(0, ge=0, description="Número de resultados a saltar")
+    cursor: Optional[str] = Field(
+        None,
+        max_length=200,
+        description="Cursor de la página siguiente (next_cursor); si se indica, se ignora offset"
+    )
+    include_total: bool = Field(True, description="Calcular el total de resultados (consulta COUNT adicional)")
     
-    @validator('end_date')
-    def validate_date_range(cls, v, values):
-        if v is not None and 'start_date' in values and values['start_date'] is not None:
-            if v < values['start_date']:
+    @model_validator(mode='after')
+    def validate_date_range(self):
+        if self.end_date is not None and self.start_date is not None:
+            if self.end_date < self.start_date:
                 raise ValueError('La fecha de fin debe ser posterior a la fecha de inicio')
-        return v
+        return self
     
-    @validator('max_amount')
-    def validate_amount_range(cls, v, values):
-        if v is not None and 'min_amount' in values and values['min_amount'] is not None:
-            if v < values['min_amount']:
+    @model_validator(mode='after')
+    def validate_amount_range(self):
+        if self.max_amount is not None and self.min_amount is not None:
+            if self.max_amount < self.min_amount:
                 raise ValueError('El monto máximo debe ser mayor al monto mínimo')
-        return v
+        return self
     
-    class Config:
-        schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "start_date": "2024-01-01",
                 "end_date": "2024-01-31",
@@ -125,6 +142,7 @@ class TransactionFilters(BaseModel):
                 "offset": 0
             }
         }
+    )
 
 
 # Modelos de Response (salida)
@@ -135,9 +153,9 @@ class UserResponse(BaseModel):
     email: str = Field(..., description="Email del usuario")
     is_active: bool = Field(..., description="Estado activo del usuario")
     
-    class Config:
-        from_attributes = True
-        schema_extra = {
+    model_config = ConfigDict(
+        from_attributes=True,
+        json_schema_extra={
             "example": {
                 "id": 1,
                 "username": "USER0001",
@@ -145,6 +163,7 @@ class UserResponse(BaseModel):
                 "is_active": True
             }
         }
+    )
 
 
 class TokenResponse(BaseModel):
@@ -154,8 +173,8 @@ class TokenResponse(BaseModel):
     expires_in: int = Field(..., description="Tiempo de expiración en segundos")
     user: UserResponse = Field(..., description="Información del usuario autenticado")
     
-    class Config:
-        schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "access_token": "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9...",
                 "token_type": "bearer",
@@ -168,6 +187,7 @@ class TokenResponse(BaseModel):
                 }
             }
         }
+    )
 
 
 class AccountResponse(BaseModel):
@@ -184,9 +204,9 @@ class AccountResponse(BaseModel):
     created_at: datetime = Field(..., description="Fecha de creación")
     updated_at: Optional[datetime] = Field(None, description="Fecha de última actualización")
     
-    class Config:
-        from_attributes = True
-        schema_extra = {
+    model_config = ConfigDict(
+        from_attributes=True,
+        json_schema_extra={
             "example": {
                 "id": 1,
                 "account_number": "1000000001",
@@ -201,6 +221,7 @@ class AccountResponse(BaseModel):
                 "updated_at": None
             }
         }
+    )
 
 
 class CardResponse(BaseModel):
@@ -215,9 +236,9 @@ class CardResponse(BaseModel):
     available_credit: Decimal = Field(..., description="Crédito disponible")
     created_at: datetime = Field(..., description="Fecha de creación")
     
-    class Config:
-        from_attributes = True
-        schema_extra = {
+    model_config = ConfigDict(
+        from_attributes=True,
+        json_schema_extra={
             "example": {
                 "id": 1,
                 "masked_card_number": "**** **** **** 1111",
@@ -230,6 +251,7 @@ class CardResponse(BaseModel):
                 "created_at": "2024-01-15T10:30:00Z"
             }
         }
+    )
 
 
 class TransactionResponse(BaseModel):
@@ -243,9 +265,9 @@ class TransactionResponse(BaseModel):
     description: Optional[str] = Field(None, description="Descripción adicional")
     created_at: datetime = Field(..., description="Fecha de creación del registro")
     
-    class Config:
-        from_attributes = True
-        schema_extra = {
+    model_config = ConfigDict(
+        from_attributes=True,
+        json_schema_extra={
             "example": {
                 "id": 1,
                 "transaction_date": "2024-01-15T14:30:00Z",
@@ -257,18 +279,26 @@ class TransactionResponse(BaseModel):
                 "created_at": "2024-01-15T14:30:00Z"
             }
         }
+    )
 
 
 class TransactionListResponse(BaseModel):
     """Modelo para respuesta de lista de transacciones con paginación"""
     transactions: List[TransactionResponse] = Field(..., description="Lista de transacciones")
-    total: int = Field(..., description="Total de transacciones que coinciden con los filtros")
+    total: Optional[int] = Field(
+        None,
+        description="Total de transacciones que coinciden con los filtros (solo si include_total=true)"
+    )
     limit: int = Field(..., description="Límite de resultados por página")
     offset: int = Field(..., description="Número de resultados saltados")
     has_more: bool = Field(..., description="Indica si hay más resultados disponibles")
+    next_cursor: Optional[str] = Field(
+        None,
+        description="Cursor para pedir la página siguiente sin offset (paginación por clave)"
+    )
     
-    class Config:
-        schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "transactions": [
                     {
@@ -285,9 +315,11 @@ class TransactionListResponse(BaseModel):
                 "total": 25,
                 "limit": 20,
                 "offset": 0,
-                "has_more": True
+                "has_more": True,
+                "next_cursor": "MjAyNC0wMS0xNVQxNDozMDowMHwx"
             }
         }
+    )
 
 
 class HealthResponse(BaseModel):
@@ -297,8 +329,8 @@ class HealthResponse(BaseModel):
     version: str = Field(..., description="Versión del servicio")
     timestamp: datetime = Field(default_factory=datetime.utcnow, description="Timestamp de la verificación")
     
-    class Config:
-        schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "status": "healthy",
                 "service": "CardDemo API",
@@ -306,6 +338,7 @@ class HealthResponse(BaseModel):
                 "timestamp": "2024-01-15T10:30:00Z"
             }
         }
+    )
 
 
 class DetailedHealthResponse(BaseModel):
@@ -317,8 +350,8 @@ class DetailedHealthResponse(BaseModel):
     database: dict = Field(..., description="Estado de la base de datos")
     uptime: float = Field(..., description="Tiempo de actividad en segundos")
     
-    class Config:
-        schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "status": "healthy",
                 "service": "CardDemo API",
@@ -331,14 +364,15 @@ class DetailedHealthResponse(BaseModel):
                 "uptime": 3600.5
             }
         }
+    )
 
 
 class ErrorResponse(BaseModel):
     """Modelo para respuestas de error estandarizadas"""
     error: dict = Field(..., description="Información del error")
     
-    class Config:
-        schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "error": {
                     "code": "VALIDATION_ERROR",
@@ -353,4 +387,19 @@ class ErrorResponse(BaseModel):
                     "timestamp": "2024-01-15T10:30:00Z"
                 }
             }
-        }
\ No newline at end of file
+        }
+    )
+
+# Modelos expuestos por la API. Pydantic v2 compila validador y serializador
+# al definir cada clase; model_rebuild() completa al importar cualquier modelo
+# cuya construcción haya quedado diferida (p. ej. por referencias adelantadas)
+# para que ese coste no recaiga en el primer request que lo use
+_API_MODELS = (
+    UserLogin, AccountUpdate, TransactionFilters,
+    UserResponse, TokenResponse, AccountResponse, CardResponse,
+    TransactionResponse, TransactionListResponse, HealthResponse,
+    DetailedHealthResponse, ErrorResponse,
+)
+
+for _model in _API_MODELS:
+    _model.model_rebuild()
@@ -1,12 +1,22 @@
 """
 Modelos de base de datos para CardDemo API usando SQLModel
 """
-from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Column, DateTime, Index, Sequence, event, func
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import now
+from sqlmodel import SQLModel, Field, Relationship, select
 from typing import Optional, List
 from datetime import datetime
 from decimal import Decimal
 
 
+@compiles(now, "sqlite")
+def _sqlite_now(element, compiler, **kw):
+    """now() en SQLite con milisegundos (CURRENT_TIMESTAMP solo tiene segundos)"""
+    return "STRFTIME('%Y-%m-%d %H:%M:%f', 'now')"
+
+
 class User(SQLModel, table=True):
     """Modelo de usuario del sistema"""
     __tablename__ = "users"
@@ -16,11 +26,33 @@ class User(SQLModel, table=True):
     email: str = Field(unique=True, index=True, max_length=100)
     hashed_password: str = Field(max_length=255)
     is_active: bool = Field(default=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: Optional[datetime] = Field(default=None)
+    # Timestamps asignados por la base de datos en la propia sentencia (con
+    # RETURNING se leen sin consulta extra); None hasta el primer flush
+    created_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    )
+    updated_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(DateTime(timezone=True), onupdate=func.now())
+    )
     
-    # Relaciones
-    account: Optional["Account"] = Relationship(back_populates="user")
+    # Relaciones (estrategia de carga explícita en cada una: las referencias
+    # a la entidad padre se cargan solo si se acceden, casi siempre desde el
+    # identity map y sin SQL, y quien las necesite en bloque usa joinedload;
+    # las colecciones acotadas con un único SELECT ... IN y el historial de
+    # transacciones, que no está acotado, nunca se carga completo)
+    # El usuario se carga en cada request autenticado, así que su cuenta
+    # (y, en cadena, sus tarjetas) solo se consulta si se accede a ella
+    account: Optional["Account"] = Relationship(
+        back_populates="user",
+        sa_relationship_kwargs={"lazy": "select"}
+    )
+
+
+# Secuencia de números de cuenta (PostgreSQL). create_all la omite en motores
+# sin secuencias, donde el número se deriva de la clave primaria
+account_number_seq = Sequence("account_number_seq", start=100000, metadata=SQLModel.metadata)
 
 
 class Account(SQLModel, table=True):
@@ -28,7 +60,8 @@ class Account(SQLModel, table=True):
     __tablename__ = "accounts"
     
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="users.id", index=True)
+    # Una cuenta por usuario; el índice único respalda el ON CONFLICT (user_id)
+    user_id: int = Field(foreign_key="users.id", unique=True, index=True)
     account_number: str = Field(unique=True, index=True, max_length=20)
     first_name: str = Field(max_length=50)
     last_name: str = Field(max_length=50)
@@ -37,12 +70,25 @@ class Account(SQLModel, table=True):
     city: Optional[str] = Field(default=None, max_length=50)
     state: Optional[str] = Field(default=None, max_length=2)
     zip_code: Optional[str] = Field(default=None, max_length=10)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: Optional[datetime] = Field(default=None)
+    created_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    )
+    updated_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(DateTime(timezone=True), onupdate=func.now())
+    )
     
-    # Relaciones
-    user: Optional[User] = Relationship(back_populates="account")
-    credit_cards: List["CreditCard"] = Relationship(back_populates="account")
+    # Relaciones (sin JOIN a users: arrastraría hashed_password a cada carga
+    # de cuenta o tarjeta sin que nadie lo lea)
+    user: Optional[User] = Relationship(
+        back_populates="account",
+        sa_relationship_kwargs={"lazy": "select"}
+    )
+    credit_cards: List["CreditCard"] = Relationship(
+        back_populates="account",
+        sa_relationship_kwargs={"lazy": "selectin"}
+    )
 
 
 class CreditCard(SQLModel, table=True):
@@ -52,35 +98,88 @@ class CreditCard(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     account_id: int = Field(foreign_key="accounts.id", index=True)
     card_number: str = Field(index=True, max_length=20)  # Será encriptado
+    # Máscara calculada una sola vez al crear la tarjeta ("**** **** **** 1234"),
+    # para no desencriptar el número en cada respuesta
+    masked_card_number: Optional[str] = Field(default=None, max_length=24)
     card_type: str = Field(max_length=20)  # VISA, MASTERCARD, AMEX, etc.
     expiry_month: int = Field(ge=1, le=12)
     expiry_year: int = Field(ge=2024, le=2050)
     status: str = Field(default="ACTIVE", max_length=20)  # ACTIVE, BLOCKED, EXPIRED
     credit_limit: Decimal = Field(max_digits=10, decimal_places=2)
     available_credit: Decimal = Field(max_digits=10, decimal_places=2)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    )
     
     # Relaciones
-    account: Optional[Account] = Relationship(back_populates="credit_cards")
-    transactions: List["Transaction"] = Relationship(back_populates="credit_card")
+    account: Optional[Account] = Relationship(
+        back_populates="credit_cards",
+        sa_relationship_kwargs={"lazy": "select"}
+    )
+    # Colección de solo escritura: se consulta con card.transactions.select()
+    # para aplicar filtros y paginación en SQL
+    transactions: List["Transaction"] = Relationship(
+        back_populates="credit_card",
+        sa_relationship_kwargs={"lazy": "write_only"}
+    )
 
 
 class Transaction(SQLModel, table=True):
     """Modelo de transacción"""
     __tablename__ = "transactions"
+    # Índice compuesto para el listado (tarjetas del usuario + rango de fechas,
+    # ordenado por fecha); también cubre las búsquedas solo por card_id. Un
+    # B-tree se recorre igual en ambos sentidos, así que sirve para DESC
+    # El listado por usuario usa ix_txn_user_date sin JOIN con tarjetas ni cuentas
+    __table_args__ = (
+        Index("ix_txn_card_date", "card_id", "transaction_date"),
+        Index("ix_txn_user_date", "user_id", "transaction_date"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
-    card_id: int = Field(foreign_key="credit_cards.id", index=True)
-    transaction_date: datetime = Field(index=True)
+    card_id: int = Field(foreign_key="credit_cards.id")
+    # Propietario desnormalizado (usuario de la cuenta de la tarjeta); si no
+    # se indica se completa al hacer flush (ver _set_transaction_user_ids)
+    user_id: Optional[int] = Field(default=None, foreign_key="users.id")
+    transaction_date: datetime
     merchant_name: str = Field(max_length=100)
     amount: Decimal = Field(max_digits=10, decimal_places=2)
     transaction_type: str = Field(max_length=20)  # PURCHASE, PAYMENT, REFUND
     status: str = Field(default="COMPLETED", max_length=20)  # PENDING, COMPLETED, FAILED
     description: Optional[str] = Field(default=None, max_length=200)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    )
     
     # Relaciones
-    credit_card: Optional[CreditCard] = Relationship(back_populates="transactions")
+    # Los listados de transacciones no usan la tarjeta: se carga bajo demanda
+    credit_card: Optional[CreditCard] = Relationship(
+        back_populates="transactions",
+        sa_relationship_kwargs={"lazy": "select"}
+    )
+
+
+@event.listens_for(Session, "before_flush")
+def _set_transaction_user_ids(session, flush_context, instances):
+    """Completar user_id de las transacciones nuevas a partir de su tarjeta"""
+    pending = [
+        obj for obj in session.new
+        if isinstance(obj, Transaction) and obj.user_id is None
+    ]
+    if not pending:
+        return
+    
+    # Una sola consulta para todas las tarjetas del flush
+    with session.no_autoflush:
+        owners = dict(session.execute(
+            select(CreditCard.id, Account.user_id)
+            .join(Account, CreditCard.account_id == Account.id)
+            .where(CreditCard.id.in_({transaction.card_id for transaction in pending}))
+        ).all())
+    for transaction in pending:
+        transaction.user_id = owners.get(transaction.card_id)
 
 
 class AuditLog(SQLModel, table=True):
@@ -94,6 +193,9 @@ class AuditLog(SQLModel, table=True):
     action: str = Field(max_length=20)  # CREATE, UPDATE, DELETE
     old_values: Optional[str] = Field(default=None)  # JSON string
     new_values: Optional[str] = Field(default=None)  # JSON string
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    )
     ip_address: Optional[str] = Field(default=None, max_length=45)
     user_agent: Optional[str] = Field(default=None, max_length=500)
\ No newline at end of file
@@ -1,3 +1,8 @@
 """
 Routers para CardDemo API
-"""
\ No newline at end of file
+
+Los endpoints que acceden a la base de datos se declaran con ``def`` (no
+``async def``): la sesión de SQLModel es síncrona y FastAPI ejecuta esos
+endpoints en su threadpool, de modo que las consultas no bloquean el
+event loop ni serializan los requests concurrentes.
+"""
@@ -1,12 +1,15 @@
 """
 Router de gestión de cuentas para CardDemo API
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlmodel import Session
 
 from database import get_session
 from dependencies import get_current_active_user
 from services.account_service import AccountService
+from services.cache_service import (
+    ResponseCache, account_cache_key, conditional_json_response, get_response_cache
+)
 from models.api_models import AccountResponse, AccountUpdate
 from models.database_models import User
 
@@ -20,46 +23,46 @@ def get_account_service() -> AccountService:
 
 
 @router.get("/me", response_model=AccountResponse)
-async def get_my_account(
+def get_my_account(
+    request: Request,
     current_user: User = Depends(get_current_active_user),
     session: Session = Depends(get_session),
-    account_service: AccountService = Depends(get_account_service)
+    account_service: AccountService = Depends(get_account_service),
+    response_cache: ResponseCache = Depends(get_response_cache)
 ):
     """
     Obtener información de la cuenta del usuario actual
     
+    Responde 304 sin cuerpo si el ETag de If-None-Match sigue vigente.
+    
     Args:
+        request: Petición (cabecera If-None-Match)
         current_user: Usuario actual autenticado
         session: Sesión de base de datos
         account_service: Servicio de cuentas
+        response_cache: Caché de respuestas
         
     Returns:
         Información de la cuenta del usuario
     """
-    # Obtener o crear cuenta si no existe
-    account = account_service.get_or_create_account(session, current_user.id)
+    cache_key = account_cache_key(current_user.id)
+    account_data = response_cache.get(cache_key)
+    if account_data is None:
+        # Obtener o crear cuenta si no existe
+        account = account_service.get_or_create_account(session, current_user.id)
+        account_data = AccountResponse.model_validate(account).model_dump(mode="json")
+        response_cache.set(cache_key, account_data)
     
-    return AccountResponse(
-        id=account.id,
-        account_number=account.account_number,
-        first_name=account.first_name,
-        last_name=account.last_name,
-        phone=account.phone,
-        address=account.address,
-        city=account.city,
-        state=account.state,
-        zip_code=account.zip_code,
-        created_at=account.created_at,
-        updated_at=account.updated_at
-    )
+    return conditional_json_response(request, account_data)
 
 
 @router.put("/me", response_model=AccountResponse)
-async def update_my_account(
+def update_my_account(
     account_update: AccountUpdate,
     current_user: User = Depends(get_current_active_user),
     session: Session = Depends(get_session),
-    account_service: AccountService = Depends(get_account_service)
+    account_service: AccountService = Depends(get_account_service),
+    response_cache: ResponseCache = Depends(get_response_cache)
 ):
     """
     Actualizar información de la cuenta del usuario actual
@@ -69,6 +72,7 @@ async def update_my_account(
         current_user: Usuario actual autenticado
         session: Sesión de base de datos
         account_service: Servicio de cuentas
+        response_cache: Caché de respuestas
         
     Returns:
         Información actualizada de la cuenta
@@ -82,20 +86,9 @@ async def update_my_account(
     try:
         # Actualizar cuenta
         updated_account = account_service.update_account(session, account, account_update)
+        response_cache.delete(account_cache_key(current_user.id))
         
-        return AccountResponse(
-            id=updated_account.id,
-            account_number=updated_account.account_number,
-            first_name=updated_account.first_name,
-            last_name=updated_account.last_name,
-            phone=updated_account.phone,
-            address=updated_account.address,
-            city=updated_account.city,
-            state=updated_account.state,
-            zip_code=updated_account.zip_code,
-            created_at=updated_account.created_at,
-            updated_at=updated_account.updated_at
-        )
+        return AccountResponse.model_validate(updated_account)
     
     except Exception as e:
         raise HTTPException(
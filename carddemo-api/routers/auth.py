@@ -1,13 +1,14 @@
 """
 Router de autenticación para CardDemo API
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import HTTPAuthorizationCredentials
 from sqlmodel import Session
 
 from database import get_session
 from dependencies import get_auth_service, get_current_active_user, security
 from services.auth_service import AuthService
+from services.cache_service import conditional_json_response
 from models.api_models import UserLogin, TokenResponse, UserResponse
 from models.database_models import User
 
@@ -16,7 +17,7 @@ router = APIRouter(prefix="/auth", tags=["authentication"])
 
 
 @router.post("/login", response_model=TokenResponse)
-async def login(
+def login(
     user_credentials: UserLogin,
     session: Session = Depends(get_session),
     auth_service: AuthService = Depends(get_auth_service)
@@ -54,12 +55,7 @@ async def login(
     access_token = auth_service.create_access_token(token_data)
     
     # Crear respuesta con información del usuario
-    user_info = UserResponse(
-        id=user.id,
-        username=user.username,
-        email=user.email,
-        is_active=user.is_active
-    )
+    user_info = UserResponse.model_validate(user)
     
     return TokenResponse(
         access_token=access_token,
@@ -70,21 +66,28 @@ async def login(
 
 
 @router.post("/logout")
-async def logout(
-    current_user: User = Depends(get_current_active_user)
+def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: User = Depends(get_current_active_user),
+    auth_service: AuthService = Depends(get_auth_service)
 ):
     """
     Cerrar sesión del usuario
     
     Nota: En JWT stateless, el logout es principalmente del lado del cliente.
-    El servidor simplemente confirma que el token era válido.
+    El servidor confirma que el token era válido y descarta el usuario
+    cacheado para ese token.
     
     Args:
+        credentials: Credenciales Bearer de la petición
         current_user: Usuario actual autenticado
+        auth_service: Servicio de autenticación
         
     Returns:
         Mensaje de confirmación de logout
     """
+    auth_service.invalidate_token(credentials.credentials)
+    
     return {
         "message": f"Usuario {current_user.username} ha cerrado sesión exitosamente",
         "detail": "Token JWT debe ser eliminado del cliente"
@@ -92,21 +95,20 @@ async def logout(
 
 
 @router.get("/me", response_model=UserResponse)
-async def get_current_user_info(
+def get_current_user_info(
+    request: Request,
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Obtener información del usuario actual
     
+    Responde 304 sin cuerpo si el ETag de If-None-Match sigue vigente.
+    
     Args:
+        request: Petición (cabecera If-None-Match)
         current_user: Usuario actual autenticado
         
     Returns:
         Información del usuario actual
     """
-    return UserResponse(
-        id=current_user.id,
-        username=current_user.username,
-        email=current_user.email,
-        is_active=current_user.is_active
-    )
\ No newline at end of file
+    return conditional_json_response(request, UserResponse.model_validate(current_user).model_dump(mode="json"))
\ No newline at end of file
@@ -2,13 +2,16 @@
 Router de gestión de tarjetas de crédito para CardDemo API
 """
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlmodel import Session
 
 from database import get_session
 from dependencies import get_current_active_user
 from services.card_service import CardService
 from services.account_service import AccountService
+from services.cache_service import (
+    ResponseCache, cards_cache_key, conditional_json_response, get_response_cache
+)
 from models.api_models import CardResponse
 from models.database_models import User
 
@@ -27,41 +30,53 @@ def get_account_service() -> AccountService:
 
 
 @router.get("", response_model=List[CardResponse])
-async def get_my_cards(
+def get_my_cards(
+    request: Request,
     current_user: User = Depends(get_current_active_user),
     session: Session = Depends(get_session),
     card_service: CardService = Depends(get_card_service),
-    account_service: AccountService = Depends(get_account_service)
+    account_service: AccountService = Depends(get_account_service),
+    response_cache: ResponseCache = Depends(get_response_cache)
 ):
     """
     Obtener todas las tarjetas del usuario actual
     
+    Responde 304 sin cuerpo si el ETag de If-None-Match sigue vigente.
+    
     Args:
+        request: Petición (cabecera If-None-Match)
         current_user: Usuario actual autenticado
         session: Sesión de base de datos
         card_service: Servicio de tarjetas
         account_service: Servicio de cuentas
+        response_cache: Caché de respuestas
         
     Returns:
         Lista de tarjetas del usuario con números enmascarados
     """
-    # Obtener o crear cuenta del usuario
-    account = account_service.get_or_create_account(session, current_user.id)
-    
-    # Obtener tarjetas de la cuenta
-    cards = card_service.get_cards_by_account_id(session, account.id)
-    
-    # Si no hay tarjetas, crear algunas de ejemplo para la demo
-    if not cards:
-        cards = card_service.create_sample_cards(session, account.id)
+    cache_key = cards_cache_key(current_user.id)
+    cards_data = response_cache.get(cache_key)
+    if cards_data is None:
+        # Cuenta y tarjetas del usuario en una sola consulta
+        account_id, cards = card_service.get_user_cards(session, current_user.id)
+        if account_id is None:
+            account_id = account_service.get_or_create_account(session, current_user.id).id
+        
+        # Si no hay tarjetas, crear algunas de ejemplo para la demo
+        if not cards:
+            cards = card_service.create_sample_cards(session, account_id)
+        
+        # Convertir a modelos de respuesta con números enmascarados
+        cards_data = [card_service.card_to_response(card).model_dump(mode="json") for card in cards]
+        response_cache.set(cache_key, cards_data)
     
-    # Convertir a modelos de respuesta con números enmascarados
-    return [card_service.card_to_response(card) for card in cards]
+    return conditional_json_response(request, cards_data)
 
 
 @router.get("/{card_id}", response_model=CardResponse)
-async def get_card_details(
+def get_card_details(
     card_id: int,
+    request: Request,
     current_user: User = Depends(get_current_active_user),
     session: Session = Depends(get_session),
     card_service: CardService = Depends(get_card_service),
@@ -70,8 +85,11 @@ async def get_card_details(
     """
     Obtener detalles de una tarjeta específica
     
+    Responde 304 sin cuerpo si el ETag de If-None-Match sigue vigente.
+    
     Args:
         card_id: ID de la tarjeta
+        request: Petición (cabecera If-None-Match)
         current_user: Usuario actual autenticado
         session: Sesión de base de datos
         card_service: Servicio de tarjetas
@@ -96,4 +114,4 @@ async def get_card_details(
         )
     
     # Convertir a modelo de respuesta con número enmascarado
-    return card_service.card_to_response(card)
\ No newline at end of file
+    return conditional_json_response(request, card_service.card_to_response(card).model_dump(mode="json"))
\ No newline at end of file
@@ -1,7 +1,7 @@
 """
 Router de monitoreo de salud para CardDemo API
 """
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, status
 from typing import Dict, Any
 
 from services.health_service import health_service
@@ -73,17 +73,24 @@ async def get_detailed_health():
 
 
 @router.get("/component/{component_name}")
-async def get_component_health(component_name: str) -> Dict[str, Any]:
+async def get_component_health(
+    component_name: str,
+    force: bool = Query(False, description="Repetir la comprobación sin usar la caché")
+) -> Dict[str, Any]:
     """
     Verificar salud de un componente específico del sistema
     
     Args:
         component_name: Nombre del componente (database, api)
+        force: Descartar la comprobación de BD cacheada antes de verificar
         
     Returns:
         Estado del componente específico
     """
     try:
+        if force:
+            health_service.invalidate_cache()
+        
         component_health = health_service.check_component_health(component_name)
         
         # Si el componente es desconocido, retornar 500
@@ -2,14 +2,15 @@
 Router de gestión de transacciones para CardDemo API
 """
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import ORJSONResponse
 from sqlmodel import Session
-from typing import Optional
+from typing import Any, Optional
 from datetime import date
-from decimal import Decimal
+import orjson
 
 from database import get_session
 from dependencies import get_current_active_user
-from services.transaction_service import TransactionService
+from services.transaction_service import TransactionService, encode_cursor
 from services.card_service import CardService
 from models.api_models import TransactionResponse, TransactionListResponse, TransactionFilters, TransactionType
 from models.database_models import User
@@ -18,6 +19,18 @@ from models.database_models import User
 router = APIRouter(prefix="/transactions", tags=["transactions"])
 
 
+class UTCJSONResponse(ORJSONResponse):
+    """
+    ORJSONResponse que escribe las fechas UTC con sufijo "Z", igual que
+    Pydantic (orjson usaría "+00:00")
+    """
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_UTC_Z
+        )
+
+
 def get_transaction_service() -> TransactionService:
     """Dependency para obtener servicio de transacciones"""
     return TransactionService()
@@ -29,15 +42,17 @@ def get_card_service() -> CardService:
 
 
 @router.get("", response_model=TransactionListResponse)
-async def get_my_transactions(
+def get_my_transactions(
     start_date: Optional[date] = Query(None, description="Fecha de inicio (YYYY-MM-DD)"),
     end_date: Optional[date] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
     card_id: Optional[int] = Query(None, ge=1, description="ID de la tarjeta"),
     transaction_type: Optional[TransactionType] = Query(None, description="Tipo de transacción"),
-    min_amount: Optional[Decimal] = Query(None, ge=0, description="Monto mínimo"),
-    max_amount: Optional[Decimal] = Query(None, ge=0, description="Monto máximo"),
+    min_amount: Optional[float] = Query(None, ge=0, description="Monto mínimo"),
+    max_amount: Optional[float] = Query(None, ge=0, description="Monto máximo"),
     limit: int = Query(50, ge=1, le=100, description="Número máximo de resultados"),
     offset: int = Query(0, ge=0, description="Número de resultados a saltar"),
+    cursor: Optional[str] = Query(None, max_length=200, description="Cursor de la página siguiente (next_cursor)"),
+    include_total: bool = Query(True, description="Calcular el total de resultados"),
     current_user: User = Depends(get_current_active_user),
     session: Session = Depends(get_session),
     transaction_service: TransactionService = Depends(get_transaction_service),
@@ -55,6 +70,8 @@ async def get_my_transactions(
         max_amount: Monto máximo para filtrar
         limit: Número máximo de resultados por página
         offset: Número de resultados a saltar (para paginación)
+        cursor: Cursor devuelto en ``next_cursor``; si se indica, se ignora offset
+        include_total: Si es falso se omite el COUNT y ``total`` vale None
         current_user: Usuario actual autenticado
         session: Sesión de base de datos
         transaction_service: Servicio de transacciones
@@ -72,55 +89,68 @@ async def get_my_transactions(
         min_amount=min_amount,
         max_amount=max_amount,
         limit=limit,
-        offset=offset
+        offset=offset,
+        cursor=cursor,
+        include_total=include_total
     )
     
     # Obtener transacciones con filtros
-    transactions, total = transaction_service.get_transactions_with_filters(
-        session, current_user.id, filters
-    )
+    try:
+        transactions, total, has_more = transaction_service.get_transactions_with_filters(
+            session, current_user.id, filters
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     
     # Si no hay transacciones, crear algunas de ejemplo
-    if not transactions and offset == 0:  # Solo crear ejemplos en la primera página
+    if not transactions and offset == 0 and cursor is None:  # Solo crear ejemplos en la primera página
         # Obtener tarjetas del usuario
         user_card_ids = transaction_service.get_user_card_ids(session, current_user.id)
         
-        # Si no hay tarjetas, crear algunas primero
-        if not user_card_ids:
-            from services.account_service import AccountService
-            account_service = AccountService()
-            account = account_service.get_or_create_account(session, current_user.id)
-            cards = card_service.create_sample_cards(session, account.id)
-            user_card_ids = [card.id for card in cards]
-        
-        # Crear transacciones de ejemplo
-        sample_transactions = transaction_service.create_sample_transactions(session, user_card_ids)
-        
-        # Volver a obtener transacciones con filtros
-        transactions, total = transaction_service.get_transactions_with_filters(
-            session, current_user.id, filters
-        )
-    
-    # Convertir a modelos de respuesta
-    transaction_responses = [
-        transaction_service.transaction_to_response(transaction)
-        for transaction in transactions
-    ]
+        # Una página vacía por filtros sin coincidencias no debe volver a
+        # insertar ejemplos: solo se crean si el usuario no tiene ninguna
+        if not transaction_service.has_transactions(session, user_card_ids):
+            # Si no hay tarjetas, crear algunas primero
+            if not user_card_ids:
+                from services.account_service import AccountService
+                account_service = AccountService()
+                account = account_service.get_or_create_account(session, current_user.id)
+                cards = card_service.create_sample_cards(session, account.id)
+                user_card_ids = [card.id for card in cards]
+            
+            # Crear transacciones de ejemplo
+            transaction_service.create_sample_transactions(session, user_card_ids, current_user.id)
+            
+            # Volver a obtener transacciones con filtros
+            transactions, total, has_more = transaction_service.get_transactions_with_filters(
+                session, current_user.id, filters
+            )
     
-    # Calcular si hay más resultados
-    has_more = (offset + len(transactions)) < total
+    # Cursor de la página siguiente (has_more se obtiene pidiendo limit+1 filas)
+    next_cursor = encode_cursor(transactions[-1]) if has_more else None
     
-    return TransactionListResponse(
-        transactions=transaction_responses,
-        total=total,
-        limit=limit,
-        offset=offset,
-        has_more=has_more
-    )
+    # Serializar directamente con orjson: el listado puede ser grande y los
+    # datos ya vienen validados de la BD, así que se evita construir y
+    # re-validar un TransactionResponse por fila (response_model documenta
+    # el esquema en OpenAPI)
+    return UTCJSONResponse(content={
+        "transactions": [
+            transaction_service.transaction_to_dict(transaction)
+            for transaction in transactions
+        ],
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "has_more": has_more,
+        "next_cursor": next_cursor
+    })
 
 
 @router.get("/{transaction_id}", response_model=TransactionResponse)
-async def get_transaction_details(
+def get_transaction_details(
     transaction_id: int,
     current_user: User = Depends(get_current_active_user),
     session: Session = Depends(get_session),
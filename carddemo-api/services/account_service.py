@@ -1,30 +1,55 @@
 """
 Servicio de gestión de cuentas para CardDemo API
 """
-from typing import Optional
+import uuid
+from typing import Optional, Tuple
 from sqlmodel import Session, select
-from datetime import datetime, timezone
+from sqlalchemy import lambda_stmt
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import flag_modified
 
-from models.database_models import Account, User
+from models.database_models import Account, User, account_number_seq
 from models.api_models import AccountUpdate
 
 
+# INSERT con soporte de ON CONFLICT por dialecto
+_UPSERT_INSERTS = {
+    "postgresql": pg_insert,
+    "sqlite": sqlite_insert,
+}
+
+
 class AccountService:
     """Servicio para manejo de cuentas de usuario"""
     
-    def get_account_by_user_id(self, session: Session, user_id: int) -> Optional[Account]:
+    def get_account_by_user_id(
+        self,
+        session: Session,
+        user_id: int,
+        eager_cards: bool = False
+    ) -> Optional[Account]:
         """
         Obtener cuenta por ID de usuario
         
         Args:
             session: Sesión de base de datos
             user_id: ID del usuario
+            eager_cards: Cargar también ``credit_cards`` con un único SELECT ... IN
+                (selectinload) en lugar de una consulta aparte al acceder
             
         Returns:
             Cuenta del usuario o None si no existe
         """
-        statement = select(Account).where(Account.user_id == user_id)
-        return session.exec(statement).first()
+        # Consulta en lambda: SQLAlchemy reutiliza la sentencia construida y
+        # su SQL compilado entre llamadas; user_id pasa como parámetro. Es
+        # único, así que como mucho hay una fila (sin LIMIT)
+        statement = lambda_stmt(lambda: select(Account))
+        statement += lambda s: s.where(Account.user_id == user_id)
+        if eager_cards:
+            statement += lambda s: s.options(selectinload(Account.credit_cards))
+        return session.scalars(statement).one_or_none()
     
     def create_account(self, session: Session, user_id: int, account_data: dict) -> Account:
         """
@@ -38,9 +63,7 @@ class AccountService:
         Returns:
             Cuenta creada
         """
-        # Generar número de cuenta único (simplificado para demo)
-        import random
-        account_number = f"ACC{random.randint(100000, 999999):06d}"
+        account_number, provisional = self._new_account_number(session)
         
         account = Account(
             user_id=user_id,
@@ -51,11 +74,13 @@ class AccountService:
             address=account_data.get("address"),
             city=account_data.get("city"),
             state=account_data.get("state"),
-            zip_code=account_data.get("zip_code"),
-            created_at=datetime.now(timezone.utc)
+            zip_code=account_data.get("zip_code")
         )
         
         session.add(account)
+        if provisional:
+            session.flush()
+            self._assign_account_number(account)
         session.commit()
         session.refresh(account)
         return account
@@ -79,31 +104,93 @@ class AccountService:
             if hasattr(account, field):
                 setattr(account, field, value)
         
-        account.updated_at = datetime.now(timezone.utc)
-        
+        # updated_at lo asigna la base de datos en el UPDATE (onupdate)
         session.add(account)
         session.commit()
         session.refresh(account)
         return account
     
-    def get_or_create_account(self, session: Session, user_id: int) -> Account:
+    def get_or_create_account(self, session: Session, user_id: int, eager_cards: bool = False) -> Account:
         """
         Obtener cuenta existente o crear una nueva si no existe
         
         Args:
             session: Sesión de base de datos
             user_id: ID del usuario
+            eager_cards: Cargar también las tarjetas de la cuenta existente
             
         Returns:
             Cuenta del usuario
         """
-        account = self.get_account_by_user_id(session, user_id)
+        account = self.get_account_by_user_id(session, user_id, eager_cards=eager_cards)
         
         if not account:
-            # Crear cuenta básica si no existe
-            account = self.create_account(session, user_id, {
-                "first_name": "",
-                "last_name": ""
-            })
+            # Crear cuenta básica si no existe; si una petición concurrente
+            # la creó antes, el INSERT no hace nada y se lee la suya
+            account = self._create_account_if_missing(session, user_id)
+            if account is None:
+                account = self.get_account_by_user_id(session, user_id, eager_cards=eager_cards)
+        
+        return account
+    
+    def _create_account_if_missing(self, session: Session, user_id: int) -> Optional[Account]:
+        """
+        Crear una cuenta básica con INSERT ... ON CONFLICT (user_id) DO NOTHING
+        
+        Args:
+            session: Sesión de base de datos
+            user_id: ID del usuario
+            
+        Returns:
+            Cuenta creada o None si el usuario ya tenía cuenta
+        """
+        insert = _UPSERT_INSERTS.get(session.get_bind().dialect.name)
+        if insert is None:
+            return self.create_account(session, user_id, {"first_name": "", "last_name": ""})
         
-        return account
\ No newline at end of file
+        account_number, provisional = self._new_account_number(session)
+        statement = (
+            insert(Account)
+            .values(
+                user_id=user_id,
+                account_number=account_number,
+                first_name="",
+                last_name=""
+            )
+            .on_conflict_do_nothing(index_elements=["user_id"])
+            .returning(Account)
+        )
+        account = session.scalars(statement).first()
+        
+        if account is not None and provisional:
+            self._assign_account_number(account)
+        session.commit()
+        return account
+    
+    @staticmethod
+    def _new_account_number(session: Session) -> Tuple[str, bool]:
+        """
+        Obtener el número de una cuenta nueva sin riesgo de colisión
+        
+        Con secuencia se pide el siguiente valor. Sin ella se devuelve un
+        valor provisional único que ``_assign_account_number`` sustituye por
+        uno derivado del ID dentro de la misma transacción.
+        
+        Args:
+            session: Sesión de base de datos
+            
+        Returns:
+            Tupla (número de cuenta, si es provisional)
+        """
+        if session.get_bind().dialect.supports_sequences:
+            next_value = session.scalar(select(account_number_seq.next_value()))
+            return f"ACC{next_value:09d}", False
+        return f"TMP{uuid.uuid4().hex[:17]}", True
+    
+    @staticmethod
+    def _assign_account_number(account: Account) -> None:
+        """Asignar el número definitivo derivado del ID (motores sin secuencias)"""
+        account.account_number = f"ACC{account_number_seq.start + account.id:09d}"
+        # Completa el alta, no es una modificación: updated_at se incluye tal
+        # cual en el UPDATE para que no lo fije onupdate
+        flag_modified(account, "updated_at")
\ No newline at end of file
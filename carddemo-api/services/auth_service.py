@@ -1,37 +1,202 @@
 """
 Servicio de autenticación para CardDemo API
 """
+import base64
 import bcrypt
-from datetime import datetime, timedelta, timezone
-from typing import Optional
-from jose import JWTError, jwt
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional, Tuple
+import jwt
+import orjson
+from sqlalchemy import bindparam, lambda_stmt
+from sqlalchemy.orm import make_transient_to_detached
 from sqlmodel import Session, select
 
 from config import settings
 from models.database_models import User
 
 
+# Búsquedas de usuario activo del camino de autenticación, construidas una vez
+# al importar: lambda_stmt sin variables de cierre y con parámetros con nombre,
+# así cada petición solo aporta el valor y reutiliza el SQL compilado
+_ACTIVE_USER_BY_USERNAME = lambda_stmt(
+    lambda: select(User).where(User.username == bindparam("username"), User.is_active == True)
+)
+_ACTIVE_USER_BY_ID = lambda_stmt(
+    lambda: select(User).where(User.id == bindparam("user_id"), User.is_active == True)
+)
+
+
+# Algoritmos HMAC que se firman sin pasar por jwt.encode
+_HMAC_DIGESTS = {"HS256": "sha256", "HS384": "sha384", "HS512": "sha512"}
+
+
+class _OrjsonJWT(jwt.PyJWT):
+    """PyJWT que decodifica el payload con orjson en lugar del json estándar"""
+    
+    def _decode_payload(self, decoded: dict) -> dict:
+        """
+        Decodificar el payload de un JWS (punto de extensión de PyJWT)
+        
+        Args:
+            decoded: Diccionario con payload, firma y cabecera
+            
+        Returns:
+            Payload decodificado
+            
+        Raises:
+            jwt.DecodeError: Si el payload no es un objeto JSON válido
+        """
+        try:
+            payload = orjson.loads(decoded["payload"])
+        except orjson.JSONDecodeError as e:
+            raise jwt.DecodeError(f"Invalid payload string: {e}") from e
+        if not isinstance(payload, dict):
+            raise jwt.DecodeError("Invalid payload string: must be a json object")
+        return payload
+
+
+# Decodificador compartido: PyJWT no guarda estado por token
+_jwt = _OrjsonJWT()
+
+
+def _b64url(data: bytes) -> bytes:
+    """Codificar en base64 URL-safe sin relleno (formato de los segmentos JWT)"""
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _now_ts() -> int:
+    """Instante actual como timestamp UNIX entero (el formato de exp e iat)"""
+    return int(time.time())
+
+
 class AuthService:
     """Servicio para manejo de autenticación y contraseñas"""
     
     def __init__(self):
         self.bcrypt_rounds = settings.bcrypt_rounds
-        self.secret_key = settings.secret_key
+        # bcrypt es CPU pura: más hashes simultáneos que núcleos no aumentan
+        # el rendimiento y dejan sin CPU al resto del threadpool durante una
+        # avalancha de logins
+        self._bcrypt_slots = threading.BoundedSemaphore(
+            settings.bcrypt_max_concurrency or os.cpu_count() or 1
+        )
+        self.secret_key = settings.get_secret("secret_key", settings.secret_key)
         self.algorithm = settings.algorithm
         self.access_token_expire_minutes = settings.access_token_expire_minutes
+        # Precalculados para no reconstruirlos en cada token (la instancia es
+        # única por proceso: ver dependencies.get_auth_service)
+        self._algorithms = [self.algorithm]
+        self._token_lifetime_seconds = self.access_token_expire_minutes * 60
+        # Con HMAC la cabecera del token es constante: se codifica una vez y
+        # cada token solo serializa el payload y calcula la firma
+        self._hmac_digest = _HMAC_DIGESTS.get(self.algorithm)
+        self._token_header = _b64url(orjson.dumps({"alg": self.algorithm, "typ": "JWT"})) + b"."
+        self._secret_bytes = self.secret_key.encode()
+        
+        # Usuarios ya resueltos por token: hash del token -> (vencimiento
+        # monotónico, copia desacoplada del usuario). Los endpoints corren
+        # en el threadpool, de ahí el lock
+        self.user_cache_ttl = settings.user_cache_ttl_seconds
+        self.user_cache_max_size = settings.user_cache_max_size
+        self._user_cache: "OrderedDict[bytes, Tuple[float, User]]" = OrderedDict()
+        self._user_cache_lock = threading.Lock()
+        # Mismas copias por ID de usuario, para tokens nuevos de un usuario
+        # ya resuelto (otro login, otro dispositivo)
+        self._users_by_id: "OrderedDict[int, Tuple[float, User]]" = OrderedDict()
+        
+        # Verificaciones de contraseña correctas recientes: clave derivada
+        # con un secreto aleatorio del proceso (no es reutilizable fuera de
+        # él) -> vencimiento monotónico. Comparte tamaño máximo y lock
+        self.password_cache_ttl = settings.password_cache_ttl_seconds
+        self._password_cache_secret = os.urandom(32)
+        self._password_cache: "OrderedDict[bytes, float]" = OrderedDict()
+        
+        # Payloads de JWT ya verificados: hash del token -> (vencimiento en
+        # tiempo UNIX, nunca posterior al exp del token; payload)
+        self.jwt_cache_ttl = settings.jwt_cache_ttl_seconds if settings.jwt_cache_enabled else 0
+        self._token_cache: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()
     
     def hash_password(self, password: str) -> str:
         """Hashear contraseña usando bcrypt"""
         password_bytes = password.encode('utf-8')
         salt = bcrypt.gensalt(rounds=self.bcrypt_rounds)
-        hashed = bcrypt.hashpw(password_bytes, salt)
+        with self._bcrypt_slots:
+            hashed = bcrypt.hashpw(password_bytes, salt)
         return hashed.decode('utf-8')
     
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        """Verificar contraseña contra hash"""
+        """
+        Verificar contraseña contra hash
+        
+        bcrypt (>= 4.1) libera el GIL durante el KDF y el login es un endpoint
+        síncrono que corre en el threadpool, así que los logins concurrentes
+        se reparten entre núcleos en lugar de serializarse. Como mucho se
+        ejecutan ``bcrypt_max_concurrency`` a la vez (por defecto, un hash
+        por núcleo).
+        """
+        return self._checkpw(plain_password.encode('utf-8'), hashed_password.encode('ascii'))
+    
+    def _checkpw(self, password_bytes: bytes, hashed_bytes: bytes) -> bool:
+        """
+        Ejecutar bcrypt.checkpw con los valores ya codificados
+        
+        La contraseña se codifica en UTF-8 completo (nunca se descartan
+        caracteres); el hash bcrypt siempre es ASCII.
+        
+        Args:
+            password_bytes: Contraseña en texto plano codificada
+            hashed_bytes: Hash bcrypt almacenado codificado
+            
+        Returns:
+            True si la contraseña es correcta
+        """
+        with self._bcrypt_slots:
+            return bcrypt.checkpw(password_bytes, hashed_bytes)
+    
+    def verify_password_cached(self, plain_password: str, hashed_password: str) -> bool:
+        """
+        Verificar contraseña reutilizando verificaciones correctas recientes
+        
+        Solo se recuerdan aciertos; la clave incluye el hash almacenado, así
+        que un cambio de contraseña invalida la entrada.
+        
+        Args:
+            plain_password: Contraseña en texto plano
+            hashed_password: Hash bcrypt almacenado
+            
+        Returns:
+            True si la contraseña es correcta
+        """
+        # Cada valor se codifica una sola vez: sirve para la clave y para bcrypt
         password_bytes = plain_password.encode('utf-8')
-        hashed_bytes = hashed_password.encode('utf-8')
-        return bcrypt.checkpw(password_bytes, hashed_bytes)
+        hashed_bytes = hashed_password.encode('ascii')
+        if self.password_cache_ttl <= 0:
+            return self._checkpw(password_bytes, hashed_bytes)
+        
+        key = hmac.digest(self._password_cache_secret, hashed_bytes + b"\0" + password_bytes, "blake2b")
+        now = time.monotonic()
+        with self._user_cache_lock:
+            expires = self._password_cache.get(key)
+            if expires is not None:
+                if expires > now:
+                    return True
+                del self._password_cache[key]
+        
+        if not self._checkpw(password_bytes, hashed_bytes):
+            return False
+        
+        with self._user_cache_lock:
+            self._password_cache[key] = now + self.password_cache_ttl
+            while len(self._password_cache) > self.user_cache_max_size:
+                self._password_cache.popitem(last=False)
+        return True
     
     def authenticate_user(self, session: Session, username: str, password: str) -> Optional[User]:
         """
@@ -45,15 +210,14 @@ class AuthService:
         Returns:
             Usuario autenticado o None si las credenciales son inválidas
         """
-        # Buscar usuario por username
-        statement = select(User).where(User.username == username, User.is_active == True)
-        user = session.exec(statement).first()
+        # Buscar usuario por username (único: como mucho una fila)
+        user = session.scalars(_ACTIVE_USER_BY_USERNAME, {"username": username}).one_or_none()
         
         if not user:
             return None
         
-        # Verificar contraseña
-        if not self.verify_password(password, user.hashed_password):
+        # Verificar contraseña (bcrypt solo si no se verificó hace poco)
+        if not self.verify_password_cached(password, user.hashed_password):
             return None
         
         return user
@@ -71,16 +235,25 @@ class AuthService:
         """
         to_encode = user_data.copy()
         
-        now = datetime.now(timezone.utc)
+        # exp e iat viajan como segundos UNIX: se calculan como enteros sin
+        # construir datetimes con zona horaria
+        now = _now_ts()
         if expires_delta:
-            expire = now + expires_delta
+            expire = now + int(expires_delta.total_seconds())
         else:
-            expire = now + timedelta(minutes=self.access_token_expire_minutes)
+            expire = now + self._token_lifetime_seconds
         
         to_encode.update({"exp": expire, "iat": now})
         
-        encoded_jwt = jwt.encode(to_encode, self.secret_key, algorithm=self.algorithm)
-        return encoded_jwt
+        if self._hmac_digest is None:
+            return jwt.encode(to_encode, self.secret_key, algorithm=self.algorithm)
+        
+        # Mismo JSON que PyJWT: json.dumps compacto escapa lo que no es ASCII
+        # (orjson escribiría UTF-8 y el token ya no sería idéntico)
+        payload = json.dumps(to_encode, separators=(",", ":")).encode()
+        signing_input = self._token_header + _b64url(payload)
+        signature = hmac.digest(self._secret_bytes, signing_input, self._hmac_digest)
+        return (signing_input + b"." + _b64url(signature)).decode("ascii")
     
     def verify_token(self, token: str) -> Optional[dict]:
         """
@@ -92,28 +265,39 @@ class AuthService:
         Returns:
             Payload del token si es válido, None si es inválido
         """
+        # Un token verificado hace poco no se vuelve a decodificar; la
+        # entrada vence antes que el propio token, así que exp sigue vigente
+        key = self._token_key(token) if self.jwt_cache_ttl > 0 else None
+        if key is not None:
+            with self._user_cache_lock:
+                entry = self._token_cache.get(key)
+                if entry is not None:
+                    if entry[0] > _now_ts():
+                        self._token_cache.move_to_end(key)
+                        return dict(entry[1])
+                    del self._token_cache[key]
+        
         try:
-            payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
-            
-            # Verificar que el token no haya expirado
-            exp = payload.get("exp")
-            if exp is None:
-                return None
-            
-            # Convertir timestamp a datetime con timezone UTC
-            if isinstance(exp, (int, float)):
-                exp_datetime = datetime.fromtimestamp(exp, tz=timezone.utc)
-            else:
-                # Si exp ya es un datetime, asegurar que tenga timezone UTC
-                exp_datetime = exp.replace(tzinfo=timezone.utc) if exp.tzinfo is None else exp
-            
-            now = datetime.now(timezone.utc)
-            if now >= exp_datetime:
-                return None
-            
-            return payload
-        except JWTError:
+            # PyJWT exige exp y rechaza los tokens expirados
+            payload = _jwt.decode(
+                token,
+                self.secret_key,
+                algorithms=self._algorithms,
+                options={"require": ["exp"]}
+            )
+        except jwt.PyJWTError:
             return None
+        
+        # Solo se cachean tokens válidos
+        if key is not None:
+            expires = min(payload["exp"], _now_ts() + self.jwt_cache_ttl)
+            with self._user_cache_lock:
+                self._token_cache[key] = (expires, dict(payload))
+                self._token_cache.move_to_end(key)
+                while len(self._token_cache) > self.user_cache_max_size:
+                    self._token_cache.popitem(last=False)
+        
+        return payload
     
     def get_current_user(self, session: Session, token: str) -> Optional[User]:
         """
@@ -126,6 +310,13 @@ class AuthService:
         Returns:
             Usuario actual o None si el token es inválido
         """
+        # Un token ya resuelto hace poco no se vuelve a decodificar ni a
+        # buscar: la copia cacheada se adjunta a la sesión sin consultar la BD
+        key = self._token_key(token)
+        cached_user = self._get_cached_user(key)
+        if cached_user is not None:
+            return session.merge(cached_user, load=False)
+        
         payload = self.verify_token(token)
         if payload is None:
             return None
@@ -139,12 +330,148 @@ class AuthService:
         except (ValueError, TypeError):
             return None
         
-        # Buscar usuario en base de datos
-        statement = select(User).where(User.id == user_id, User.is_active == True)
-        user = session.exec(statement).first()
+        # Usuario ya resuelto con otro token: sin consulta a la BD
+        entry = self._get_cached_user_by_id(user_id)
+        if entry is not None:
+            self._cache_token_user(key, entry[1], entry[0], payload["exp"])
+            return session.merge(entry[1], load=False)
+        
+        # Buscar usuario en base de datos con la sentencia precompilada
+        user = session.scalars(_ACTIVE_USER_BY_ID, {"user_id": user_id}).one_or_none()
+        
+        if user is not None:
+            self._cache_user(key, user, payload["exp"])
         
         return user
     
+    def invalidate_token(self, token: str) -> None:
+        """
+        Descartar el usuario y el payload cacheados para un token (p. ej. al
+        cerrar sesión)
+        
+        Args:
+            token: Token JWT
+        """
+        key = self._token_key(token)
+        with self._user_cache_lock:
+            user_entry = self._user_cache.pop(key, None)
+            self._token_cache.pop(key, None)
+            if user_entry is not None:
+                self._users_by_id.pop(user_entry[1].id, None)
+    
+    def invalidate_user(self, user_id: int) -> None:
+        """
+        Descartar las copias cacheadas de un usuario (p. ej. tras cambiar su
+        contraseña o desactivarlo), con cualquier token
+        
+        Args:
+            user_id: ID del usuario
+        """
+        with self._user_cache_lock:
+            self._users_by_id.pop(user_id, None)
+            stale_keys = [key for key, (_, user) in self._user_cache.items() if user.id == user_id]
+            for key in stale_keys:
+                del self._user_cache[key]
+    
+    @staticmethod
+    def _token_key(token: str) -> bytes:
+        """Clave de caché de un token (no se guarda el token en claro)"""
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+    
+    def _get_cached_user(self, key: bytes) -> Optional[User]:
+        """
+        Obtener el usuario cacheado para un token si sigue vigente
+        
+        Args:
+            key: Clave del token
+            
+        Returns:
+            Copia desacoplada del usuario o None si no hay entrada vigente
+        """
+        if self.user_cache_ttl <= 0:
+            return None
+        
+        with self._user_cache_lock:
+            entry = self._user_cache.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._user_cache[key]
+                return None
+            self._user_cache.move_to_end(key)
+            return entry[1]
+    
+    def _get_cached_user_by_id(self, user_id: int) -> Optional[Tuple[float, User]]:
+        """
+        Obtener la copia cacheada de un usuario por su ID si sigue vigente
+        
+        Args:
+            user_id: ID del usuario
+            
+        Returns:
+            Tupla (vencimiento monotónico, copia desacoplada del usuario) o
+            None si no hay entrada vigente
+        """
+        if self.user_cache_ttl <= 0:
+            return None
+        
+        with self._user_cache_lock:
+            entry = self._users_by_id.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._users_by_id[user_id]
+                return None
+            self._users_by_id.move_to_end(user_id)
+            return entry
+    
+    def _cache_user(self, key: bytes, user: User, exp: float) -> None:
+        """
+        Cachear una copia desacoplada del usuario, por ID y para el token
+        
+        Args:
+            key: Clave del token
+            user: Usuario cargado de la base de datos
+            exp: Expiración del token (timestamp UNIX)
+        """
+        if self.user_cache_ttl <= 0:
+            return
+        
+        snapshot = User(**user.model_dump())
+        make_transient_to_detached(snapshot)
+        expires = time.monotonic() + self.user_cache_ttl
+        
+        with self._user_cache_lock:
+            self._users_by_id[user.id] = (expires, snapshot)
+            self._users_by_id.move_to_end(user.id)
+            while len(self._users_by_id) > self.user_cache_max_size:
+                self._users_by_id.popitem(last=False)
+        
+        self._cache_token_user(key, snapshot, expires, exp)
+    
+    def _cache_token_user(self, key: bytes, snapshot: User, expires: float, exp: float) -> None:
+        """
+        Asociar un token a una copia cacheada del usuario
+        
+        La entrada no sobrevive a la copia ni a la expiración del propio token.
+        
+        Args:
+            key: Clave del token
+            snapshot: Copia desacoplada del usuario
+            expires: Vencimiento monotónico de la copia
+            exp: Expiración del token (timestamp UNIX)
+        """
+        now = time.monotonic()
+        expires = min(expires, now + exp - time.time())
+        if expires <= now:
+            return
+        
+        with self._user_cache_lock:
+            self._user_cache[key] = (expires, snapshot)
+            self._user_cache.move_to_end(key)
+            while len(self._user_cache) > self.user_cache_max_size:
+                self._user_cache.popitem(last=False)
+    
     def create_user_token_data(self, user: User) -> dict:
         """
         Crear datos para incluir en el token JWT
@@ -0,0 +1,187 @@
+"""
+Caché de respuestas para CardDemo API: entradas compartidas en Redis y
+validación condicional HTTP (ETag / If-None-Match)
+"""
+from typing import Any, Optional
+import hashlib
+import logging
+
+import orjson
+from fastapi import Request, Response
+from fastapi.responses import ORJSONResponse
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Tiempo máximo de espera de Redis: una caché lenta no debe frenar la petición
+_REDIS_TIMEOUT_SECONDS = 0.05
+
+
+class ResponseCache:
+    """
+    Caché de respuestas de lectura por usuario
+    
+    Solo se activa con Redis: la invalidación (p. ej. tras un PUT) debe verse
+    en todos los workers, algo que una caché en memoria por proceso no
+    garantiza. Sin Redis, o si Redis falla, cada lectura es un fallo de caché
+    y la petición sigue contra la base de datos.
+    """
+    
+    def __init__(self, redis_url: Optional[str] = None, ttl: int = 60):
+        """
+        Inicializar caché de respuestas
+        
+        Args:
+            redis_url: URL de Redis; sin ella la caché queda desactivada
+            ttl: Segundos de vida de cada entrada
+        """
+        self.ttl = ttl
+        self._redis = None
+        if redis_url and ttl > 0:
+            try:
+                import redis
+            except ImportError:
+                logger.warning("Paquete redis no instalado; caché de respuestas desactivada")
+            else:
+                self._redis = redis.Redis.from_url(
+                    redis_url,
+                    socket_timeout=_REDIS_TIMEOUT_SECONDS,
+                    socket_connect_timeout=_REDIS_TIMEOUT_SECONDS
+                )
+    
+    @property
+    def enabled(self) -> bool:
+        """Indica si la caché está activa"""
+        return self._redis is not None
+    
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Obtener una respuesta cacheada
+        
+        Args:
+            key: Clave de la entrada
+        
+        Returns:
+            Datos deserializados o None si no hay entrada
+        """
+        if self._redis is None:
+            return None
+        try:
+            value = self._redis.get(key)
+        except Exception as e:
+            logger.warning(f"Redis no disponible para la caché de respuestas: {e}")
+            return None
+        return orjson.loads(value) if value is not None else None
+    
+    def set(self, key: str, value: Any) -> None:
+        """
+        Guardar una respuesta serializable a JSON
+        
+        Args:
+            key: Clave de la entrada
+            value: Datos a cachear
+        """
+        if self._redis is None:
+            return
+        try:
+            self._redis.set(key, orjson.dumps(value), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar la respuesta en caché: {e}")
+    
+    def delete(self, key: str) -> None:
+        """
+        Invalidar una entrada
+        
+        Args:
+            key: Clave de la entrada
+        """
+        if self._redis is None:
+            return
+        try:
+            self._redis.delete(key)
+        except Exception as e:
+            logger.warning(f"No se pudo invalidar la caché de respuestas: {e}")
+
+
+def compute_etag(data: Any) -> str:
+    """
+    Calcular un ETag débil a partir del contenido JSON de una respuesta
+    
+    Args:
+        data: Datos serializables a JSON
+        
+    Returns:
+        ETag débil (``W/"..."``)
+    """
+    digest = hashlib.blake2b(orjson.dumps(data, option=orjson.OPT_SORT_KEYS), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Comprobar una cabecera If-None-Match (comparación débil, RFC 9110)
+    
+    Args:
+        if_none_match: Valor de la cabecera If-None-Match
+        etag: ETag actual del recurso
+        
+    Returns:
+        True si el cliente ya tiene la representación actual
+    """
+    if not if_none_match:
+        return False
+    opaque_tag = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque_tag:
+            return True
+    return False
+
+
+def conditional_json_response(request: Request, data: Any) -> Response:
+    """
+    Responder con ETag, o con 304 si el cliente ya tiene la representación
+    
+    Los datos deben estar ya validados y en modo JSON (``model_dump(mode="json")``):
+    se envían tal cual, sin volver a pasar por el ``response_model``.
+    
+    Args:
+        request: Petición entrante
+        data: Datos de la respuesta
+        
+    Returns:
+        Respuesta 304 sin cuerpo o respuesta JSON con ETag
+    """
+    # Datos privados de cada usuario: solo caché del cliente y revalidando
+    headers = {"ETag": compute_etag(data), "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(content=data, headers=headers)
+
+
+def account_cache_key(user_id: int) -> str:
+    """Clave de caché de la cuenta de un usuario"""
+    return f"acc:{user_id}"
+
+
+def cards_cache_key(user_id: int) -> str:
+    """Clave de caché del listado de tarjetas de un usuario"""
+    return f"cards:{user_id}"
+
+
+# Instancia global de la caché de respuestas
+_response_cache = None
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Obtener instancia global de la caché de respuestas
+    
+    Returns:
+        Instancia de ResponseCache
+    """
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(settings.redis_url, settings.response_cache_ttl_seconds)
+    return _response_cache
@@ -1,18 +1,36 @@
 """
 Servicio de gestión de tarjetas de crédito para CardDemo API
 """
-from typing import List, Optional
+from typing import List, Optional, Tuple
+from sqlalchemy import Row, case, func, insert, lambda_stmt, update
 from sqlmodel import Session, select
-from datetime import datetime, timezone
 from decimal import Decimal
 import logging
 
 from models.database_models import CreditCard, Account
 from models.api_models import CardResponse
-from services.encryption_service import get_encryption_service
+from services.encryption_service import LEGACY_TOKEN_PREFIX, get_encryption_service, unwrap_legacy_token
 
 logger = logging.getLogger(__name__)
 
+# Columnas de tarjeta que necesita CardResponse. El número encriptado (un
+# token Fernet de ~120 bytes) solo se lee para las tarjetas anteriores a
+# masked_card_number, que se enmascaran al vuelo; en el resto llega NULL
+_CARD_RESPONSE_COLUMNS = (
+    CreditCard.id,
+    case(
+        (CreditCard.masked_card_number == None, CreditCard.card_number)
+    ).label("card_number"),
+    CreditCard.masked_card_number,
+    CreditCard.card_type,
+    CreditCard.expiry_month,
+    CreditCard.expiry_year,
+    CreditCard.status,
+    CreditCard.credit_limit,
+    CreditCard.available_credit,
+    CreditCard.created_at
+)
+
 
 class CardService:
     """Servicio para manejo de tarjetas de crédito con encriptación"""
@@ -31,8 +49,36 @@ class CardService:
         Returns:
             Lista de tarjetas de la cuenta
         """
-        statement = select(CreditCard).where(CreditCard.account_id == account_id)
-        return list(session.exec(statement).all())
+        statement = lambda_stmt(lambda: select(CreditCard).where(CreditCard.account_id == account_id))
+        return list(session.scalars(statement).all())
+    
+    def get_user_cards(self, session: Session, user_id: int) -> Tuple[Optional[int], List[Row]]:
+        """
+        Obtener la cuenta del usuario y sus tarjetas en una sola consulta
+        
+        LEFT JOIN de cuentas con tarjetas filtrado por usuario, leyendo solo
+        las columnas de la respuesta (sin cargar entidades ni sus relaciones).
+        
+        Args:
+            session: Sesión de base de datos
+            user_id: ID del usuario
+            
+        Returns:
+            Tupla con (ID de la cuenta o None si el usuario no tiene cuenta,
+            filas de tarjetas con los campos de ``CardResponse``)
+        """
+        statement = (
+            select(Account.id.label("account_id"), *_CARD_RESPONSE_COLUMNS)
+            .outerjoin(CreditCard, CreditCard.account_id == Account.id)
+            .where(Account.user_id == user_id)
+            .order_by(CreditCard.id)
+        )
+        rows = session.exec(statement).all()
+        
+        if not rows:
+            return None, []
+        # Una cuenta sin tarjetas devuelve una única fila con la tarjeta a NULL
+        return rows[0].account_id, [row for row in rows if row.id is not None]
     
     def get_card_by_id(self, session: Session, card_id: int, account_id: int) -> Optional[CreditCard]:
         """
@@ -46,11 +92,12 @@ class CardService:
         Returns:
             Tarjeta si existe y pertenece a la cuenta, None en caso contrario
         """
-        statement = select(CreditCard).where(
-            CreditCard.id == card_id,
-            CreditCard.account_id == account_id
-        )
-        return session.exec(statement).first()
+        # Carga por clave primaria: si la tarjeta ya está en la sesión no
+        # se lanza ninguna consulta
+        card = session.get(CreditCard, card_id)
+        if card is None or card.account_id != account_id:
+            return None
+        return card
     
     def mask_card_number(self, card_number: str) -> str:
         """
@@ -73,14 +120,15 @@ class CardService:
         Convertir modelo de base de datos a modelo de respuesta
         
         Args:
-            card: Tarjeta de la base de datos
+            card: Tarjeta de la base de datos (o fila con sus columnas)
             
         Returns:
             Modelo de respuesta con número enmascarado
         """
         return CardResponse(
             id=card.id,
-            masked_card_number=self.mask_card_number(card.card_number),
+            # Las tarjetas anteriores a la columna se enmascaran al vuelo
+            masked_card_number=card.masked_card_number or self.mask_card_number(card.card_number),
             card_type=card.card_type,
             expiry_month=card.expiry_month,
             expiry_year=card.expiry_year,
@@ -120,34 +168,34 @@ class CardService:
             }
         ]
         
-        created_cards = []
+        rows = []
         for card_data in sample_cards:
             try:
                 # Encriptar número de tarjeta antes de guardar
                 encrypted_number = self.encryption_service.encrypt_card_number(card_data["card_number"])
                 
-                card = CreditCard(
-                    account_id=account_id,
-                    card_number=encrypted_number,  # Guardar encriptado
-                    card_type=card_data["card_type"],
-                    expiry_month=card_data["expiry_month"],
-                    expiry_year=card_data["expiry_year"],
-                    status="ACTIVE",
-                    credit_limit=card_data["credit_limit"],
-                    available_credit=card_data["available_credit"],
-                    created_at=datetime.now(timezone.utc)
-                )
-                session.add(card)
-                created_cards.append(card)
+                rows.append({
+                    **card_data,
+                    "account_id": account_id,
+                    "card_number": encrypted_number,  # Guardar encriptado
+                    "masked_card_number": self.mask_card_number(card_data["card_number"]),
+                    "status": "ACTIVE"
+                })
                 
             except Exception as e:
                 logger.error(f"Error creating sample card: {e}")
                 continue
         
-        if created_cards:
-            session.commit()
-            for card in created_cards:
-                session.refresh(card)
+        if not rows:
+            return []
+        
+        # Un único INSERT multi-fila; RETURNING devuelve las tarjetas ya
+        # cargadas (con su ID) sin un SELECT de refresco por fila
+        created_cards = list(session.scalars(
+            insert(CreditCard).returning(CreditCard),
+            rows
+        ))
+        session.commit()
         
         return created_cards
     
@@ -162,23 +210,95 @@ class CardService:
         Returns:
             Número de tarjetas actualizadas
         """
-        cards = session.exec(select(CreditCard)).all()
-        updated_count = 0
+        # Los números encriptados son más largos: el filtro se hace en SQL y
+        # solo se leen (id, número) de las tarjetas sin encriptar
+        plain_cards = session.exec(
+            select(CreditCard.id, CreditCard.card_number)
+            .where(func.length(CreditCard.card_number) <= 20)
+        ).all()
         
-        for card in cards:
+        rows = []
+        for card_id, card_number in plain_cards:
             try:
-                # Verificar si ya está encriptado (los números encriptados son más largos)
-                if len(card.card_number) <= 20:  # Número sin encriptar
-                    encrypted_number = self.encryption_service.encrypt_card_number(card.card_number)
-                    card.card_number = encrypted_number
-                    updated_count += 1
-                    
+                rows.append({
+                    "id": card_id,
+                    "card_number": self.encryption_service.encrypt_card_number(card_number)
+                })
             except Exception as e:
-                logger.error(f"Error encrypting card {card.id}: {e}")
+                logger.error(f"Error encrypting card {card_id}: {e}")
                 continue
         
-        if updated_count > 0:
+        if rows:
+            # UPDATE masivo por clave primaria (executemany), sin cargar
+            # las tarjetas en la sesión ni seguir cambios fila a fila
+            session.execute(update(CreditCard), rows)
+            session.commit()
+            logger.info(f"Encrypted {len(rows)} card numbers")
+        
+        return len(rows)
+    
+    def unwrap_legacy_card_numbers(self, session: Session) -> int:
+        """
+        Quitar la capa de base64 extra de los números encriptados con el
+        formato anterior (Función de migración)
+        
+        Args:
+            session: Sesión de base de datos
+            
+        Returns:
+            Número de tarjetas actualizadas
+        """
+        # El token Fernet interior no cambia: no hace falta desencriptar
+        legacy_cards = session.exec(
+            select(CreditCard.id, CreditCard.card_number)
+            .where(CreditCard.card_number.startswith(LEGACY_TOKEN_PREFIX))
+        ).all()
+        
+        rows = [
+            {"id": card_id, "card_number": unwrap_legacy_token(card_number)}
+            for card_id, card_number in legacy_cards
+        ]
+        
+        if rows:
+            session.execute(update(CreditCard), rows)
+            session.commit()
+            logger.info(f"Unwrapped {len(rows)} legacy card numbers")
+        
+        return len(rows)
+    
+    def backfill_masked_card_numbers(self, session: Session) -> int:
+        """
+        Calcular y guardar la máscara de las tarjetas que aún no la tienen
+        (Función de migración)
+        
+        Args:
+            session: Sesión de base de datos
+            
+        Returns:
+            Número de tarjetas actualizadas
+        """
+        # El número está encriptado, así que la máscara no se puede
+        # calcular en SQL: se desencripta una única vez por tarjeta
+        cards = session.exec(
+            select(CreditCard).where(CreditCard.masked_card_number == None)
+        ).all()
+        
+        masked_count = 0
+        for card in cards:
+            card_number = card.card_number
+            if len(card_number) > 20:  # Probablemente encriptado
+                # Sin pasar por mask_card_number: su máscara genérica de
+                # error quedaría guardada y la tarjeta no se reintentaría
+                try:
+                    card_number = self.encryption_service.decrypt_card_number(card_number)
+                except Exception as e:
+                    logger.error(f"Error decrypting card {card.id} for masking: {e}")
+                    continue
+            card.masked_card_number = self.encryption_service.mask_card_number(card_number)
+            masked_count += 1
+        
+        if masked_count:
             session.commit()
-            logger.info(f"Encrypted {updated_count} card numbers")
+            logger.info(f"Masked {masked_count} card numbers")
         
-        return updated_count
\ No newline at end of file
+        return masked_count
\ No newline at end of file
@@ -2,15 +2,109 @@
 Servicio de encriptación para datos sensibles en CardDemo API
 """
 import base64
+import hmac
 import os
-from typing import Optional
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import logging
 
+from config import settings
+
 logger = logging.getLogger(__name__)
 
+# Separador para sanitizar varios strings en una sola pasada: ningún patrón
+# peligroso ni escape lo contiene, así que ninguna coincidencia lo cruza
+_BATCH_SEPARATOR = "\x00"
+
+# Patrones peligrosos para sanitize_input, compilados en una sola expresión
+_DANGEROUS_PATTERNS = [
+    '<script', '</script>',
+    'javascript:', 'vbscript:',
+    'onload=', 'onerror=', 'onclick=',
+    'eval(', 'exec(',
+    'DROP TABLE', 'DELETE FROM', 'INSERT INTO', 'UPDATE SET',
+    '--', '/*', '*/',
+    'UNION SELECT', 'OR 1=1', 'AND 1=1'
+]
+_DANGEROUS_PATTERN_RE = re.compile('|'.join(map(re.escape, _DANGEROUS_PATTERNS)), re.IGNORECASE)
+
+
+# Escapes HTML aplicados con str.translate
+_HTML_ESCAPES = str.maketrans({
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    "'": '&#x27;',
+    '&': '&amp;'
+})
+
+
+# Claves Fernet ya derivadas por contraseña: PBKDF2 (100k iteraciones) solo
+# se ejecuta una vez por clave y proceso
+_DERIVED_KEY_CACHE: Dict[bytes, bytes] = {}
+
+
+# Los tokens Fernet empiezan por el byte de versión 0x80 ("gAAAAA" en base64).
+# El formato anterior los envolvía en otra capa de base64, que empieza por
+# la codificación de ese mismo prefijo
+LEGACY_TOKEN_PREFIX = base64.urlsafe_b64encode(b"gAAAAA").decode()
+
+
+def _digits_only(text: str) -> str:
+    """Quitar los caracteres no numéricos (sin copiar si ya son solo dígitos)"""
+    if text.isdigit():
+        return text
+    return ''.join(filter(str.isdigit, text))
+
+
+@lru_cache(maxsize=32)
+def _mask_template(length: int) -> str:
+    """
+    Plantilla de máscara para números de ``length`` dígitos
+    
+    Asteriscos y huecos ``{}`` para los últimos 4 dígitos, agrupados de 4 en
+    4 con espacios. Solo depende de la longitud, así que se calcula una vez.
+    
+    Args:
+        length: Número de dígitos (al menos 4)
+        
+    Returns:
+        Plantilla para ``str.format`` con cuatro campos
+    """
+    chars = ["*"] * (length - 4) + ["{}"] * 4
+    return " ".join("".join(chars[i:i + 4]) for i in range(0, length, 4))
+
+
+# Formato actual: base64 URL-safe de versión (1 byte) + nonce (12) + texto
+# cifrado con AES-256-GCM y su tag. El byte de versión distingue estos tokens
+# de los Fernet anteriores (que empiezan por 0x80) y va como dato asociado
+_AESGCM_VERSION = b"\x01"
+_AESGCM_NONCE_SIZE = 12
+# Etiqueta para derivar la clave AES-GCM sin reutilizar la de Fernet
+_AESGCM_KEY_LABEL = b"carddemo-aesgcm-v1"
+
+
+def unwrap_legacy_token(encrypted_data: str) -> str:
+    """
+    Quitar la capa de base64 extra de un token del formato anterior
+    
+    No requiere la clave: el token Fernet interior no cambia.
+    
+    Args:
+        encrypted_data: Token en formato actual o anterior
+        
+    Returns:
+        Token Fernet sin la capa extra (los actuales se devuelven tal cual)
+    """
+    if encrypted_data.startswith(LEGACY_TOKEN_PREFIX):
+        return base64.urlsafe_b64decode(encrypted_data.encode('ascii')).decode('ascii')
+    return encrypted_data
+
 
 class EncryptionService:
     """Servicio para encriptar y desencriptar datos sensibles"""
@@ -26,8 +120,8 @@ class EncryptionService:
             # Usar clave proporcionada
             self._key = encryption_key.encode()
         else:
-            # Generar clave desde variable de entorno o crear una nueva
-            env_key = os.getenv("ENCRYPTION_KEY")
+            # Generar clave desde Secrets Manager / variable de entorno o crear una nueva
+            env_key = settings.get_secret("encryption_key", os.getenv("ENCRYPTION_KEY"))
             if env_key:
                 self._key = env_key.encode()
             else:
@@ -36,19 +130,34 @@ class EncryptionService:
                 self._key = Fernet.generate_key()
                 logger.warning("Using temporary encryption key. Set ENCRYPTION_KEY environment variable for production.")
         
-        # Crear instancia de Fernet para encriptación simétrica
-        self._fernet = Fernet(self._derive_key(self._key))
+        # AES-GCM cifra y autentica en una sola pasada (AES-NI + PCLMULQDQ);
+        # Fernet se conserva solo para leer los datos encriptados antes
+        fernet_key = self._derive_key(self._key)
+        self._fernet = Fernet(fernet_key)
+        self._aead = AESGCM(hmac.digest(base64.urlsafe_b64decode(fernet_key), _AESGCM_KEY_LABEL, "sha256"))
+        
+        # Máscaras ya calculadas por texto cifrado (propia de cada instancia,
+        # porque depende de la clave). Solo se guarda la máscara: el número
+        # en claro se descarta tras enmascararlo
+        self._masked_for_ciphertext = lru_cache(maxsize=10_000)(self._mask_ciphertext)
     
     def _derive_key(self, password: bytes) -> bytes:
         """
         Derivar clave de encriptación usando PBKDF2
         
+        El resultado se memoriza por contraseña en ``_DERIVED_KEY_CACHE``:
+        construir otra instancia con la misma clave no repite la derivación.
+        
         Args:
             password: Contraseña base
             
         Returns:
             Clave derivada para Fernet
         """
+        cached = _DERIVED_KEY_CACHE.get(password)
+        if cached is not None:
+            return cached
+        
         # Salt fijo para consistencia (en producción debería ser único por instalación)
         salt = b'carddemo_salt_2024'
         
@@ -59,8 +168,8 @@ class EncryptionService:
             iterations=100000,
         )
         
-        key = base64.urlsafe_b64encode(kdf.derive(password))
-        return key
+        # Cada PBKDF2HMAC solo puede derivar una vez: se crea solo en los fallos
+        return _DERIVED_KEY_CACHE.setdefault(password, base64.urlsafe_b64encode(kdf.derive(password)))
     
     def encrypt(self, data: str) -> str:
         """
@@ -70,14 +179,15 @@ class EncryptionService:
             data: Datos a encriptar
             
         Returns:
-            Datos encriptados en formato base64
+            Token AES-GCM versionado, en base64 URL-safe
         """
         if not data:
             return data
         
         try:
-            encrypted_data = self._fernet.encrypt(data.encode())
-            return base64.urlsafe_b64encode(encrypted_data).decode()
+            nonce = os.urandom(_AESGCM_NONCE_SIZE)
+            ciphertext = self._aead.encrypt(nonce, data.encode(), _AESGCM_VERSION)
+            return base64.urlsafe_b64encode(_AESGCM_VERSION + nonce + ciphertext).decode('ascii')
         except Exception as e:
             logger.error(f"Error encrypting data: {e}")
             raise ValueError("Failed to encrypt data")
@@ -86,8 +196,11 @@ class EncryptionService:
         """
         Desencriptar datos
         
+        Acepta también los formatos anteriores: tokens Fernet, con o sin la
+        capa de base64 adicional, se detectan por su byte de versión.
+        
         Args:
-            encrypted_data: Datos encriptados en formato base64
+            encrypted_data: Token AES-GCM o Fernet
             
         Returns:
             Datos desencriptados
@@ -96,9 +209,12 @@ class EncryptionService:
             return encrypted_data
         
         try:
-            decoded_data = base64.urlsafe_b64decode(encrypted_data.encode())
-            decrypted_data = self._fernet.decrypt(decoded_data)
-            return decrypted_data.decode()
+            token = unwrap_legacy_token(encrypted_data).encode('ascii')
+            raw = base64.urlsafe_b64decode(token)
+            if raw[:1] == _AESGCM_VERSION:
+                nonce_end = 1 + _AESGCM_NONCE_SIZE
+                return self._aead.decrypt(raw[1:nonce_end], raw[nonce_end:], _AESGCM_VERSION).decode()
+            return self._fernet.decrypt(token).decode()
         except Exception as e:
             logger.error(f"Error decrypting data: {e}")
             raise ValueError("Failed to decrypt data")
@@ -114,7 +230,7 @@ class EncryptionService:
             Número de tarjeta encriptado
         """
         # Remover espacios y caracteres no numéricos
-        clean_number = ''.join(filter(str.isdigit, card_number))
+        clean_number = _digits_only(card_number)
         return self.encrypt(clean_number)
     
     def decrypt_card_number(self, encrypted_card_number: str) -> str:
@@ -140,30 +256,52 @@ class EncryptionService:
             Número de tarjeta enmascarado (ej: **** **** **** 1234)
         """
         try:
-            # Si está encriptado, desencriptar primero
+            # Si está encriptado, desencriptar (solo la primera vez por texto cifrado)
             if len(card_number) > 20:  # Probablemente encriptado
-                decrypted = self.decrypt_card_number(card_number)
-            else:
-                decrypted = card_number
-            
-            # Limpiar número
-            clean_number = ''.join(filter(str.isdigit, decrypted))
-            
-            if len(clean_number) < 4:
-                return "*" * len(clean_number)
-            
-            # Mostrar solo los últimos 4 dígitos
-            masked = "*" * (len(clean_number) - 4) + clean_number[-4:]
-            
-            # Formatear con espacios cada 4 dígitos
-            formatted = ' '.join([masked[i:i+4] for i in range(0, len(masked), 4)])
-            
-            return formatted
+                return self._masked_for_ciphertext(card_number)
+            return self._mask_digits(card_number)
             
         except Exception as e:
             logger.error(f"Error masking card number: {e}")
             return "**** **** **** ****"
     
+    def _mask_ciphertext(self, encrypted_card_number: str) -> str:
+        """
+        Desencriptar y enmascarar un número de tarjeta (cacheado por instancia
+        en ``_masked_for_ciphertext``; los errores no se cachean)
+        
+        Args:
+            encrypted_card_number: Número de tarjeta encriptado
+            
+        Returns:
+            Número de tarjeta enmascarado
+        """
+        return self._mask_digits(self.decrypt_card_number(encrypted_card_number))
+    
+    @staticmethod
+    def _mask_digits(card_number: str) -> str:
+        """
+        Enmascarar un número de tarjeta en claro
+        
+        Args:
+            card_number: Número de tarjeta (puede incluir separadores)
+            
+        Returns:
+            Número de tarjeta enmascarado
+        """
+        # Limpiar número
+        clean_number = _digits_only(card_number)
+        
+        # Caso habitual (16 dígitos): prefijo constante y últimos 4
+        if len(clean_number) == 16:
+            return f"**** **** **** {clean_number[-4:]}"
+        
+        if len(clean_number) < 4:
+            return "*" * len(clean_number)
+        
+        # Mostrar solo los últimos 4 dígitos, con espacios cada 4 posiciones
+        return _mask_template(len(clean_number)).format(*clean_number[-4:])
+    
     def sanitize_input(self, input_data: str) -> str:
         """
         Sanitizar entrada para prevenir inyección
@@ -177,33 +315,53 @@ class EncryptionService:
         if not input_data:
             return input_data
         
-        # Lista de patrones peligrosos
-        dangerous_patterns = [
-            '<script', '</script>',
-            'javascript:', 'vbscript:',
-            'onload=', 'onerror=', 'onclick=',
-            'eval(', 'exec(',
-            'DROP TABLE', 'DELETE FROM', 'INSERT INTO', 'UPDATE SET',
-            '--', '/*', '*/',
-            'UNION SELECT', 'OR 1=1', 'AND 1=1'
-        ]
-        
-        sanitized = input_data
-        
-        # Remover patrones peligrosos (case insensitive)
-        for pattern in dangerous_patterns:
-            sanitized = sanitized.replace(pattern.lower(), '')
-            sanitized = sanitized.replace(pattern.upper(), '')
-            sanitized = sanitized.replace(pattern.capitalize(), '')
-        
-        # Escapar caracteres especiales
-        sanitized = sanitized.replace('<', '&lt;')
-        sanitized = sanitized.replace('>', '&gt;')
-        sanitized = sanitized.replace('"', '&quot;')
-        sanitized = sanitized.replace("'", '&#x27;')
-        sanitized = sanitized.replace('&', '&amp;')
-        
-        return sanitized.strip()
+        return self._remove_dangerous_content(input_data).strip()
+    
+    def sanitize_batch(self, inputs: List[str]) -> List[str]:
+        """
+        Sanitizar varios strings en una sola pasada
+        
+        Une los strings con un separador y aplica cada reemplazo una sola vez
+        sobre el texto completo, en lugar de una vez por string.
+        
+        Args:
+            inputs: Strings de entrada
+            
+        Returns:
+            Strings sanitizados, en el mismo orden (mismo resultado que
+            aplicar ``sanitize_input`` a cada uno)
+        """
+        if len(inputs) < 2:
+            return [self.sanitize_input(item) for item in inputs]
+        
+        joined = _BATCH_SEPARATOR.join(inputs)
+        if joined.count(_BATCH_SEPARATOR) != len(inputs) - 1:
+            # Algún string contiene el separador: sanitizar uno a uno
+            return [self.sanitize_input(item) for item in inputs]
+        
+        sanitized = self._remove_dangerous_content(joined)
+        return [part.strip() for part in sanitized.split(_BATCH_SEPARATOR)]
+    
+    def _remove_dangerous_content(self, text: str) -> str:
+        """
+        Remover patrones peligrosos y escapar caracteres especiales
+        
+        Args:
+            text: Texto de entrada
+            
+        Returns:
+            Texto sin patrones peligrosos y con caracteres escapados
+        """
+        # Remover patrones peligrosos (sin distinguir mayúsculas) en una sola
+        # pasada por ronda; se repite por si una eliminación forma un patrón
+        # nuevo ("DROP TA--BLE")
+        sanitized, removed = _DANGEROUS_PATTERN_RE.subn('', text)
+        while removed:
+            sanitized, removed = _DANGEROUS_PATTERN_RE.subn('', sanitized)
+        
+        # Escapar caracteres especiales (traducción simultánea: '&' no vuelve
+        # a escapar los '&' de las entidades ya generadas)
+        return sanitized.translate(_HTML_ESCAPES)
 
 
 # Instancia global del servicio de encriptación
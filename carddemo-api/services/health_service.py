@@ -1,8 +1,9 @@
 """
 Servicio de monitoreo de salud del sistema para CardDemo API
 """
+import threading
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 from datetime import datetime, timezone
 
 from database import check_database_health
@@ -17,6 +18,20 @@ class HealthService:
     
     def __init__(self):
         self.start_time = time.time()
+        # Parte constante de la salud básica (los balanceadores la consultan
+        # varias veces por segundo): solo el timestamp cambia en cada llamada
+        self._service_info = {
+            "service": settings.app_name,
+            "version": settings.app_version
+        }
+        
+        # Última comprobación de BD: (instante monotónico, resultado). Los
+        # health checks del balanceador llegan varias veces por segundo y
+        # cada comprobación ocupa una conexión del pool; el lock hace que
+        # las llamadas concurrentes esperen a una única comprobación
+        self.database_check_ttl = settings.health_cache_ttl_seconds
+        self._database_check: Optional[Tuple[float, Dict[str, Any]]] = None
+        self._database_check_lock = threading.Lock()
     
     def get_basic_health(self) -> Dict[str, Any]:
         """
@@ -26,12 +41,7 @@ class HealthService:
             Diccionario con información básica de salud
         """
         logger.debug("Verificando salud básica del sistema")
-        return {
-            "status": "healthy",
-            "service": settings.app_name,
-            "version": settings.app_version,
-            "timestamp": datetime.now(timezone.utc)
-        }
+        return {"status": "healthy", **self._service_info, "timestamp": datetime.now(timezone.utc)}
     
     def get_detailed_health(self) -> Dict[str, Any]:
         """
@@ -45,8 +55,8 @@ class HealthService:
         # Información básica
         health_info = self.get_basic_health()
         
-        # Verificar conectividad de base de datos usando la nueva función
-        database_status = check_database_health()
+        # Verificar conectividad de base de datos (resultado reciente cacheado)
+        database_status = self._check_database_health()
         
         # Calcular uptime
         uptime = time.time() - self.start_time
@@ -69,12 +79,25 @@ class HealthService:
     def _check_database_health(self) -> Dict[str, Any]:
         """
         Verificar conectividad y rendimiento de la base de datos
-        Delegado a la función mejorada en database.py
+        Delegado a la función mejorada en database.py; el resultado se
+        reutiliza durante ``database_check_ttl`` segundos
         
         Returns:
             Diccionario con estado de la base de datos
         """
-        return check_database_health()
+        with self._database_check_lock:
+            cached = self._database_check
+            if cached is not None and time.monotonic() - cached[0] < self.database_check_ttl:
+                return dict(cached[1])
+            
+            database_status = check_database_health()
+            self._database_check = (time.monotonic(), database_status)
+            return dict(database_status)
+    
+    def invalidate_cache(self) -> None:
+        """Descartar la comprobación de BD cacheada (la siguiente consulta la repite)"""
+        with self._database_check_lock:
+            self._database_check = None
     
     def check_component_health(self, component: str) -> Dict[str, Any]:
         """
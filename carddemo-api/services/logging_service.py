@@ -1,29 +1,128 @@
 """
 Servicio de logging seguro para CardDemo API
 """
+import atexit
 import logging
+import logging.handlers
 import json
+import queue
 import re
-from typing import Any, Dict, Optional
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
 from datetime import datetime, timezone
 from pathlib import Path
 import os
 
+try:
+    # RE2 garantiza tiempo lineal: sin retroceso catastrófico ante mensajes
+    # manipulados (p. ej. el patrón de email sobre "a.a.a.a...")
+    import re2
+except ImportError:
+    re2 = None
+
+
+# Patrones de datos sensibles, en orden de prioridad. Los de clave-valor
+# nombran la clave (<tipo>_key) para conservarla al redactar el valor
+_SENSITIVE_SOURCES = {
+    'password': r'(?P<password_key>password|passwd|pwd)["\']?\s*[:=]\s*["\']?[^"\'\s,}]+',
+    'token': r'(?P<token_key>token|jwt|bearer)["\']?\s*[:=]\s*["\']?[^"\'\s,}]+',
+    'card_number': r'\b\d{4}[\s-]?\d{4}[\s-]?\d{4}[\s-]?\d{4}\b',
+    'ssn': r'\b\d{3}-?\d{2}-?\d{4}\b',
+    'email': r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
+    'phone': r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b',
+    'api_key': r'(?P<api_key_key>api[_-]?key|apikey)["\']?\s*[:=]\s*["\']?[^"\'\s,}]+',
+}
+
+_KEY_VALUE_TYPES = frozenset({'password', 'token', 'api_key'})
+
+# Una pasada por patrón y en este orden: cada pasada ve el resultado de la
+# anterior, y una alternancia única no equivale (un email o un token puede
+# consumir la clave de otro par, p. ej. "admin@corp.iotoken=abc", y dejar su
+# valor sin enmascarar). Cada patrón tiene un grupo con su nombre para que
+# match.lastgroup indique el tipo. El flag va en línea porque re2.compile no
+# acepta flags de re
+_SENSITIVE_PASSES = tuple(
+    (re2 or re).compile(('(?i)' if name in _KEY_VALUE_TYPES else '') + f'(?P<{name}>{source})')
+    for name, source in _SENSITIVE_SOURCES.items()
+)
+
+# Prefiltro de _SENSITIVE_PASSES: sin dígitos, sin "@" y sin ninguna de
+# estas subcadenas ningún patrón puede coincidir y el mensaje se devuelve tal
+# cual
+_DIGIT_RE = re.compile(r'\d')
+_TRIGGER_SUBSTRINGS = ('passw', 'pwd', 'token', 'jwt', 'bearer', 'apikey', 'api_key', 'api-key')
+# casefold() iguala todo lo que IGNORECASE considera equivalente salvo la
+# i turca (İ se pliega a "i" + punto combinante, ı no se pliega)
+_CASEFOLD_FIXES = str.maketrans({'\u0131': 'i', '\u0307': None})
+
+# Claves de datos extra cuyo valor se redacta sin examinarlo (también como
+# parte de la clave: new_password, refresh_token...)
+_SENSITIVE_KEY_RE = re.compile(r'password|passwd|pwd|token|jwt|api[_-]?key|card_number|ssn', re.IGNORECASE)
+# Los patrones numéricos (SSN, teléfono, tarjeta) necesitan al menos 9
+# dígitos: un entero menor no puede contener datos sensibles
+_MAX_SAFE_INT = 10 ** 8
+
+
+def _may_contain_sensitive(message: str) -> bool:
+    """
+    Comprobar con operaciones de cadena si algún patrón sensible puede coincidir
+    
+    Args:
+        message: Mensaje a comprobar
+        
+    Returns:
+        False solo si es seguro que ningún patrón sensible coincide
+    """
+    if '@' in message or _DIGIT_RE.search(message) is not None:
+        return True
+    if message.isascii():
+        folded = message.lower()
+    else:
+        folded = message.casefold().translate(_CASEFOLD_FIXES)
+    return any(trigger in folded for trigger in _TRIGGER_SUBSTRINGS)
+
+
+def _mask_sensitive_match(match: 're.Match[str]') -> str:
+    """
+    Enmascarar una coincidencia de ``_SENSITIVE_PASSES`` según su tipo
+    
+    Args:
+        match: Coincidencia de un patrón sensible
+        
+    Returns:
+        Texto de reemplazo
+    """
+    kind = match.lastgroup
+    if kind in _KEY_VALUE_TYPES:
+        # Para campos con valores, reemplazar el valor
+        return f"{match.group(kind + '_key')}: [REDACTED]"
+    if kind == 'card_number':
+        # Para números de tarjeta, mostrar solo últimos 4 dígitos (el patrón
+        # exige 16 dígitos y termina en 4 sin separadores)
+        return '************' + match.group(0)[-4:]
+    if kind == 'email':
+        # Para emails, mostrar solo dominio
+        return f"***@{match.group(0).split('@', 1)[1]}"
+    # Para SSN y teléfonos, enmascarar completamente
+    return '[REDACTED]'
+
 
 class SecureLogger:
     """Logger que excluye información sensible automáticamente"""
     
     # Patrones de datos sensibles que deben ser enmascarados
     SENSITIVE_PATTERNS = {
-        'password': re.compile(r'(password|passwd|pwd)["\']?\s*[:=]\s*["\']?([^"\'\s,}]+)', re.IGNORECASE),
-        'token': re.compile(r'(token|jwt|bearer)["\']?\s*[:=]\s*["\']?([^"\'\s,}]+)', re.IGNORECASE),
-        'card_number': re.compile(r'\b\d{4}[\s-]?\d{4}[\s-]?\d{4}[\s-]?\d{4}\b'),
-        'ssn': re.compile(r'\b\d{3}-?\d{2}-?\d{4}\b'),
-        'email': re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'),
-        'phone': re.compile(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b'),
-        'api_key': re.compile(r'(api[_-]?key|apikey)["\']?\s*[:=]\s*["\']?([^"\'\s,}]+)', re.IGNORECASE),
+        name: re.compile(source, re.IGNORECASE if name in _KEY_VALUE_TYPES else 0)
+        for name, source in _SENSITIVE_SOURCES.items()
     }
     
+    # Cola compartida y listener que escribe en archivo y consola desde un
+    # hilo propio; se crean una sola vez por proceso
+    _log_queue: Optional[queue.SimpleQueue] = None
+    _queue_listener: Optional[logging.handlers.QueueListener] = None
+    _listener_lock = threading.Lock()
+    
     def __init__(self, name: str, log_level: str = "INFO"):
         """
         Inicializar logger seguro
@@ -40,30 +139,56 @@ class SecureLogger:
             self._setup_handler()
     
     def _setup_handler(self):
-        """Configurar handler de logging con formato seguro"""
-        # Crear directorio de logs si no existe
-        log_dir = Path("logs")
-        log_dir.mkdir(exist_ok=True)
-        
-        # Handler para archivo
-        file_handler = logging.FileHandler(
-            log_dir / "carddemo-api.log",
-            encoding='utf-8'
-        )
-        
-        # Handler para consola
-        console_handler = logging.StreamHandler()
-        
-        # Formato de log
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+        """
+        Configurar handler de logging con formato seguro
         
-        file_handler.setFormatter(formatter)
-        console_handler.setFormatter(formatter)
+        El logger solo encola los registros; la escritura bloqueante en
+        archivo y consola la hace el hilo del ``QueueListener``.
+        """
+        self.logger.addHandler(logging.handlers.QueueHandler(self._get_log_queue()))
+    
+    @classmethod
+    def _get_log_queue(cls) -> queue.SimpleQueue:
+        """
+        Obtener la cola de logging, arrancando el listener la primera vez
         
-        self.logger.addHandler(file_handler)
-        self.logger.addHandler(console_handler)
+        Returns:
+            Cola compartida por todos los loggers seguros
+        """
+        with cls._listener_lock:
+            if cls._log_queue is None:
+                # Crear directorio de logs si no existe
+                log_dir = Path("logs")
+                log_dir.mkdir(exist_ok=True)
+                
+                # Handler para archivo
+                file_handler = logging.FileHandler(
+                    log_dir / "carddemo-api.log",
+                    encoding='utf-8'
+                )
+                
+                # Handler para consola
+                console_handler = logging.StreamHandler()
+                
+                # Formato de log
+                formatter = logging.Formatter(
+                    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+                )
+                
+                file_handler.setFormatter(formatter)
+                console_handler.setFormatter(formatter)
+                
+                log_queue = queue.SimpleQueue()
+                listener = logging.handlers.QueueListener(
+                    log_queue, file_handler, console_handler, respect_handler_level=True
+                )
+                listener.start()
+                # Vaciar la cola antes de terminar el proceso
+                atexit.register(listener.stop)
+                
+                cls._queue_listener = listener
+                cls._log_queue = log_queue
+            return cls._log_queue
     
     def _sanitize_message(self, message: str) -> str:
         """
@@ -75,35 +200,12 @@ class SecureLogger:
         Returns:
             Mensaje sanitizado
         """
-        sanitized = message
-        
-        for pattern_name, pattern in self.SENSITIVE_PATTERNS.items():
-            if pattern_name in ['password', 'token', 'api_key']:
-                # Para campos con valores, reemplazar el valor
-                sanitized = pattern.sub(r'\1: [REDACTED]', sanitized)
-            elif pattern_name == 'card_number':
-                # Para números de tarjeta, mostrar solo últimos 4 dígitos
-                def mask_card(match):
-                    card = match.group(0)
-                    clean_card = re.sub(r'[\s-]', '', card)
-                    if len(clean_card) >= 4:
-                        return '*' * (len(clean_card) - 4) + clean_card[-4:]
-                    return '*' * len(clean_card)
-                sanitized = pattern.sub(mask_card, sanitized)
-            elif pattern_name == 'email':
-                # Para emails, mostrar solo dominio
-                def mask_email(match):
-                    email = match.group(0)
-                    if '@' in email:
-                        local, domain = email.split('@', 1)
-                        return f"***@{domain}"
-                    return "***@***.***"
-                sanitized = pattern.sub(mask_email, sanitized)
-            elif pattern_name in ['ssn', 'phone']:
-                # Para SSN y teléfonos, enmascarar completamente
-                sanitized = pattern.sub('[REDACTED]', sanitized)
-        
-        return sanitized
+        # La mayoría de los mensajes no tienen nada que enmascarar
+        if not _may_contain_sensitive(message):
+            return message
+        for pattern in _SENSITIVE_PASSES:
+            message = pattern.sub(_mask_sensitive_match, message)
+        return message
     
     def _format_extra_data(self, **kwargs) -> str:
         """
@@ -119,42 +221,103 @@ class SecureLogger:
             return ""
         
         try:
-            # Convertir a JSON y sanitizar
-            json_str = json.dumps(kwargs, default=str, ensure_ascii=False)
-            sanitized = self._sanitize_message(json_str)
-            return f" | Extra: {sanitized}"
+            parts = []
+            for key, value in kwargs.items():
+                if _SENSITIVE_KEY_RE.search(key):
+                    # Clave sensible: el valor no se examina
+                    formatted = "[REDACTED]"
+                elif value is None or isinstance(value, bool) or (
+                    isinstance(value, int) and -_MAX_SAFE_INT < value < _MAX_SAFE_INT
+                ):
+                    # IDs, contadores, flags: sin JSON ni expresiones regulares
+                    formatted = repr(value)
+                elif isinstance(value, (str, int, float)):
+                    formatted = self._sanitize_message(str(value))
+                else:
+                    # Estructuras anidadas: JSON y sanitización del resultado
+                    formatted = self._sanitize_message(json.dumps(value, default=str, ensure_ascii=False))
+                parts.append(f"{key}={formatted}")
+            return " | Extra: " + ", ".join(parts)
         except Exception:
             return f" | Extra: [Error formatting data]"
     
-    def debug(self, message: str, **kwargs):
-        """Log mensaje de debug"""
+    def _log(self, level: int, message: str, kwargs: Dict[str, Any]) -> None:
+        """
+        Sanitizar y registrar un mensaje si el nivel está habilitado
+        
+        Con el nivel deshabilitado no se serializan los datos extra ni se
+        aplican las expresiones de sanitización.
+        
+        Args:
+            level: Nivel de logging
+            message: Mensaje original
+            kwargs: Datos adicionales
+        """
+        if not self.logger.isEnabledFor(level):
+            return
         sanitized_msg = self._sanitize_message(str(message))
         extra_data = self._format_extra_data(**kwargs)
-        self.logger.debug(f"{sanitized_msg}{extra_data}")
+        self.logger.log(level, f"{sanitized_msg}{extra_data}")
+    
+    def debug(self, message: str, **kwargs):
+        """Log mensaje de debug"""
+        self._log(logging.DEBUG, message, kwargs)
     
     def info(self, message: str, **kwargs):
         """Log mensaje informativo"""
-        sanitized_msg = self._sanitize_message(str(message))
-        extra_data = self._format_extra_data(**kwargs)
-        self.logger.info(f"{sanitized_msg}{extra_data}")
+        self._log(logging.INFO, message, kwargs)
     
     def warning(self, message: str, **kwargs):
         """Log mensaje de advertencia"""
-        sanitized_msg = self._sanitize_message(str(message))
-        extra_data = self._format_extra_data(**kwargs)
-        self.logger.warning(f"{sanitized_msg}{extra_data}")
+        self._log(logging.WARNING, message, kwargs)
     
     def error(self, message: str, **kwargs):
         """Log mensaje de error"""
-        sanitized_msg = self._sanitize_message(str(message))
-        extra_data = self._format_extra_data(**kwargs)
-        self.logger.error(f"{sanitized_msg}{extra_data}")
+        self._log(logging.ERROR, message, kwargs)
     
     def critical(self, message: str, **kwargs):
         """Log mensaje crítico"""
-        sanitized_msg = self._sanitize_message(str(message))
-        extra_data = self._format_extra_data(**kwargs)
-        self.logger.critical(f"{sanitized_msg}{extra_data}")
+        self._log(logging.CRITICAL, message, kwargs)
+
+# Acciones ante errores de BD por contenido del mensaje, en orden de
+# prioridad: un timeout también suele mencionar la conexión
+_DB_ERROR_ACTIONS = (
+    ('timeout_retry', ('timeout', 'time out')),
+    ('connection_retry', ('connection', 'connect', 'network', 'host', 'server', 'unreachable', 'refused')),
+    ('constraint_violation', ('constraint', 'unique', 'foreign key', 'check constraint', 'not null', 'primary key')),
+)
+_INTEGRITY_ERRORS = frozenset({'IntegrityError', 'DataError'})
+_RECOVERABLE_ERRORS = frozenset({
+    'OperationalError',  # Errores de conexión, timeouts
+    'DisconnectionError',  # Desconexiones
+    'TimeoutError',  # Timeouts
+    'DatabaseError'  # Errores generales de BD que pueden ser temporales
+})
+_RECOVERABLE_INDICATORS = ('connection', 'timeout', 'network', 'temporary', 'retry')
+
+
+@lru_cache(maxsize=256)
+def _classify_database_error(error_name: str, error_message: str) -> Tuple[str, bool]:
+    """
+    Clasificar un error de BD (memoizado: los reintentos repiten el mismo error)
+    
+    Args:
+        error_name: Nombre de la clase de la excepción
+        error_message: Texto de la excepción
+        
+    Returns:
+        Tupla (acción a tomar, si el error es recuperable con reintento)
+    """
+    error_str = error_message.lower()
+    recoverable = error_name in _RECOVERABLE_ERRORS or any(
+        indicator in error_str for indicator in _RECOVERABLE_INDICATORS
+    )
+    for action, indicators in _DB_ERROR_ACTIONS:
+        if any(indicator in error_str for indicator in indicators):
+            return action, recoverable
+    if error_name in _INTEGRITY_ERRORS:
+        return 'integrity_violation', recoverable
+    return 'unknown_error', recoverable
 
 
 class DatabaseErrorHandler:
@@ -172,119 +335,75 @@ class DatabaseErrorHandler:
         self.max_retries = 3
         self.retry_delay = 1.0  # segundos
     
-    def handle_database_error(self, error: Exception, operation: str, **context) -> Dict[str, Any]:
+    def handle_database_error(
+        self,
+        error: Exception,
+        operation: str,
+        retry_count: Optional[int] = None,
+        **context
+    ) -> Dict[str, Any]:
         """
         Manejar error de base de datos con recuperación
         
         Args:
             error: Excepción de base de datos
             operation: Descripción de la operación que falló
+            retry_count: Intento actual del llamador; si se omite se usa el contador interno
             **context: Contexto adicional (sin datos sensibles)
             
         Returns:
             Diccionario con información del error y acciones tomadas
         """
+        if retry_count is None:
+            retry_count = self.retry_count
+        action, recoverable = self._classify(error)
+        
         error_info = {
             'error_type': type(error).__name__,
             'operation': operation,
             'timestamp': datetime.now(timezone.utc).isoformat(),
-            'retry_count': self.retry_count,
-            'recoverable': self._is_recoverable_error(error),
-            'action_taken': None
+            'retry_count': retry_count,
+            'recoverable': recoverable,
+            'action_taken': action
         }
         
         # Log del error (sin información sensible)
         self.logger.error(
             f"Database error in {operation}: {str(error)}",
             error_type=error_info['error_type'],
-            retry_count=self.retry_count,
+            retry_count=retry_count,
             **context
         )
         
-        # Determinar acción basada en el tipo de error
-        if self._is_timeout_error(error):
-            error_info['action_taken'] = 'timeout_retry'
+        # Registrar la acción según el tipo de error
+        if action == 'timeout_retry':
             self.logger.warning(f"Timeout error detected, will retry with longer timeout: {operation}")
             
-        elif self._is_connection_error(error):
-            error_info['action_taken'] = 'connection_retry'
+        elif action == 'connection_retry':
             self.logger.warning(f"Connection error detected, will retry operation: {operation}")
             
-        elif self._is_constraint_error(error):
-            error_info['action_taken'] = 'constraint_violation'
+        elif action == 'constraint_violation':
             self.logger.error(f"Constraint violation in {operation}, operation cannot be retried")
             
-        elif self._is_integrity_error(error):
-            error_info['action_taken'] = 'integrity_violation'
+        elif action == 'integrity_violation':
             self.logger.error(f"Data integrity error in {operation}, manual intervention required")
             
         else:
-            error_info['action_taken'] = 'unknown_error'
             self.logger.critical(f"Unknown database error in {operation}: {str(error)}")
         
         return error_info
     
-    def _is_recoverable_error(self, error: Exception) -> bool:
+    def _classify(self, error: Exception) -> Tuple[str, bool]:
         """
-        Determinar si el error es recuperable con reintento
+        Clasificar un error de base de datos
         
         Args:
             error: Excepción de base de datos
             
         Returns:
-            True si el error es recuperable
+            Tupla (acción a tomar, si el error es recuperable con reintento)
         """
-        recoverable_errors = [
-            'OperationalError',  # Errores de conexión, timeouts
-            'DisconnectionError',  # Desconexiones
-            'TimeoutError',  # Timeouts
-            'DatabaseError'  # Errores generales de BD que pueden ser temporales
-        ]
-        
-        error_name = type(error).__name__
-        error_str = str(error).lower()
-        
-        # Verificar por nombre de clase
-        if error_name in recoverable_errors:
-            return True
-        
-        # Verificar por contenido del mensaje para errores genéricos
-        recoverable_indicators = [
-            'connection', 'timeout', 'network', 'temporary', 'retry'
-        ]
-        
-        return any(indicator in error_str for indicator in recoverable_indicators)
-    
-    def _is_connection_error(self, error: Exception) -> bool:
-        """Verificar si es error de conexión"""
-        error_str = str(error).lower()
-        connection_indicators = [
-            'connection', 'connect', 'network', 'host', 'server',
-            'unreachable', 'refused'
-        ]
-        # Excluir timeout ya que tiene su propia categoría
-        if 'timeout' in error_str or 'time out' in error_str:
-            return False
-        return any(indicator in error_str for indicator in connection_indicators)
-    
-    def _is_timeout_error(self, error: Exception) -> bool:
-        """Verificar si es error de timeout"""
-        error_str = str(error).lower()
-        return 'timeout' in error_str or 'time out' in error_str
-    
-    def _is_constraint_error(self, error: Exception) -> bool:
-        """Verificar si es error de constraint"""
-        error_str = str(error).lower()
-        constraint_indicators = [
-            'constraint', 'unique', 'foreign key', 'check constraint',
-            'not null', 'primary key'
-        ]
-        return any(indicator in error_str for indicator in constraint_indicators)
-    
-    def _is_integrity_error(self, error: Exception) -> bool:
-        """Verificar si es error de integridad de datos"""
-        error_name = type(error).__name__
-        return error_name in ['IntegrityError', 'DataError']
+        return _classify_database_error(type(error).__name__, str(error))
     
     def should_retry(self, error: Exception) -> bool:
         """
@@ -299,7 +418,7 @@ class DatabaseErrorHandler:
         if self.retry_count >= self.max_retries:
             return False
         
-        return self._is_recoverable_error(error)
+        return self._classify(error)[1]
     
     def increment_retry(self):
         """Incrementar contador de reintentos"""
@@ -191,7 +191,7 @@ class ResponseCompletenessValidator:
             Resultado de validación
         """
         # Convertir modelo a diccionario
-        response_data = model_instance.dict()
+        response_data = model_instance.model_dump()
         return self._validate_response(response_data, response_type)
     
     def get_schema_validation_summary(self, response_type: str) -> Dict[str, Any]:
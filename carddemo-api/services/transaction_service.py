@@ -1,7 +1,10 @@
 """
 Servicio de gestión de transacciones para CardDemo API
 """
-from typing import List, Optional, Tuple
+import base64
+import binascii
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import exists, func, insert, lambda_stmt, tuple_, update
 from sqlmodel import Session, select, and_, or_
 from datetime import datetime, timezone, date
 from decimal import Decimal
@@ -10,6 +13,56 @@ from models.database_models import Transaction, CreditCard, Account
 from models.api_models import TransactionResponse, TransactionFilters, TransactionListResponse
 
 
+def to_decimal(value: Optional[float]) -> Optional[Decimal]:
+    """
+    Convertir un monto float a Decimal para compararlo con columnas monetarias
+    
+    Args:
+        value: Monto como float (o None)
+        
+    Returns:
+        Decimal con la representación decimal más corta del float, o None
+    """
+    if value is None:
+        return None
+    return Decimal(repr(value))
+
+
+def encode_cursor(transaction: Transaction) -> str:
+    """
+    Codificar la posición de una transacción como cursor de paginación
+    
+    Args:
+        transaction: Última transacción de la página
+        
+    Returns:
+        Cursor opaco (base64 URL-safe de "fecha|id")
+    """
+    raw = f"{transaction.transaction_date.isoformat()}|{transaction.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decodificar un cursor de paginación
+    
+    Args:
+        cursor: Cursor generado por ``encode_cursor``
+        
+    Returns:
+        Tupla (fecha de transacción, ID de transacción)
+        
+    Raises:
+        ValueError: Si el cursor no es válido
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date_part, id_part = raw.rsplit("|", 1)
+        return datetime.fromisoformat(date_part), int(id_part)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError("Cursor de paginación inválido") from e
+
+
 class TransactionService:
     """Servicio para manejo de transacciones"""
     
@@ -24,25 +77,36 @@ class TransactionService:
         Returns:
             Lista de IDs de tarjetas del usuario
         """
-        # Obtener cuenta del usuario
-        account_statement = select(Account).where(Account.user_id == user_id)
-        account = session.exec(account_statement).first()
-        
-        if not account:
-            return []
-        
-        # Obtener IDs de tarjetas de la cuenta
-        cards_statement = select(CreditCard.id).where(CreditCard.account_id == account.id)
-        card_ids = list(session.exec(cards_statement).all())
+        # Una sola consulta a través de la cuenta (sin cargar la cuenta aparte),
+        # en lambda para reutilizar la sentencia compilada entre llamadas
+        statement = lambda_stmt(lambda: (
+            select(CreditCard.id)
+            .join(Account, CreditCard.account_id == Account.id)
+            .where(Account.user_id == user_id)
+        ))
+        return list(session.scalars(statement).all())
+    
+    def has_transactions(self, session: Session, card_ids: List[int]) -> bool:
+        """
+        Comprobar si alguna de las tarjetas tiene transacciones
         
-        return card_ids
+        Args:
+            session: Sesión de base de datos
+            card_ids: IDs de las tarjetas
+            
+        Returns:
+            True si existe al menos una transacción
+        """
+        if not card_ids:
+            return False
+        return session.scalar(select(exists().where(Transaction.card_id.in_(card_ids))))
     
     def get_transactions_with_filters(
         self, 
         session: Session, 
         user_id: int, 
         filters: TransactionFilters
-    ) -> Tuple[List[Transaction], int]:
+    ) -> Tuple[List[Transaction], Optional[int], bool]:
         """
         Obtener transacciones del usuario con filtros aplicados
         
@@ -52,17 +116,18 @@ class TransactionService:
             filters: Filtros a aplicar
             
         Returns:
-            Tupla con (lista de transacciones, total de transacciones)
+            Tupla con (lista de transacciones, total de transacciones o None
+            si ``filters.include_total`` es falso, si hay más resultados)
+            
+        Raises:
+            ValueError: Si ``filters.cursor`` no es un cursor válido
         """
-        # Obtener IDs de tarjetas del usuario
-        user_card_ids = self.get_user_card_ids(session, user_id)
-        
-        if not user_card_ids:
-            return [], 0
+        cursor = decode_cursor(filters.cursor) if filters.cursor else None
         
-        # Construir query base
-        base_query = select(Transaction).where(Transaction.card_id.in_(user_card_ids))
-        count_query = select(Transaction.id).where(Transaction.card_id.in_(user_card_ids))
+        # Construir query base: user_id está desnormalizado en la transacción,
+        # así que no hace falta resolver antes las tarjetas del usuario
+        base_query = select(Transaction).where(Transaction.user_id == user_id)
+        count_query = select(func.count()).select_from(Transaction).where(Transaction.user_id == user_id)
         
         # Aplicar filtros
         conditions = []
@@ -76,14 +141,10 @@ class TransactionService:
             end_datetime = datetime.combine(filters.end_date, datetime.max.time())
             conditions.append(Transaction.transaction_date <= end_datetime)
         
-        # Filtro por tarjeta específica
+        # Filtro por tarjeta específica (una tarjeta ajena no devuelve nada
+        # porque sus transacciones tienen otro user_id)
         if filters.card_id:
-            # Verificar que la tarjeta pertenezca al usuario
-            if filters.card_id in user_card_ids:
-                conditions.append(Transaction.card_id == filters.card_id)
-            else:
-                # Si la tarjeta no pertenece al usuario, no retornar nada
-                return [], 0
+            conditions.append(Transaction.card_id == filters.card_id)
         
         # Filtro por tipo de transacción
         if filters.transaction_type:
@@ -91,28 +152,41 @@ class TransactionService:
         
         # Filtro por monto
         if filters.min_amount is not None:
-            conditions.append(Transaction.amount >= filters.min_amount)
+            conditions.append(Transaction.amount >= to_decimal(filters.min_amount))
         
         if filters.max_amount is not None:
-            conditions.append(Transaction.amount <= filters.max_amount)
+            conditions.append(Transaction.amount <= to_decimal(filters.max_amount))
         
         # Aplicar condiciones a las queries
         if conditions:
             base_query = base_query.where(and_(*conditions))
             count_query = count_query.where(and_(*conditions))
         
-        # Obtener total de registros
-        total = len(list(session.exec(count_query).all()))
+        # El total exige recorrer todo el conjunto filtrado, así que solo se
+        # calcula si se pide; has_more no depende de él
+        total = session.exec(count_query).one() if filters.include_total else None
+        
+        # Paginación por clave: con cursor se continúa tras la última fila
+        # de la página anterior (búsqueda en el índice, coste independiente
+        # de la profundidad); sin cursor se mantiene offset por compatibilidad
+        if cursor is not None:
+            base_query = base_query.where(
+                tuple_(Transaction.transaction_date, Transaction.id) < cursor
+            )
+        else:
+            base_query = base_query.offset(filters.offset)
         
-        # Aplicar ordenamiento, paginación y ejecutar
+        # Aplicar ordenamiento (id desempata fechas iguales) y pedir una fila
+        # extra para saber si hay página siguiente sin contar
         transactions = list(session.exec(
             base_query
-            .order_by(Transaction.transaction_date.desc())
-            .offset(filters.offset)
-            .limit(filters.limit)
+            .order_by(Transaction.transaction_date.desc(), Transaction.id.desc())
+            .limit(filters.limit + 1)
         ).all())
+        has_more = len(transactions) > filters.limit
+        del transactions[filters.limit:]
         
-        return transactions, total
+        return transactions, total, has_more
     
     def get_transaction_by_id(self, session: Session, transaction_id: int, user_id: int) -> Optional[Transaction]:
         """
@@ -126,19 +200,12 @@ class TransactionService:
         Returns:
             Transacción si existe y pertenece al usuario, None en caso contrario
         """
-        # Obtener IDs de tarjetas del usuario
-        user_card_ids = self.get_user_card_ids(session, user_id)
-        
-        if not user_card_ids:
+        # Carga por clave primaria (mapa de identidad de la sesión) y
+        # comprobación de propietario en memoria
+        transaction = session.get(Transaction, transaction_id)
+        if transaction is None or transaction.user_id != user_id:
             return None
-        
-        # Buscar la transacción
-        statement = select(Transaction).where(
-            Transaction.id == transaction_id,
-            Transaction.card_id.in_(user_card_ids)
-        )
-        
-        return session.exec(statement).first()
+        return transaction
     
     def transaction_to_response(self, transaction: Transaction) -> TransactionResponse:
         """
@@ -150,24 +217,47 @@ class TransactionService:
         Returns:
             Modelo de respuesta
         """
-        return TransactionResponse(
-            id=transaction.id,
-            transaction_date=transaction.transaction_date,
-            merchant_name=transaction.merchant_name,
-            amount=transaction.amount,
-            transaction_type=transaction.transaction_type,
-            status=transaction.status,
-            description=transaction.description,
-            created_at=transaction.created_at
-        )
+        return TransactionResponse.model_validate(transaction)
+    
+    def transaction_to_dict(self, transaction: Transaction) -> Dict[str, Any]:
+        """
+        Convertir modelo de base de datos a diccionario listo para serializar
+        
+        Produce el mismo JSON que ``TransactionResponse`` pero sin validar ni
+        construir el modelo Pydantic (para listados de alto volumen). Las
+        fechas se dejan como ``datetime``: deben serializarse con
+        ``orjson.OPT_UTC_Z`` (``UTCJSONResponse``) para coincidir con Pydantic.
+        
+        Args:
+            transaction: Transacción de la base de datos
+            
+        Returns:
+            Diccionario con los campos de ``TransactionResponse``
+        """
+        return {
+            "id": transaction.id,
+            "transaction_date": transaction.transaction_date,
+            "merchant_name": transaction.merchant_name,
+            "amount": str(transaction.amount),  # Decimal se serializa como string
+            "transaction_type": transaction.transaction_type,
+            "status": transaction.status,
+            "description": transaction.description,
+            "created_at": transaction.created_at
+        }
     
-    def create_sample_transactions(self, session: Session, card_ids: List[int]) -> List[Transaction]:
+    def create_sample_transactions(
+        self,
+        session: Session,
+        card_ids: List[int],
+        user_id: Optional[int] = None
+    ) -> List[Transaction]:
         """
         Crear transacciones de ejemplo para demostración
         
         Args:
             session: Sesión de base de datos
             card_ids: IDs de las tarjetas para las que crear transacciones
+            user_id: Propietario de las tarjetas; si no se indica se consulta
             
         Returns:
             Lista de transacciones creadas
@@ -213,33 +303,67 @@ class TransactionService:
             }
         ]
         
-        created_transactions = []
+        from datetime import timedelta
+        now = datetime.now(timezone.utc)
         
-        for i, transaction_data in enumerate(sample_transactions):
-            # Alternar entre tarjetas disponibles
-            card_id = card_ids[i % len(card_ids)]
-            
-            # Calcular fecha de transacción
-            from datetime import timedelta
-            transaction_date = datetime.now(timezone.utc) - timedelta(days=transaction_data["days_ago"])
-            
-            # Crear transacción
-            transaction = Transaction(
-                card_id=card_id,
-                transaction_date=transaction_date,
-                merchant_name=transaction_data["merchant_name"],
-                amount=transaction_data["amount"],
-                transaction_type=transaction_data["transaction_type"],
-                status="COMPLETED",
-                description=transaction_data["description"],
-                created_at=datetime.now(timezone.utc)
-            )
-            
-            session.add(transaction)
-            created_transactions.append(transaction)
+        # El INSERT masivo no pasa por el flush del ORM, así que si no se
+        # conoce el propietario se resuelve aquí en una sola consulta
+        if user_id is not None:
+            owners = dict.fromkeys(card_ids, user_id)
+        else:
+            owners = dict(session.exec(
+                select(CreditCard.id, Account.user_id)
+                .join(Account, CreditCard.account_id == Account.id)
+                .where(CreditCard.id.in_(card_ids))
+            ).all())
         
+        rows = [
+            {
+                # Alternar entre tarjetas disponibles
+                "card_id": card_ids[i % len(card_ids)],
+                "user_id": owners.get(card_ids[i % len(card_ids)]),
+                "transaction_date": now - timedelta(days=transaction_data["days_ago"]),
+                "merchant_name": transaction_data["merchant_name"],
+                "amount": transaction_data["amount"],
+                "transaction_type": transaction_data["transaction_type"],
+                "status": "COMPLETED",
+                "description": transaction_data["description"]
+            }
+            for i, transaction_data in enumerate(sample_transactions)
+        ]
+        
+        # Un único INSERT multi-fila con RETURNING en lugar de un INSERT y un
+        # SELECT de refresco por transacción
+        created_transactions = list(session.scalars(
+            insert(Transaction).returning(Transaction),
+            rows
+        ))
+        session.commit()
+        
+        return created_transactions
+    
+    def backfill_transaction_user_ids(self, session: Session) -> int:
+        """
+        Completar user_id en transacciones creadas antes de desnormalizarlo
+        (Función de migración)
+        
+        Args:
+            session: Sesión de base de datos
+            
+        Returns:
+            Número de transacciones actualizadas
+        """
+        owner = (
+            select(Account.user_id)
+            .join(CreditCard, CreditCard.account_id == Account.id)
+            .where(CreditCard.id == Transaction.card_id)
+            .scalar_subquery()
+        )
+        result = session.execute(
+            update(Transaction)
+            .where(Transaction.user_id.is_(None))
+            .values(user_id=owner)
+        )
         session.commit()
-        for transaction in created_transactions:
-            session.refresh(transaction)
         
-        return created_transactions
\ No newline at end of file
+        return result.rowcount
\ No newline at end of file
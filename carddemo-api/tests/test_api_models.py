@@ -236,6 +236,41 @@ class TestResponseModels:
         assert token_response.expires_in == 1800
         assert token_response.user.username == "USER0001"
     
+    def test_response_models_from_orm_attributes(self):
+        """Test de construcción de respuestas directamente desde modelos ORM"""
+        from models.database_models import User, Account, Transaction
+        
+        user = User(id=1, username="USER0001", email="user@carddemo.com", hashed_password="hash", is_active=True)
+        assert UserResponse.model_validate(user).username == "USER0001"
+        
+        account = Account(
+            id=1,
+            user_id=1,
+            account_number="ACC000100001",
+            first_name="John",
+            last_name="Doe",
+            state="CA",
+            created_at=datetime(2024, 1, 1)
+        )
+        account_response = AccountResponse.model_validate(account)
+        assert account_response.account_number == "ACC000100001"
+        assert account_response.state == "CA"
+        assert account_response.updated_at is None
+        
+        transaction = Transaction(
+            id=1,
+            card_id=1,
+            transaction_date=datetime(2024, 1, 15, 10, 30),
+            merchant_name="Amazon",
+            amount=Decimal("89.99"),
+            transaction_type="PURCHASE",
+            status="COMPLETED",
+            created_at=datetime(2024, 1, 15, 10, 30)
+        )
+        transaction_response = TransactionResponse.model_validate(transaction)
+        assert transaction_response.transaction_type == TransactionType.PURCHASE
+        assert transaction_response.amount == Decimal("89.99")
+    
     def test_account_response(self):
         """Test del modelo AccountResponse"""
         data = {
@@ -424,4 +459,14 @@ class TestValidationEdgeCases:
         # Mes de expiración en límite superior
         data["expiry_month"] = 12
         card_response = CardResponse(**data)
-        assert card_response.expiry_month == 12
\ No newline at end of file
+        assert card_response.expiry_month == 12
+
+class TestModelBuild:
+    """Tests para la construcción de los modelos al importar"""
+    
+    def test_models_fully_built_on_import(self):
+        """Test que ningún modelo queda con validador diferido al importar"""
+        from models.api_models import _API_MODELS
+        
+        for model in _API_MODELS:
+            assert model.__pydantic_complete__, f"{model.__name__} no está construido"
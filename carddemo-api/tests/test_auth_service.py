@@ -3,9 +3,10 @@ Tests para el servicio de autenticación
 Feature: carddemo-api-migration
 """
 import pytest
+import time
 from datetime import datetime, timedelta, timezone
 from sqlmodel import Session, create_engine, SQLModel
-from jose import jwt
+import jwt
 
 from services.auth_service import AuthService
 from models.database_models import User
@@ -273,4 +274,237 @@ def test_token_with_custom_expiration(auth_service, test_user):
     
     # Debe expirar en aproximadamente 1 hora
     time_diff = exp_datetime - now
-    assert 3500 <= time_diff.total_seconds() <= 3700  # ~1 hora con margen
\ No newline at end of file
+    assert 3500 <= time_diff.total_seconds() <= 3700  # ~1 hora con margen
+
+def test_token_timestamps_are_integers(auth_service, test_user):
+    """Test de exp e iat como timestamps UNIX enteros"""
+    token_data = auth_service.create_user_token_data(test_user)
+    before = int(time.time())
+    token = auth_service.create_access_token(token_data, expires_delta=timedelta(minutes=5))
+    
+    payload = auth_service.verify_token(token)
+    assert type(payload["exp"]) is int and type(payload["iat"]) is int
+    assert before <= payload["iat"] <= int(time.time())
+    assert payload["exp"] - payload["iat"] == 300
+
+
+def test_token_signed_like_pyjwt(auth_service, test_user, monkeypatch):
+    """Test de firma HMAC directa: mismo token que jwt.encode"""
+    token = auth_service.create_access_token(auth_service.create_user_token_data(test_user))
+    payload = jwt.decode(token, auth_service.secret_key, algorithms=[auth_service.algorithm])
+    
+    assert token == jwt.encode(payload, auth_service.secret_key, algorithm=auth_service.algorithm)
+    assert jwt.get_unverified_header(token) == {"alg": auth_service.algorithm, "typ": "JWT"}
+    
+    # Claims con caracteres no ASCII: también idéntico
+    claims = {"sub": "1", "username": "José Muñoz", "exp": 2_000_000_000, "iat": 1_700_000_000}
+    monkeypatch.setattr("services.auth_service._now_ts", lambda: 1_700_000_000)
+    token = auth_service.create_access_token(
+        {"sub": "1", "username": "José Muñoz"}, expires_delta=timedelta(seconds=300_000_000)
+    )
+    assert token == jwt.encode(claims, auth_service.secret_key, algorithm=auth_service.algorithm)
+    
+    # Otra clave no valida la firma
+    with pytest.raises(jwt.InvalidSignatureError):
+        jwt.decode(token, auth_service.secret_key + "x", algorithms=[auth_service.algorithm])
+
+
+def test_token_payload_decoded_with_orjson(auth_service, test_user, monkeypatch):
+    """Test de decodificación del payload JWT con orjson"""
+    import base64
+    import hashlib
+    import hmac
+    from services import auth_service as auth_module
+    
+    monkeypatch.setattr(auth_service, "jwt_cache_ttl", 0)
+    loads = auth_module.orjson.loads
+    calls = []
+    monkeypatch.setattr(auth_module.orjson, "loads", lambda data: calls.append(data) or loads(data))
+    
+    token = auth_service.create_access_token(auth_service.create_user_token_data(test_user))
+    assert auth_service.verify_token(token)["sub"] == str(test_user.id)
+    assert len(calls) == 1
+    
+    # Un payload firmado que no es un objeto JSON se rechaza
+    header, _, _ = token.split(".")
+    signing_input = f"{header}.{base64.urlsafe_b64encode(b'[1]').rstrip(b'=').decode()}"
+    signature = hmac.new(auth_service.secret_key.encode(), signing_input.encode(), hashlib.sha256).digest()
+    array_token = f"{signing_input}.{base64.urlsafe_b64encode(signature).rstrip(b'=').decode()}"
+    assert auth_service.verify_token(array_token) is None
+
+
+def test_user_lookups_use_prepared_statements(test_engine, test_session, auth_service, test_user):
+    """Test de búsquedas de usuario con sentencias precompiladas y parámetros"""
+    from sqlalchemy import event
+    
+    other = User(
+        username="otheruser",
+        email="other@example.com",
+        hashed_password=auth_service.hash_password("otherpassword"),
+        is_active=True
+    )
+    test_session.add(other)
+    test_session.commit()
+    other_id, test_user_id = other.id, test_user.id
+    
+    statements = []
+    event.listen(test_engine, "before_cursor_execute", lambda *args: statements.append((args[2], args[3])))
+    
+    assert auth_service.authenticate_user(test_session, "testuser", "testpassword").id == test_user_id
+    assert auth_service.authenticate_user(test_session, "otheruser", "otherpassword").id == other_id
+    assert auth_service.authenticate_user(test_session, "missing", "testpassword") is None
+    
+    # Misma sentencia para cada usuario; solo cambia el parámetro
+    assert len({sql for sql, _ in statements}) == 1
+    assert "LIMIT" not in statements[0][0]
+    assert [params for _, params in statements] == [("testuser",), ("otheruser",), ("missing",)]
+    
+    token = auth_service.create_access_token(auth_service.create_user_token_data(other))
+    assert auth_service.get_current_user(test_session, token).id == other_id
+
+
+def test_current_user_cached_per_token(test_engine, test_session, auth_service, test_user):
+    """Test de caché del usuario resuelto desde un token"""
+    from sqlalchemy import event
+    
+    token = auth_service.create_access_token(auth_service.create_user_token_data(test_user))
+    assert auth_service.get_current_user(test_session, token).id == test_user.id
+    
+    statements = []
+    event.listen(test_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    
+    # Segunda resolución en otra sesión: sin consultas y adjunta a la sesión
+    with Session(test_engine) as session:
+        user = auth_service.get_current_user(session, token)
+        assert user.username == test_user.username
+        assert user in session
+    assert statements == []
+    
+    # Tras invalidar el token se vuelve a consultar la base de datos
+    auth_service.invalidate_token(token)
+    with Session(test_engine) as session:
+        assert auth_service.get_current_user(session, token).id == test_user.id
+    assert len(statements) == 1
+
+
+def test_password_verification_cached(test_session, auth_service, test_user, monkeypatch):
+    """Test de caché de verificaciones de contraseña correctas"""
+    import bcrypt
+    
+    calls = []
+    checkpw = bcrypt.checkpw
+    monkeypatch.setattr(bcrypt, "checkpw", lambda *args: calls.append(args) or checkpw(*args))
+    
+    # Solo el primer login correcto ejecuta bcrypt
+    assert auth_service.authenticate_user(test_session, "testuser", "testpassword").id == test_user.id
+    assert auth_service.authenticate_user(test_session, "testuser", "testpassword").id == test_user.id
+    assert len(calls) == 1
+    
+    # Los fallos no se cachean
+    assert auth_service.authenticate_user(test_session, "testuser", "wrong") is None
+    assert auth_service.authenticate_user(test_session, "testuser", "wrong") is None
+    assert len(calls) == 3
+    
+    # Con otro hash (contraseña cambiada) se vuelve a verificar
+    other_hash = auth_service.hash_password("testpassword")
+    assert auth_service.verify_password_cached("testpassword", other_hash)
+    assert len(calls) == 4
+
+
+def test_non_ascii_passwords_verified_exactly(auth_service):
+    """Test de contraseñas con caracteres no ASCII (no se descartan al codificar)"""
+    hashed = auth_service.hash_password("contraseña-ñ1")
+    
+    assert auth_service.verify_password("contraseña-ñ1", hashed)
+    assert not auth_service.verify_password("contrasea-1", hashed)
+    assert auth_service.verify_password_cached("contraseña-ñ1", hashed)
+    assert not auth_service.verify_password_cached("contrasea-1", hashed)
+
+
+def test_bcrypt_concurrency_bounded(test_user, monkeypatch):
+    """Test del límite de operaciones bcrypt simultáneas"""
+    import bcrypt
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from services import auth_service as auth_module
+    
+    monkeypatch.setattr(
+        auth_module, "settings", auth_module.settings.model_copy(update={"bcrypt_max_concurrency": 2})
+    )
+    service = AuthService()
+    
+    lock = threading.Lock()
+    active, peak = [0], [0]
+    checkpw = bcrypt.checkpw
+    
+    def tracked_checkpw(*args):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        try:
+            time.sleep(0.02)
+            return checkpw(*args)
+        finally:
+            with lock:
+                active[0] -= 1
+    
+    monkeypatch.setattr(bcrypt, "checkpw", tracked_checkpw)
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(
+            lambda _: service.verify_password("testpassword", test_user.hashed_password), range(6)
+        ))
+    
+    assert all(results)
+    assert peak[0] == 2
+
+
+def test_verified_token_payload_cached(auth_service, test_user, monkeypatch):
+    """Test de caché del payload de tokens ya verificados"""
+    from services import auth_service as auth_module
+    
+    token = auth_service.create_access_token(auth_service.create_user_token_data(test_user))
+    invalid_token = token[:-4] + "AAAA"
+    
+    calls = []
+    decode = auth_module._jwt.decode
+    monkeypatch.setattr(auth_module._jwt, "decode", lambda *args, **kwargs: calls.append(args) or decode(*args, **kwargs))
+    
+    # La segunda verificación no decodifica de nuevo
+    payload = auth_service.verify_token(token)
+    assert auth_service.verify_token(token) == payload
+    assert len(calls) == 1
+    
+    # Los tokens inválidos no se cachean
+    assert auth_service.verify_token(invalid_token) is None
+    assert auth_service.verify_token(invalid_token) is None
+    assert len(calls) == 3
+    
+    # Tras invalidar el token (logout) se vuelve a verificar
+    auth_service.invalidate_token(token)
+    assert auth_service.verify_token(token) == payload
+    assert len(calls) == 4
+
+
+def test_current_user_cached_by_id(test_engine, test_session, auth_service, test_user):
+    """Test de caché del usuario por ID, compartida entre tokens"""
+    from sqlalchemy import event
+    
+    token_data = auth_service.create_user_token_data(test_user)
+    first_token = auth_service.create_access_token(token_data)
+    second_token = auth_service.create_access_token(token_data, expires_delta=timedelta(minutes=5))
+    assert auth_service.get_current_user(test_session, first_token).id == test_user.id
+    
+    statements = []
+    event.listen(test_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    
+    # Otro token del mismo usuario no vuelve a consultar la base de datos
+    with Session(test_engine) as session:
+        assert auth_service.get_current_user(session, second_token).id == test_user.id
+    assert statements == []
+    
+    # Tras invalidar el usuario (p. ej. desactivación) ningún token usa la copia
+    auth_service.invalidate_user(test_user.id)
+    with Session(test_engine) as session:
+        assert auth_service.get_current_user(session, first_token).id == test_user.id
+        assert auth_service.get_current_user(session, second_token).id == test_user.id
+    assert len(statements) == 1
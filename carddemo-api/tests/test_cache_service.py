@@ -0,0 +1,116 @@
+"""
+Tests para la caché de respuestas
+"""
+import pytest
+from unittest.mock import MagicMock
+
+from starlette.requests import Request
+
+from services.cache_service import (
+    ResponseCache, account_cache_key, cards_cache_key,
+    compute_etag, etag_matches, conditional_json_response
+)
+
+
+class FakeRedis:
+    """Cliente Redis mínimo en memoria para los tests"""
+    
+    def __init__(self):
+        self.data = {}
+        self.expirations = {}
+    
+    def get(self, key):
+        return self.data.get(key)
+    
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.expirations[key] = ex
+    
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+@pytest.fixture
+def cache():
+    """Caché conectada a un Redis falso"""
+    response_cache = ResponseCache(ttl=60)
+    response_cache._redis = FakeRedis()
+    return response_cache
+
+
+class TestResponseCache:
+    """Tests para ResponseCache"""
+    
+    def test_disabled_without_redis(self):
+        """Sin Redis la caché no guarda nada"""
+        response_cache = ResponseCache(redis_url=None)
+        response_cache.set("acc:1", {"id": 1})
+        
+        assert not response_cache.enabled
+        assert response_cache.get("acc:1") is None
+    
+    def test_round_trip_with_ttl(self, cache):
+        """Las entradas se guardan como JSON con el TTL configurado"""
+        cache.set(account_cache_key(1), {"id": 1, "first_name": "Ana"})
+        
+        assert cache.get(account_cache_key(1)) == {"id": 1, "first_name": "Ana"}
+        assert cache._redis.expirations["acc:1"] == 60
+        assert cache.get(cards_cache_key(1)) is None
+    
+    def test_delete_invalidates_entry(self, cache):
+        """Invalidar una entrada provoca un fallo de caché"""
+        cache.set(account_cache_key(1), {"id": 1})
+        cache.delete(account_cache_key(1))
+        
+        assert cache.get(account_cache_key(1)) is None
+    
+    def test_redis_errors_are_cache_misses(self, cache):
+        """Un fallo de Redis no debe propagarse a la petición"""
+        cache._redis = MagicMock()
+        cache._redis.get.side_effect = ConnectionError("redis caído")
+        cache._redis.set.side_effect = ConnectionError("redis caído")
+        
+        assert cache.get("acc:1") is None
+        cache.set("acc:1", {"id": 1})
+
+
+def make_request(if_none_match=None):
+    """Construir una petición GET con If-None-Match opcional"""
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+class TestConditionalResponses:
+    """Tests para ETag / If-None-Match"""
+    
+    def test_etag_depends_only_on_content(self):
+        """El ETag no depende del orden de las claves y cambia con el contenido"""
+        assert compute_etag({"a": 1, "b": 2}) == compute_etag({"b": 2, "a": 1})
+        assert compute_etag({"a": 1}) != compute_etag({"a": 2})
+        assert compute_etag({"a": 1}).startswith('W/"')
+    
+    def test_etag_matching(self):
+        """Comparación débil con listas de ETags y comodín"""
+        etag = compute_etag({"id": 1})
+        opaque = etag.removeprefix("W/")
+        
+        assert etag_matches(etag, etag)
+        assert etag_matches(opaque, etag)
+        assert etag_matches(f'W/"otro", {etag}', etag)
+        assert etag_matches("*", etag)
+        assert not etag_matches(None, etag)
+        assert not etag_matches('W/"otro"', etag)
+    
+    def test_conditional_json_response(self):
+        """304 sin cuerpo si el ETag coincide; 200 con ETag en otro caso"""
+        data = {"id": 1, "first_name": "Ana"}
+        
+        response = conditional_json_response(make_request(), data)
+        assert response.status_code == 200
+        assert response.headers["etag"] == compute_etag(data)
+        assert response.headers["cache-control"] == "private, no-cache"
+        
+        not_modified = conditional_json_response(make_request(response.headers["etag"]), data)
+        assert not_modified.status_code == 304
+        assert not_modified.body == b""
+        assert not_modified.headers["etag"] == response.headers["etag"]
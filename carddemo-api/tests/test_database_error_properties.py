@@ -64,6 +64,32 @@ class TestDatabaseErrorProperties:
         assert error_info['action_taken'] == 'constraint_violation', "Debe identificar violación de constraint"
         assert error_handler.should_retry(constraint_error) == False, "No debe permitir reintento"
     
+    def test_property_19_error_classification_memoized(self):
+        """
+        **Propiedad 19: Clasificación de errores de BD en una pasada y memoizada**
+        **Valida: Requisitos 6.3**
+        """
+        from sqlalchemy.exc import IntegrityError
+        from services.logging_service import _classify_database_error
+        
+        error_handler = DatabaseErrorHandler(get_secure_logger("test"))
+        
+        # El timeout tiene prioridad sobre la conexión; la integridad va por clase
+        assert error_handler._classify(Exception("Connection Timeout")) == ('timeout_retry', True)
+        assert error_handler._classify(Exception("server refused")) == ('connection_retry', False)
+        assert error_handler._classify(Exception("NOT NULL failed")) == ('constraint_violation', False)
+        assert error_handler._classify(IntegrityError("stmt", {}, Exception("dup"))) == (
+            'integrity_violation', False
+        )
+        assert error_handler._classify(TimeoutError("boom")) == ('unknown_error', True)
+        
+        # Los reintentos del mismo error no vuelven a clasificarlo
+        _classify_database_error.cache_clear()
+        for _ in range(3):
+            error_handler.handle_database_error(Exception("network down"), "retry_storm")
+        cache_info = _classify_database_error.cache_info()
+        assert (cache_info.misses, cache_info.hits) == (1, 2)
+    
     def test_property_19_retry_limit_enforcement(self):
         """
         **Propiedad 19: Límite de reintentos**
@@ -120,6 +146,35 @@ class TestDatabaseErrorProperties:
         current_time = time.time()
         assert abs(current_time - health_info['last_check']) < 10, "Timestamp debe ser reciente"
     
+    def test_property_19_health_check_single_round_trip(self, monkeypatch):
+        """
+        **Propiedad 19: Comprobación de salud en una sola consulta**
+        **Valida: Requisitos 6.3**
+        
+        Con la BD sana basta una consulta; sin tablas se sigue distinguiendo
+        la conexión correcta de las tablas ausentes.
+        """
+        import database
+        from sqlalchemy import event
+        from sqlmodel import SQLModel, create_engine
+        from sqlmodel.pool import StaticPool
+        import models.database_models  # noqa: F401 (registra las tablas)
+        
+        empty_engine = create_engine("sqlite://", poolclass=StaticPool)
+        monkeypatch.setattr(database, "engine", empty_engine)
+        health_info = check_database_health()
+        assert health_info['status'] == 'unhealthy'
+        assert health_info['connection'] is True
+        assert health_info['tables_exist'] is False
+        
+        SQLModel.metadata.create_all(empty_engine)
+        statements = []
+        event.listen(empty_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        health_info = check_database_health()
+        assert health_info['status'] == 'healthy'
+        assert health_info['tables_exist'] is True
+        assert len(statements) == 1
+    
     def test_property_19_operation_retry_consistency(self):
         """
         **Propiedad 19: Consistencia en reintentos de operaciones**
@@ -149,6 +204,48 @@ class TestDatabaseErrorProperties:
         except Exception as e:
             # Si falla, debe ser después de agotar reintentos
             assert call_count > 1, "Debe haber intentado múltiples veces antes de fallar"
+    
+    def test_property_19_session_scope_rolls_back_on_error(self):
+        """
+        **Propiedad 19: Manejo elegante de errores de base de datos**
+        **Valida: Requisitos 6.3**
+        
+        get_db_session debe deshacer la unidad de trabajo si falla y confirmarla si no.
+        """
+        session = MagicMock()
+        session.__enter__.return_value = session
+        with patch('database.SessionLocal', return_value=session):
+            with pytest.raises(RuntimeError):
+                with get_db_session():
+                    raise RuntimeError("fallo en la operación")
+            session.rollback.assert_called_once()
+            session.commit.assert_not_called()
+            session.__exit__.assert_called_once()
+            
+            session.reset_mock()
+            with get_db_session():
+                pass
+            session.commit.assert_called_once()
+            session.rollback.assert_not_called()
+            session.__exit__.assert_called_once()
+    
+    def test_property_19_sessions_not_shared_between_requests(self):
+        """
+        **Propiedad 19: Cada petición obtiene su propia sesión**
+        **Valida: Requisitos 6.3**
+        
+        FastAPI puede entrar en dos dependencias get_session desde el mismo
+        hilo del threadpool; no deben compartir la sesión.
+        """
+        from database import get_session
+        
+        first_request = get_session()
+        second_request = get_session()
+        first_session = next(first_request)
+        second_session = next(second_request)
+        assert first_session is not second_session
+        first_request.close()
+        second_request.close()
 
 
 class TestSecureLoggingProperties:
@@ -207,6 +304,141 @@ class TestSecureLoggingProperties:
                     # Debe enmascarar la parte del usuario
                     assert '***@' in sanitized or sanitized.count('@') == 0, "Emails deben enmascarar usuario"
     
+    def test_property_27_sanitization_by_pattern_type(self):
+        """
+        **Propiedad 27: Enmascaramiento según el tipo de dato sensible**
+        **Valida: Requisitos 8.4**
+        
+        Cada patrón se aplica sobre el resultado del anterior, en orden.
+        """
+        logger = SecureLogger("test_sanitize_types")
+        
+        assert logger._sanitize_message("password=abc token: xyz 4111 1111 1111 1234") == (
+            "password: [REDACTED] token: [REDACTED] ************1234"
+        )
+        assert logger._sanitize_message("email john.doe@example.com phone 555-123-4567 ssn 123-45-6789") == (
+            "email ***@example.com phone [REDACTED] ssn [REDACTED]"
+        )
+        assert logger._sanitize_message('{"PWD": "s3cret", "api_key": "K1"}') == (
+            '{"PWD: [REDACTED]", "api_key: [REDACTED]"}'
+        )
+        assert logger._sanitize_message("4111-1111-1111-1234 y 5551234567@x.com") == (
+            "************1234 y ***@x.com"
+        )
+        assert logger._sanitize_message("sin datos sensibles") == "sin datos sensibles"
+        
+        # Una coincidencia no puede ocultar la clave de otro par clave-valor
+        assert logger._sanitize_message('jwt=x.pwd="secret"') == 'jwt: [REDACTED] [REDACTED]"'
+        assert logger._sanitize_message("admin@corp.iotoken=abc123") == "***@corp.iotoken: [REDACTED]"
+        assert logger._sanitize_message('apikey="4111 1111 1111 1234') == "apikey: [REDACTED]"
+    
+    def test_property_27_disabled_levels_skip_sanitization(self):
+        """
+        **Propiedad 27: Sin sanitizar mensajes de niveles deshabilitados**
+        **Valida: Requisitos 6.4**
+        """
+        logger = SecureLogger("test_disabled_levels", log_level="WARNING")
+        
+        with patch.object(logger, '_sanitize_message', wraps=logger._sanitize_message) as sanitize, \
+                patch.object(logger.logger, 'log') as log:
+            logger.debug("password=abc", user_id=1)
+            logger.info("password=abc", user_id=1)
+            assert sanitize.call_count == 0
+            log.assert_not_called()
+            
+            logger.warning("password=abc")
+            assert sanitize.call_count == 1
+            log.assert_called_once_with(logging.WARNING, "password: [REDACTED]")
+    
+    def test_property_27_extra_data_sanitized_by_key_and_value(self):
+        """
+        **Propiedad 27: Datos extra redactados por clave y por valor**
+        **Valida: Requisitos 8.4**
+        """
+        logger = SecureLogger("test_extra_data")
+        
+        with patch.object(logger, '_sanitize_message', wraps=logger._sanitize_message) as sanitize:
+            assert logger._format_extra_data(operation="login", user_id=42, success=True) == (
+                " | Extra: operation=login, user_id=42, success=True"
+            )
+            # Claves sensibles y escalares pequeños no pasan por las expresiones
+            assert logger._format_extra_data(new_password="x", API_KEY="k", retry_count=3) == (
+                " | Extra: new_password=[REDACTED], API_KEY=[REDACTED], retry_count=3"
+            )
+            assert [call.args[0] for call in sanitize.call_args_list] == ["login"]
+        
+        # Los valores se siguen sanitizando, también enteros largos y anidados
+        assert logger._format_extra_data(
+            note="de john@example.com", pan=4111111111111234, ctx={"pwd": "s"}
+        ) == ' | Extra: note=de ***@example.com, pan=************1234, ctx={"pwd: [REDACTED]"}'
+        assert logger._format_extra_data() == ""
+    
+    def test_property_27_prescan_skips_plain_messages(self):
+        """
+        **Propiedad 27: Mensajes sin datos sensibles no pasan por las expresiones**
+        **Valida: Requisitos 8.4**
+        """
+        import services.logging_service as logging_module
+        
+        logger = SecureLogger("test_prescan")
+        plain = "Usuario consultó su cuenta correctamente"
+        
+        sensitive_re = MagicMock()
+        with patch.object(logging_module, '_SENSITIVE_PASSES', (sensitive_re,)):
+            assert logger._sanitize_message(plain) is plain
+            sensitive_re.sub.assert_not_called()
+        
+        # Cualquier posible coincidencia sigue llegando a la expresión, también
+        # con variantes de mayúsculas Unicode que IGNORECASE iguala
+        assert logger._sanitize_message("PASSWORD=secreto") == "PASSWORD: [REDACTED]"
+        assert logger._sanitize_message("paſsword=secreto") == "paſsword: [REDACTED]"
+        assert logging_module._may_contain_sensitive("apİkey=abc")
+        assert logger._sanitize_message("tarjeta 4111111111111234") == "tarjeta ************1234"
+        assert logger._sanitize_message("de john@example.com") == "de ***@example.com"
+    
+    def test_property_27_sanitization_linear_time(self):
+        """
+        **Propiedad 27: La sanitización no sufre retroceso catastrófico**
+        **Valida: Requisitos 8.4**
+        """
+        pytest.importorskip("re2")
+        logger = SecureLogger("test_linear_time")
+        
+        # Con re estándar el patrón de email tarda segundos en estos mensajes
+        for message in ("a." * 20000, "1-" * 20000):
+            start = time.perf_counter()
+            assert logger._sanitize_message(message) == message
+            assert time.perf_counter() - start < 1.0
+        
+        assert logger._sanitize_message("password=s user@example.com") == (
+            "password: [REDACTED] ***@example.com"
+        )
+    
+    def test_property_27_logging_off_the_caller_thread(self):
+        """
+        **Propiedad 27: Los loggers seguros solo encolan sus registros**
+        **Valida: Requisitos 6.4, 8.4**
+        """
+        import logging.handlers
+        
+        first = SecureLogger("test_queue_first")
+        second = SecureLogger("test_queue_second")
+        
+        # Un único QueueHandler por logger, todos sobre la misma cola
+        for secure_logger in (first, second):
+            assert len(secure_logger.logger.handlers) == 1
+            assert isinstance(secure_logger.logger.handlers[0], logging.handlers.QueueHandler)
+        assert first.logger.handlers[0].queue is second.logger.handlers[0].queue
+        
+        # El listener compartido es quien escribe en archivo y consola
+        listener = SecureLogger._queue_listener
+        assert listener.queue is first.logger.handlers[0].queue
+        assert {type(handler) for handler in listener.handlers} == {
+            logging.FileHandler, logging.StreamHandler
+        }
+        assert SecureLogger._get_log_queue() is listener.queue
+        assert SecureLogger._queue_listener is listener
+    
     def test_property_27_logging_completeness(self):
         """
         **Propiedad 27: Completitud del logging**
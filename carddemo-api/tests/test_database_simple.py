@@ -2,7 +2,8 @@
 Tests simplificados para modelos de base de datos
 """
 import pytest
-from sqlmodel import Session, create_engine, SQLModel
+from sqlalchemy import event
+from sqlmodel import Session, create_engine, SQLModel, select
 from datetime import datetime
 from decimal import Decimal
 
@@ -173,6 +174,557 @@ def test_transaction_creation(test_session):
     assert transaction.transaction_type == "PURCHASE"
 
 
+def test_account_cards_loaded_without_n_plus_one(test_engine, test_session):
+    """Test de carga de tarjetas con un número constante de consultas"""
+    user = User(username="TEST007", email="test7@example.com", hashed_password="hash", is_active=True)
+    test_session.add(user)
+    test_session.commit()
+    test_session.refresh(user)
+    
+    account = Account(user_id=user.id, account_number="1000000004", first_name="Test", last_name="User")
+    test_session.add(account)
+    test_session.commit()
+    test_session.refresh(account)
+    
+    for card_number in ("4111111111111111", "5555555555554444", "378282246310005"):
+        test_session.add(CreditCard(
+            account_id=account.id,
+            card_number=card_number,
+            card_type="VISA",
+            expiry_month=12,
+            expiry_year=2025,
+            credit_limit=Decimal("1000.00"),
+            available_credit=Decimal("1000.00")
+        ))
+    test_session.commit()
+    user_id = user.id
+    test_session.expunge_all()
+    
+    statements = []
+    event.listen(test_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    
+    account = test_session.exec(select(Account).where(Account.user_id == user_id)).first()
+    accessed = [(card.card_number, card.account.id) for card in account.credit_cards]
+    
+    # Cuenta + tarjetas: dos consultas en total; la cuenta de cada tarjeta
+    # ya está en el identity map
+    assert len(accessed) == 3
+    assert len(statements) == 2
+    # Las cargas de cuenta y tarjetas no arrastran la tabla de usuarios
+    assert not any("users" in statement for statement in statements)
+
+
+def test_sample_data_inserted_in_one_statement_per_table(test_engine, test_session):
+    """Test de creación de datos de ejemplo con un INSERT multi-fila por tabla"""
+    from services.card_service import CardService
+    from services.transaction_service import TransactionService
+    
+    user = User(username="TEST009", email="test9@example.com", hashed_password="hash", is_active=True)
+    test_session.add(user)
+    test_session.commit()
+    test_session.refresh(user)
+    
+    account = Account(user_id=user.id, account_number="1000000006", first_name="Test", last_name="User")
+    test_session.add(account)
+    test_session.commit()
+    test_session.refresh(account)
+    account_id = account.id
+    user_id = user.id
+    
+    statements = []
+    event.listen(test_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    
+    # Como SessionLocal: sin expirar los objetos tras el commit
+    with Session(test_engine, expire_on_commit=False) as session:
+        cards = CardService().create_sample_cards(session, account_id)
+        transactions = TransactionService().create_sample_transactions(
+            session, [card.id for card in cards], user_id
+        )
+    
+    assert len(statements) == 2
+    assert all(statement.startswith("INSERT") for statement in statements)
+    assert len(cards) == 2
+    assert len(transactions) == 5
+    assert {card.account_id for card in cards} == {account_id}
+    assert {transaction.card_id for transaction in transactions} == {card.id for card in cards}
+    assert {transaction.user_id for transaction in transactions} == {user_id}
+    assert {card.masked_card_number for card in cards} == {"**** **** **** 1234", "**** **** **** 4321"}
+    
+    # Con transacciones ya creadas no se vuelven a generar ejemplos
+    assert TransactionService().has_transactions(test_session, [card.id for card in cards])
+    assert not TransactionService().has_transactions(test_session, [])
+
+
+def test_backfill_masked_card_numbers(test_session):
+    """Test de migración de máscaras para tarjetas existentes"""
+    from services.card_service import CardService
+    
+    card_service = CardService()
+    user = User(username="TEST010", email="test10@example.com", hashed_password="hash", is_active=True)
+    test_session.add(user)
+    test_session.commit()
+    test_session.refresh(user)
+    
+    account = Account(user_id=user.id, account_number="1000000007", first_name="Test", last_name="User")
+    test_session.add(account)
+    test_session.commit()
+    test_session.refresh(account)
+    
+    card = CreditCard(
+        account_id=account.id,
+        card_number=card_service.encryption_service.encrypt_card_number("4111111111111111"),
+        card_type="VISA",
+        expiry_month=12,
+        expiry_year=2025,
+        credit_limit=Decimal("1000.00"),
+        available_credit=Decimal("1000.00")
+    )
+    test_session.add(card)
+    test_session.commit()
+    
+    assert card_service.card_to_response(card).masked_card_number == "**** **** **** 1111"
+    assert card_service.backfill_masked_card_numbers(test_session) == 1
+    test_session.refresh(card)
+    assert card.masked_card_number == "**** **** **** 1111"
+    assert card_service.backfill_masked_card_numbers(test_session) == 0
+
+
+def test_backfill_skips_undecryptable_card_numbers(test_session):
+    """Test de que la migración de máscaras no guarda máscaras de error"""
+    from services.card_service import CardService
+    from services.encryption_service import EncryptionService
+    
+    card_service = CardService()
+    user = User(username="TEST019", email="test19@example.com", hashed_password="hash", is_active=True)
+    test_session.add(user)
+    test_session.commit()
+    test_session.refresh(user)
+    
+    account = Account(user_id=user.id, account_number="1000000019", first_name="Test", last_name="User")
+    test_session.add(account)
+    test_session.commit()
+    test_session.refresh(account)
+    
+    # Una tarjeta cifrada con otra clave (p. ej. tras rotarla) y una legible
+    other_key_card = CreditCard(
+        account_id=account.id,
+        card_number=EncryptionService("clave-anterior-rotada").encrypt_card_number("4111111111111111"),
+        card_type="VISA",
+        expiry_month=12,
+        expiry_year=2025,
+        credit_limit=Decimal("1000.00"),
+        available_credit=Decimal("1000.00")
+    )
+    card = CreditCard(
+        account_id=account.id,
+        card_number=card_service.encryption_service.encrypt_card_number("5555555555554444"),
+        card_type="MASTERCARD",
+        expiry_month=12,
+        expiry_year=2025,
+        credit_limit=Decimal("1000.00"),
+        available_credit=Decimal("1000.00")
+    )
+    test_session.add(other_key_card)
+    test_session.add(card)
+    test_session.commit()
+    
+    assert card_service.backfill_masked_card_numbers(test_session) == 1
+    test_session.refresh(other_key_card)
+    test_session.refresh(card)
+    assert other_key_card.masked_card_number is None
+    assert card.masked_card_number == "**** **** **** 4444"
+    
+    # La tarjeta ilegible se sigue intentando en cada ejecución
+    assert card_service.backfill_masked_card_numbers(test_session) == 0
+    test_session.refresh(other_key_card)
+    assert other_key_card.masked_card_number is None
+
+def test_encrypt_existing_card_numbers_in_bulk(test_engine, test_session):
+    """Test de migración de encriptación con un UPDATE masivo"""
+    from services.card_service import CardService
+    
+    card_service = CardService()
+    user = User(username="TEST016", email="test16@example.com", hashed_password="hash", is_active=True)
+    test_session.add(user)
+    test_session.commit()
+    
+    account = Account(user_id=user.id, account_number="1000000016", first_name="Test", last_name="User")
+    test_session.add(account)
+    test_session.commit()
+    
+    numbers = ["4111111111111111", "5500000000000004"]
+    encrypted = card_service.encryption_service.encrypt_card_number("4000000000000002")
+    for card_number in numbers + [encrypted]:
+        test_session.add(CreditCard(
+            account_id=account.id,
+            card_number=card_number,
+            card_type="VISA",
+            expiry_month=12,
+            expiry_year=2025,
+            credit_limit=Decimal("1000.00"),
+            available_credit=Decimal("1000.00")
+        ))
+    test_session.commit()
+    
+    statements = []
+    event.listen(test_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    assert card_service.encrypt_existing_card_numbers(test_session) == 2
+    
+    # Un SELECT filtrado en SQL y un único UPDATE (executemany)
+    assert [statement.split()[0] for statement in statements] == ["SELECT", "UPDATE"]
+    
+    stored = test_session.exec(select(CreditCard.card_number).order_by(CreditCard.id)).all()
+    assert [card_service.encryption_service.decrypt_card_number(value) for value in stored[:2]] == numbers
+    assert stored[2] == encrypted
+    assert card_service.encrypt_existing_card_numbers(test_session) == 0
+
+
+def test_unwrap_legacy_card_numbers(test_session):
+    """Test de migración de números encriptados con doble base64"""
+    import base64
+    from services.card_service import CardService
+    
+    card_service = CardService()
+    user = User(username="TEST017", email="test17@example.com", hashed_password="hash", is_active=True)
+    test_session.add(user)
+    test_session.commit()
+    
+    account = Account(user_id=user.id, account_number="1000000017", first_name="Test", last_name="User")
+    test_session.add(account)
+    test_session.commit()
+    
+    current = card_service.encryption_service.encrypt_card_number("4111111111111111")
+    legacy = base64.urlsafe_b64encode(
+        card_service.encryption_service._fernet.encrypt(b"5500000000000004")
+    ).decode()
+    for card_number in (current, legacy):
+        test_session.add(CreditCard(
+            account_id=account.id,
+            card_number=card_number,
+            card_type="VISA",
+            expiry_month=12,
+            expiry_year=2025,
+            credit_limit=Decimal("1000.00"),
+            available_credit=Decimal("1000.00")
+        ))
+    test_session.commit()
+    
+    assert card_service.unwrap_legacy_card_numbers(test_session) == 1
+    stored = test_session.exec(select(CreditCard.card_number).order_by(CreditCard.id)).all()
+    assert stored[0] == current
+    assert stored[1].startswith("gAAAAA")  # Token Fernet sin la capa extra
+    assert card_service.encryption_service.decrypt_card_number(stored[1]) == "5500000000000004"
+    assert card_service.unwrap_legacy_card_numbers(test_session) == 0
+
+
+def test_transaction_keyset_pagination(test_session):
+    """Test de paginación por cursor sin saltos ni duplicados"""
+    from models.api_models import TransactionFilters
+    from services.transaction_service import TransactionService, decode_cursor, encode_cursor
+    
+    user = User(username="TEST008", email="test8@example.com", hashed_password="hash", is_active=True)
+    test_session.add(user)
+    test_session.commit()
+    test_session.refresh(user)
+    
+    account = Account(user_id=user.id, account_number="1000000005", first_name="Test", last_name="User")
+    test_session.add(account)
+    test_session.commit()
+    test_session.refresh(account)
+    
+    card = CreditCard(
+        account_id=account.id,
+        card_number="4111111111111111",
+        card_type="VISA",
+        expiry_month=12,
+        expiry_year=2025,
+        credit_limit=Decimal("1000.00"),
+        available_credit=Decimal("1000.00")
+    )
+    test_session.add(card)
+    test_session.commit()
+    test_session.refresh(card)
+    
+    # Fechas repetidas para comprobar el desempate por ID
+    for i in range(7):
+        test_session.add(Transaction(
+            card_id=card.id,
+            transaction_date=datetime(2024, 1, 10 + i // 2, 12, 0),
+            merchant_name=f"Store {i}",
+            amount=Decimal("10.00"),
+            transaction_type="PURCHASE",
+            status="COMPLETED"
+        ))
+    test_session.commit()
+    
+    service = TransactionService()
+    seen = []
+    cursor = None
+    while True:
+        page, total, has_more = service.get_transactions_with_filters(
+            test_session, user.id, TransactionFilters(limit=3, cursor=cursor)
+        )
+        seen.extend(page)
+        if not has_more:
+            break
+        cursor = encode_cursor(page[-1])
+        assert decode_cursor(cursor) == (page[-1].transaction_date, page[-1].id)
+    
+    assert total == 7
+    assert len({t.id for t in seen}) == 7
+    assert seen == sorted(seen, key=lambda t: (t.transaction_date, t.id), reverse=True)
+    
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+    
+    # Sin total se evita el COUNT, pero has_more sigue siendo exacto
+    page, total, has_more = service.get_transactions_with_filters(
+        test_session, user.id, TransactionFilters(limit=7, include_total=False)
+    )
+    assert total is None
+    assert len(page) == 7
+    assert has_more is False
+
+
+def test_transaction_list_json_matches_response_model():
+    """Test de que el listado serializa igual que TransactionResponse"""
+    import orjson
+    from datetime import timezone
+    from routers.transactions import UTCJSONResponse
+    from services.transaction_service import TransactionService
+    
+    transaction_service = TransactionService()
+    # PostgreSQL devuelve fechas con zona horaria (DateTime(timezone=True))
+    transaction = Transaction(
+        id=1,
+        card_id=1,
+        transaction_date=datetime(2024, 1, 15, 14, 30, tzinfo=timezone.utc),
+        merchant_name="Amazon",
+        amount=Decimal("125.50"),
+        transaction_type="PURCHASE",
+        status="COMPLETED",
+        description="Compra online",
+        created_at=datetime(2024, 1, 15, 14, 30, 0, 123456, tzinfo=timezone.utc)
+    )
+    
+    list_item = orjson.loads(UTCJSONResponse(content=transaction_service.transaction_to_dict(transaction)).body)
+    detail = orjson.loads(transaction_service.transaction_to_response(transaction).model_dump_json())
+    assert list_item == detail
+    assert list_item["transaction_date"] == "2024-01-15T14:30:00Z"
+
+def test_account_numbers_are_sequential(test_session):
+    """Test de números de cuenta únicos y deterministas"""
+    from services.account_service import AccountService
+    
+    account_numbers = []
+    for i in range(3):
+        user = User(username=f"SEQ00{i}", email=f"seq{i}@example.com", hashed_password="hash", is_active=True)
+        test_session.add(user)
+        test_session.commit()
+        test_session.refresh(user)
+        account = AccountService().create_account(test_session, user.id, {"first_name": "Test", "last_name": "User"})
+        account_numbers.append(account.account_number)
+    
+    assert account_numbers == sorted(set(account_numbers))
+    assert all(number.startswith("ACC") and len(number) == 12 for number in account_numbers)
+
+
+def test_get_or_create_account_is_idempotent(test_session):
+    """Test de creación de cuenta con ON CONFLICT: una sola cuenta por usuario"""
+    from services.account_service import AccountService
+    
+    account_service = AccountService()
+    user = User(username="TEST011", email="test11@example.com", hashed_password="hash", is_active=True)
+    test_session.add(user)
+    test_session.commit()
+    test_session.refresh(user)
+    
+    account = account_service.get_or_create_account(test_session, user.id)
+    
+    # Una creación concurrente que llega tarde no inserta nada
+    assert account_service._create_account_if_missing(test_session, user.id) is None
+    assert account_service.get_or_create_account(test_session, user.id).id == account.id
+    assert len(test_session.exec(select(Account).where(Account.user_id == user.id)).all()) == 1
+
+
+def test_transaction_user_id_denormalized(test_session):
+    """Test de user_id desnormalizado en transacciones"""
+    from models.api_models import TransactionFilters
+    from services.transaction_service import TransactionService
+    
+    service = TransactionService()
+    user = User(username="TEST012", email="test12@example.com", hashed_password="hash", is_active=True)
+    other = User(username="TEST013", email="test13@example.com", hashed_password="hash", is_active=True)
+    test_session.add_all([user, other])
+    test_session.commit()
+    
+    account = Account(user_id=user.id, account_number="1000000012", first_name="Test", last_name="User")
+    test_session.add(account)
+    test_session.commit()
+    
+    card = CreditCard(
+        account_id=account.id,
+        card_number="4111111111111111",
+        card_type="VISA",
+        expiry_month=12,
+        expiry_year=2025,
+        credit_limit=Decimal("1000.00"),
+        available_credit=Decimal("1000.00")
+    )
+    test_session.add(card)
+    test_session.commit()
+    
+    # Alta por el ORM: el propietario se completa al hacer flush
+    transaction = Transaction(
+        card_id=card.id,
+        transaction_date=datetime(2024, 1, 10, 12, 0),
+        merchant_name="Store",
+        amount=Decimal("10.00"),
+        transaction_type="PURCHASE",
+        status="COMPLETED"
+    )
+    test_session.add(transaction)
+    test_session.commit()
+    assert transaction.user_id == user.id
+    
+    # Alta masiva: el INSERT incluye el propietario
+    samples = service.create_sample_transactions(test_session, [card.id])
+    assert {t.user_id for t in samples} == {user.id}
+    
+    # Filas anteriores a la columna se completan con el backfill
+    transaction.user_id = None
+    test_session.commit()
+    assert service.backfill_transaction_user_ids(test_session) == 1
+    test_session.refresh(transaction)
+    assert transaction.user_id == user.id
+    
+    # Aislamiento por usuario, también filtrando por una tarjeta ajena
+    page, total, _ = service.get_transactions_with_filters(test_session, user.id, TransactionFilters())
+    assert total == len(samples) + 1
+    page, total, _ = service.get_transactions_with_filters(
+        test_session, other.id, TransactionFilters(card_id=card.id)
+    )
+    assert page == [] and total == 0
+    assert service.get_transaction_by_id(test_session, transaction.id, other.id) is None
+    assert service.get_transaction_by_id(test_session, transaction.id, user.id).id == transaction.id
+
+
+def test_get_by_id_uses_identity_map(test_engine, test_session):
+    """Test de carga por clave primaria sin SQL si el objeto ya está en la sesión"""
+    from services.card_service import CardService
+    
+    user = User(username="TEST014", email="test14@example.com", hashed_password="hash", is_active=True)
+    test_session.add(user)
+    test_session.commit()
+    
+    account = Account(user_id=user.id, account_number="1000000014", first_name="Test", last_name="User")
+    test_session.add(account)
+    test_session.commit()
+    
+    account_id = account.id
+    card = CardService().create_sample_cards(test_session, account_id)[0]
+    test_session.refresh(card)
+    
+    statements = []
+    event.listen(test_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    
+    assert CardService().get_card_by_id(test_session, card.id, account_id) is card
+    assert CardService().get_card_by_id(test_session, card.id, account_id + 1) is None
+    assert statements == []
+    
+    # Cargada desde la BD: solo la tabla de tarjetas, sin JOIN a cuentas ni usuarios
+    card_id = card.id
+    test_session.expunge_all()
+    assert CardService().get_card_by_id(test_session, card_id, account_id).id == card_id
+    assert len(statements) == 1
+    assert "JOIN" not in statements[0]
+
+
+def test_cached_lookups_bind_parameters(test_session):
+    """Test de consultas lambda_stmt: la sentencia se reutiliza con cada valor"""
+    from services.account_service import AccountService
+    
+    account_service = AccountService()
+    accounts = []
+    for i in range(2):
+        user = User(username=f"LMB00{i}", email=f"lmb{i}@example.com", hashed_password="hash", is_active=True)
+        test_session.add(user)
+        test_session.commit()
+        accounts.append(account_service.get_or_create_account(test_session, user.id))
+    
+    for account in accounts:
+        assert account_service.get_account_by_user_id(test_session, account.user_id).id == account.id
+        assert account_service.get_account_by_user_id(test_session, account.user_id, eager_cards=True).id == account.id
+    assert account_service.get_account_by_user_id(test_session, -1) is None
+
+
+def test_user_cards_in_one_query(test_engine, test_session):
+    """Test de cuenta y tarjetas del usuario en una sola consulta"""
+    from services.card_service import CardService
+    
+    card_service = CardService()
+    user = User(username="TEST015", email="test15@example.com", hashed_password="hash", is_active=True)
+    test_session.add(user)
+    test_session.commit()
+    
+    # Sin cuenta
+    assert card_service.get_user_cards(test_session, user.id) == (None, [])
+    
+    account = Account(user_id=user.id, account_number="1000000015", first_name="Test", last_name="User")
+    test_session.add(account)
+    test_session.commit()
+    
+    # Cuenta sin tarjetas
+    assert card_service.get_user_cards(test_session, user.id) == (account.id, [])
+    
+    cards = card_service.create_sample_cards(test_session, account.id)
+    user_id, expected_account_id = user.id, account.id
+    
+    statements = []
+    event.listen(test_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    account_id, rows = card_service.get_user_cards(test_session, user_id)
+    
+    assert len(statements) == 1
+    assert account_id == expected_account_id
+    assert [row.id for row in rows] == sorted(card.id for card in cards)
+    assert [card_service.card_to_response(row) for row in rows] == [
+        card_service.card_to_response(card) for card in sorted(cards, key=lambda card: card.id)
+    ]
+
+
+def test_user_cards_skip_ciphertext_when_masked(test_session):
+    """Test de listado sin leer el número encriptado de tarjetas ya enmascaradas"""
+    from services.card_service import CardService
+    
+    card_service = CardService()
+    user = User(username="TEST018", email="test18@example.com", hashed_password="hash", is_active=True)
+    test_session.add(user)
+    test_session.commit()
+    
+    account = Account(user_id=user.id, account_number="1000000018", first_name="Test", last_name="User")
+    test_session.add(account)
+    test_session.commit()
+    
+    card_service.create_sample_cards(test_session, account.id)
+    legacy = CreditCard(
+        account_id=account.id,
+        card_number=card_service.encryption_service.encrypt_card_number("4000000000000002"),
+        card_type="VISA",
+        expiry_month=12,
+        expiry_year=2025,
+        credit_limit=Decimal("1000.00"),
+        available_credit=Decimal("1000.00")
+    )
+    test_session.add(legacy)
+    test_session.commit()
+    
+    _, rows = card_service.get_user_cards(test_session, user.id)
+    assert [row.card_number is None for row in rows] == [True, True, False]
+    assert [card_service.card_to_response(row).masked_card_number for row in rows] == [
+        "**** **** **** 1234", "**** **** **** 4321", "**** **** **** 0002"
+    ]
+
+
 def test_database_rollback_on_error(test_session):
     """Test de rollback en caso de error"""
     # Crear usuario válido
@@ -197,13 +749,20 @@ def test_model_timestamps(test_session):
     """Test de timestamps automáticos"""
     user = User(username="TEST006", email="test6@example.com", hashed_password="hash", is_active=True)
     
-    # Verificar que created_at se establece automáticamente
-    assert user.created_at is not None
-    assert isinstance(user.created_at, datetime)
+    # created_at lo asigna la base de datos al insertar
+    assert user.created_at is None
     
     test_session.add(user)
     test_session.commit()
     test_session.refresh(user)
     
     # Verificar que persiste en la base de datos
-    assert user.created_at is not None
\ No newline at end of file
+    assert isinstance(user.created_at, datetime)
+    assert user.updated_at is None
+    
+    # updated_at se asigna en cada UPDATE
+    user.email = "test6b@example.com"
+    test_session.commit()
+    test_session.refresh(user)
+    assert user.updated_at is not None
+    assert user.updated_at >= user.created_at
\ No newline at end of file
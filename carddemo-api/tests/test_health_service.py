@@ -101,6 +101,27 @@ class TestHealthService:
             assert result["status"] == "connected"
             mock_db_check.assert_called_once()
     
+    @patch('services.health_service.check_database_health')
+    def test_database_check_cached(self, mock_check):
+        """Test de reutilización de la comprobación de BD durante el TTL"""
+        service = HealthService()
+        mock_check.return_value = {"status": "healthy"}
+        
+        assert service._check_database_health()["status"] == "healthy"
+        assert service.check_component_health("database")["status"] == "healthy"
+        assert mock_check.call_count == 1
+        
+        # Tras invalidar (p. ej. ?force=1) se vuelve a comprobar
+        service.invalidate_cache()
+        service._check_database_health()
+        assert mock_check.call_count == 2
+        
+        # Con TTL 0 cada llamada comprueba la base de datos
+        service.database_check_ttl = 0
+        service._check_database_health()
+        service._check_database_health()
+        assert mock_check.call_count == 4
+    
     def test_check_component_health_api(self):
         """Test para verificación de salud del componente api"""
         service = HealthService()
@@ -4,7 +4,7 @@ Tests de propiedades para características de seguridad avanzadas
 import pytest
 import time
 from hypothesis import given, strategies as st, settings
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
 
@@ -12,6 +12,9 @@ from services.encryption_service import EncryptionService
 from middleware.rate_limit import RateLimitMiddleware
 from middleware.input_sanitizer import InputSanitizerMiddleware
 
+# Los timestamps del rate limiting son nanosegundos de time.monotonic_ns()
+NS = 1_000_000_000
+
 
 class TestSecurityProperties:
     """Tests de propiedades para seguridad avanzada"""
@@ -55,6 +58,59 @@ class TestSecurityProperties:
             for digit in last_digits:
                 assert digit in masked, f"El dígito {digit} debe estar visible en el número enmascarado"
     
+    def test_property_25_card_number_mask_format(self):
+        """
+        **Propiedad 25: Formato del enmascaramiento**
+        **Valida: Requisitos 8.1**
+        
+        El caso habitual de 16 dígitos y los demás largos comparten formato.
+        """
+        encryption_service = EncryptionService()
+        
+        assert encryption_service.mask_card_number("4111111111111234") == "**** **** **** 1234"
+        assert encryption_service.mask_card_number("4111-1111-1111-1234") == "**** **** **** 1234"
+        assert encryption_service.mask_card_number("378282246310005") == "**** **** ***0 005"
+        assert encryption_service.mask_card_number("6011000990139424123") == "**** **** **** ***4 123"
+        assert encryption_service.mask_card_number("1234") == "1234"
+        assert encryption_service.mask_card_number("12") == "**"
+    
+    def test_property_25_masking_decrypts_once(self, monkeypatch):
+        """
+        **Propiedad 25: Enmascaramiento sin desencriptar en cada respuesta**
+        **Valida: Requisitos 8.1**
+        
+        Solo se cachea la máscara de cada texto cifrado, nunca el número.
+        """
+        encryption_service = EncryptionService()
+        encrypted = encryption_service.encrypt_card_number("4111111111111234")
+        
+        calls = []
+        decrypt = encryption_service.decrypt_card_number
+        monkeypatch.setattr(encryption_service, "decrypt_card_number", lambda value: calls.append(value) or decrypt(value))
+        
+        assert encryption_service.mask_card_number(encrypted) == "**** **** **** 1234"
+        assert encryption_service.mask_card_number(encrypted) == "**** **** **** 1234"
+        assert len(calls) == 1
+        
+        # Un texto cifrado inválido no se cachea
+        assert encryption_service.mask_card_number("x" * 40) == "**** **** **** ****"
+        assert encryption_service.mask_card_number("x" * 40) == "**** **** **** ****"
+        assert len(calls) == 3
+    
+    def test_property_25_key_derivation_memoized(self):
+        """
+        **Propiedad 25: Derivación de clave una vez por contraseña**
+        **Valida: Requisitos 8.1**
+        """
+        key = "clave-de-prueba-derivacion"
+        first = EncryptionService(key)
+        
+        with patch("services.encryption_service.PBKDF2HMAC") as kdf:
+            second = EncryptionService(key)
+        
+        kdf.assert_not_called()
+        assert second.decrypt(first.encrypt("dato")) == "dato"
+    
     @given(
         plaintext_data=st.lists(
             st.text(min_size=1, max_size=100),
@@ -95,6 +151,51 @@ class TestSecurityProperties:
             decrypted2 = encryption_service.decrypt(encrypted2)
             assert decrypted2 == data, "Ambas encriptaciones deben desencriptar al mismo valor"
     
+    def test_property_25_legacy_fernet_tokens_readable(self):
+        """
+        **Propiedad 25: Lectura de los formatos de encriptación anteriores**
+        **Valida: Requisitos 8.1**
+        
+        Los tokens nuevos son AES-GCM versionados; los Fernet anteriores (con
+        o sin doble base64) se siguen leyendo.
+        """
+        import base64
+        from services.encryption_service import unwrap_legacy_token
+        
+        encryption_service = EncryptionService()
+        encrypted = encryption_service.encrypt("4111111111111234")
+        fernet_token = encryption_service._fernet.encrypt(b"4111111111111234").decode()
+        legacy = base64.urlsafe_b64encode(fernet_token.encode()).decode()
+        
+        assert base64.urlsafe_b64decode(encrypted)[:1] == b"\x01"
+        assert len(encrypted) < len(fernet_token) < len(legacy)
+        assert unwrap_legacy_token(legacy) == fernet_token
+        assert unwrap_legacy_token(fernet_token) == fernet_token
+        assert unwrap_legacy_token(encrypted) == encrypted
+        for token in (encrypted, fernet_token, legacy):
+            assert encryption_service.decrypt(token) == "4111111111111234"
+            assert encryption_service.mask_card_number(token) == "**** **** **** 1234"
+    
+    def test_property_25_aesgcm_tokens_authenticated(self):
+        """
+        **Propiedad 25: Tokens AES-GCM autenticados**
+        **Valida: Requisitos 8.1**
+        
+        Un token alterado o de otra clave no se desencripta.
+        """
+        import base64
+        
+        encryption_service = EncryptionService("clave-a")
+        encrypted = encryption_service.encrypt("dato")
+        raw = bytearray(base64.urlsafe_b64decode(encrypted))
+        raw[-1] ^= 1
+        tampered = base64.urlsafe_b64encode(bytes(raw)).decode()
+        
+        with pytest.raises(ValueError):
+            encryption_service.decrypt(tampered)
+        with pytest.raises(ValueError):
+            EncryptionService("clave-b").decrypt(encrypted)
+    
     def test_property_26_rate_limiting_enforcement(self):
         """
         **Propiedad 26: Rate limiting para prevención de abuso**
@@ -168,6 +269,175 @@ class TestSecurityProperties:
         response3 = client.get("/test", headers=ip2_headers)
         assert response3.status_code == 200, "Diferentes IPs deben tener límites independientes"
     
+    def test_property_26_token_bucket_refill(self):
+        """
+        **Propiedad 26: Recarga de tokens con el tiempo**
+        **Valida: Requisitos 8.3**
+        
+        Tras agotar la ráfaga, el cliente recupera capacidad al pasar el tiempo.
+        """
+        middleware = RateLimitMiddleware(None, calls_per_minute=60, burst_limit=2)
+        
+        for _ in range(2):
+            assert not middleware._is_rate_limited("10.0.0.1", "/test", 1000 * NS)
+            middleware._record_request("10.0.0.1", 1000 * NS)
+        
+        assert middleware._is_rate_limited("10.0.0.1", "/test", 1000 * NS), "Ráfaga agotada debe limitar"
+        # 2 tokens cada 10 segundos: en 5 segundos se recupera uno
+        assert not middleware._is_rate_limited("10.0.0.1", "/test", 1005 * NS), "Los tokens deben recargarse"
+    
+    def test_property_26_approximate_sliding_window(self):
+        """
+        **Propiedad 26: Ventana deslizante aproximada**
+        **Valida: Requisitos 8.3**
+        
+        Los requests del minuto anterior cuentan en proporción al solapamiento
+        con la ventana deslizante actual.
+        """
+        middleware = RateLimitMiddleware(None, calls_per_minute=4, burst_limit=100)
+        
+        for _ in range(4):
+            assert not middleware._is_rate_limited("10.0.0.1", "/test", 1200 * NS)
+            middleware._record_request("10.0.0.1", 1200 * NS)
+        
+        assert middleware._is_rate_limited("10.0.0.1", "/test", 1259 * NS), "Límite por minuto alcanzado"
+        # A mitad del minuto siguiente los 4 requests anteriores pesan 2
+        assert not middleware._is_rate_limited("10.0.0.1", "/test", 1290 * NS)
+        # Dos minutos después la ventana anterior ya no se solapa
+        state = middleware._update_state("10.0.0.1", 1330 * NS)
+        assert middleware._window_count(state, 2, 60 * NS, 1330 * NS) == 0
+    
+    @pytest.mark.parametrize("strict", [False, True])
+    def test_property_26_inactive_ip_cleanup(self, strict):
+        """
+        **Propiedad 26: Limpieza del estado de IPs inactivas**
+        **Valida: Requisitos 8.3**
+        
+        El estado de una IP se libera tras su inactividad, pero no mientras
+        siga haciendo requests.
+        """
+        middleware = RateLimitMiddleware(None, calls_per_minute=60, strict=strict)
+        retention = middleware._retention
+        
+        for ip in ("10.0.0.1", "10.0.0.2"):
+            assert not middleware._is_rate_limited(ip, "/test", 1000 * NS)
+            middleware._record_request(ip, 1000 * NS)
+        
+        # La IP 2 sigue activa a mitad del periodo de retención
+        assert not middleware._is_rate_limited("10.0.0.2", "/test", 1000 * NS + retention // 2)
+        middleware._record_request("10.0.0.2", 1000 * NS + retention // 2)
+        
+        middleware._cleanup_old_requests(1000 * NS + retention)
+        
+        tracked = middleware.hour_requests if strict else middleware.buckets
+        assert "10.0.0.1" not in tracked, "El estado de la IP inactiva debe eliminarse"
+        assert "10.0.0.2" in tracked, "El estado de la IP activa debe conservarse"
+        assert len(middleware._expirations) == 1
+    
+    def test_property_26_rate_limiting_strict_mode(self):
+        """
+        **Propiedad 26: Rate limiting con ventanas deslizantes exactas**
+        **Valida: Requisitos 8.3**
+        
+        El modo estricto debe aplicar los mismos límites que el modo por defecto.
+        """
+        test_app = FastAPI()
+        test_app.add_middleware(RateLimitMiddleware, calls_per_minute=3, burst_limit=2, strict=True)
+        
+        @test_app.get("/test")
+        async def test_endpoint():
+            return {"message": "success"}
+        
+        client = TestClient(test_app)
+        
+        statuses = [client.get("/test").status_code for _ in range(3)]
+        assert statuses == [200, 200, 429], "Debe limitar tras agotar la ráfaga"
+    
+    @given(
+        operations=st.lists(
+            st.tuples(st.booleans(), st.integers(min_value=0, max_value=5)),
+            max_size=40
+        ),
+        capacity=st.integers(min_value=1, max_value=5)
+    )
+    @settings(max_examples=50)
+    def test_property_26_strict_window_ring_buffer(self, operations, capacity):
+        """
+        **Propiedad 26: Buffer circular de la ventana estricta**
+        **Valida: Requisitos 8.3**
+        
+        El buffer debe conservar los últimos ``capacity`` timestamps vigentes,
+        igual que una lista con expiración explícita.
+        """
+        from middleware.rate_limit import _TimestampRing
+        
+        ring = _TimestampRing(capacity)
+        expected = []
+        now = 0
+        
+        for is_append, delta in operations:
+            now += delta
+            if is_append:
+                ring.append(now)
+                expected = (expected + [now])[-capacity:]
+            else:
+                ring.expire(now - 10)
+                expected = [ts for ts in expected if ts >= now - 10]
+            
+            assert len(ring) == len(expected)
+            assert ring.last() == (expected[-1] if expected else None)
+    
+    def test_property_26_rate_limiting_shared_counters(self):
+        """
+        **Propiedad 26: Rate limiting con contadores compartidos**
+        **Valida: Requisitos 8.3**
+        
+        Con Redis los límites se aplican sobre los contadores compartidos y,
+        si Redis falla, se recurre a los contadores locales.
+        """
+        counters = {}
+        
+        async def fake_script(keys, args):
+            for key in keys:
+                counters[key] = counters.get(key, 0) + 1
+            return [counters[key] for key in keys]
+        
+        async def failing_script(keys, args):
+            raise ConnectionError("Redis caído")
+        
+        test_app = FastAPI()
+        test_app.add_middleware(RateLimitMiddleware, calls_per_minute=10, burst_limit=2)
+        
+        @test_app.get("/test")
+        async def test_endpoint():
+            return {"message": "success"}
+        
+        client = TestClient(test_app)
+        client.get("/test")  # Construir la pila de middlewares
+        
+        middleware = test_app.middleware_stack.app
+        while not isinstance(middleware, RateLimitMiddleware):
+            middleware = middleware.app
+        
+        middleware._redis_script = fake_script
+        statuses = [client.get("/test").status_code for _ in range(3)]
+        assert statuses == [200, 200, 429], "Debe limitar con los contadores compartidos"
+        
+        middleware._redis_script = failing_script
+        response = client.get("/test", headers={"X-Forwarded-For": "10.0.0.9"})
+        assert response.status_code == 200, "Sin Redis debe usar los contadores locales"
+        
+        # Tras el fallo no se vuelve a esperar a Redis hasta que pasa el back-off
+        middleware._redis_script = fake_script
+        counters.clear()
+        client.get("/test", headers={"X-Forwarded-For": "10.0.0.10"})
+        assert not counters, "Durante el back-off no se debe consultar Redis"
+        
+        middleware._redis_retry_at = time.monotonic() - 1
+        client.get("/test", headers={"X-Forwarded-For": "10.0.0.10"})
+        assert counters, "Pasado el back-off se debe volver a usar Redis"
+        assert middleware._redis_retry_at == 0.0
+    
     @given(
         malicious_inputs=st.lists(
             st.one_of(
@@ -262,6 +532,143 @@ class TestSecurityProperties:
         
         check_sanitized(sanitized)
     
+    @given(
+        inputs=st.lists(
+            st.lists(
+                st.sampled_from(['<script', '--', '-', '&', ' ', 'a', 'OR 1=1', '\x00', '>', "'"]),
+                max_size=6
+            ).map(''.join),
+            max_size=6
+        )
+    )
+    @settings(max_examples=50)
+    def test_property_28_batch_sanitization_equivalence(self, inputs):
+        """
+        **Propiedad 28: Sanitización en lote**
+        **Valida: Requisitos 8.5**
+        
+        Sanitizar en lote debe dar el mismo resultado que sanitizar cada string.
+        """
+        encryption_service = EncryptionService()
+        
+        expected = [encryption_service.sanitize_input(item) for item in inputs]
+        assert encryption_service.sanitize_batch(inputs) == expected
+    
+    def test_property_28_sanitization_single_pass(self):
+        """
+        **Propiedad 28: Sanitización en una pasada**
+        **Valida: Requisitos 8.5**
+        
+        Los patrones se eliminan sin distinguir mayúsculas (también los que
+        se forman al eliminar otro) y cada carácter se escapa una sola vez.
+        """
+        encryption_service = EncryptionService()
+        
+        assert encryption_service.sanitize_input("a DrOp TaBlE b") == "a  b"
+        assert "drop table" not in encryption_service.sanitize_input("DROP TA--BLE").lower()
+        assert encryption_service.sanitize_input('<b>"Tom" & \'Jerry\'</b>') == (
+            "&lt;b&gt;&quot;Tom&quot; &amp; &#x27;Jerry&#x27;&lt;/b&gt;"
+        )
+    
+    def test_property_28_sanitization_change_tracking(self):
+        """
+        **Propiedad 28: Detección de cambios en la sanitización**
+        **Valida: Requisitos 8.5**
+        
+        Solo se debe reportar cambio cuando algún string fue modificado.
+        """
+        middleware = InputSanitizerMiddleware(None)
+        
+        clean = {"name": "John", "tags": ["a", "b"], "age": 30, "active": True, "extra": None}
+        sanitized, changed = middleware._sanitize_with_changes(clean)
+        assert sanitized == clean
+        assert not changed, "Datos limpios no deben marcarse como modificados"
+        
+        dirty = {"name": "John", "tags": ["a", "<script>alert(1)</script>"]}
+        sanitized, changed = middleware._sanitize_with_changes(dirty)
+        assert changed, "Datos con contenido peligroso deben marcarse como modificados"
+        assert '<script' not in sanitized["tags"][1].lower()
+    
+    def test_property_28_deeply_nested_sanitization(self):
+        """
+        **Propiedad 28: Sanitización de estructuras muy anidadas**
+        **Valida: Requisitos 8.5**
+        
+        El recorrido no debe depender del límite de recursión de Python.
+        """
+        import sys
+        
+        middleware = InputSanitizerMiddleware(None)
+        depth = sys.getrecursionlimit() * 2
+        
+        data = current = {}
+        for _ in range(depth):
+            current["child"] = current = {}
+        current["value"] = "<script>alert(1)</script>"
+        
+        sanitized, changed = middleware._sanitize_with_changes(data)
+        assert changed
+        
+        for _ in range(depth):
+            sanitized = sanitized["child"]
+        assert '<script' not in sanitized["value"].lower()
+    
+    @pytest.mark.parametrize("size", [100, 100 * 1024])
+    def test_property_28_body_sanitization_by_size(self, size):
+        """
+        **Propiedad 28: Sanitización independiente del tamaño del body**
+        **Valida: Requisitos 8.5**
+        
+        Bodies pequeños y grandes (leídos por stream) deben llegar al
+        handler sanitizados, y los limpios deben llegar intactos.
+        """
+        test_app = FastAPI()
+        test_app.add_middleware(InputSanitizerMiddleware)
+        
+        @test_app.post("/echo")
+        async def echo(payload: dict):
+            return payload
+        
+        client = TestClient(test_app)
+        
+        clean = {"data": "x" * size}
+        response = client.post("/echo", json=clean)
+        assert response.status_code == 200
+        assert response.json() == clean
+        
+        dirty = {"data": "x" * size, "note": "<script>alert(1)</script>"}
+        response = client.post("/echo", json=dirty)
+        assert response.status_code == 200
+        assert '<script' not in response.json()["note"].lower()
+        assert response.json()["data"] == dirty["data"]
+    
+    def test_property_28_non_json_body_passthrough(self):
+        """
+        **Propiedad 28: Bodies no JSON no se procesan**
+        **Valida: Requisitos 8.5**
+        
+        Solo se sanitizan bodies con Content-Type JSON; el resto llega
+        al handler sin leerse ni modificarse en el middleware.
+        """
+        test_app = FastAPI()
+        test_app.add_middleware(InputSanitizerMiddleware)
+        
+        @test_app.post("/raw")
+        async def raw(request: Request):
+            return {"body": (await request.body()).decode()}
+        
+        client = TestClient(test_app)
+        payload = '{"note": "<script>alert(1)</script>"}'
+        
+        with patch.object(InputSanitizerMiddleware, "_read_body") as read_body:
+            response = client.post("/raw", content=payload, headers={"Content-Type": "text/plain"})
+            assert response.status_code == 200
+            assert response.json()["body"] == payload
+            read_body.assert_not_called()
+        
+        response = client.post("/raw", content=payload, headers={"Content-Type": "application/json"})
+        assert '<script' not in response.json()["body"].lower()
+    
     def test_property_encryption_key_security(self):
         """
         **Propiedad 25: Seguridad de claves de encriptación**